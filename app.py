@@ -1,13 +1,11 @@
-"""
-The script to be executed using flask as the development server
-"""
-
-from flask_migrate import Migrate
-from app.config import db, connex_app
-
-migrate = Migrate(connex_app.app, db)
-
-connex_app.add_api("swagger.yml")
-
-if __name__ == "__main__":
+"""
+The script to be executed using flask as the development server
+"""
+
+from flask_migrate import Migrate
+from app.config import db, connex_app
+
+migrate = Migrate(connex_app.app, db)
+
+if __name__ == "__main__":
     connex_app.run(debug=True)
\ No newline at end of file
@@ -1,74 +1,131 @@
-""""
-The main app module.
-
-This is where the main flask/connexion instance can be retrieved through a function.
-
-A function for the creation of the ORM database is also here.
-"""
-
-import connexion
-from sqlalchemy.schema import CreateSchema
-from sqlalchemy import create_engine
-from sqlalchemy_utils import database_exists, create_database
-import os
-import shutil
-
-MOD_PATH = os.path.join(os.path.dirname(__file__))
-
-DB_PORT = os.environ['DB_PORT']
-DB_TYPE = os.environ['DB_TYPE']
-DB_USER = os.environ['DB_USER']
-DB_HOST = os.environ['DB_HOST']
-DB_PASSWORD = os.environ['DB_PASSWORD']
-DB_NAME = os.environ['DB_NAME']
-
-ROOT_DIR = os.environ['ROOT_DIR']
-LOG_DIR = os.environ['LOG_DIR']
-DATA_DIR = os.environ['DATA_DIR']
-
-DB_URI = f"{DB_TYPE}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-DB_SCHEMAS = ["filemetadata"]
-
-
-def create_app():
-    """
-    The function to call in order to get the flask/connexion object.
-    it will also specify some of the flask-sqlalchemy configurations.
-    """
-
-    connex = connexion.FlaskApp(__name__, specification_dir="./")
-    connex.app.config['SQLALCHEMY_DATABASE_URI'] = DB_URI
-    connex.app.config["SQLALCHEMY_ECHO"] = False
-    connex.app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-    return connex
-
-
-def create_db():
-    """
-    This will create the database, table, and schema.
-
-    return -- The database engine connection from sqlalchemy
-    """
-
-    if database_exists(DB_URI):
-        engine = create_engine(DB_URI)
-        conn = engine.connect()
-        for schema in DB_SCHEMAS:
-            if not conn.dialect.has_schema(conn, schema=schema):
-                engine.execute(CreateSchema(schema))
-        conn.close()
-
-        return engine
-
-    else:
-        create_database(DB_URI)
-        engine = create_engine(DB_URI)
-        conn = engine.connect()
-        for schema in DB_SCHEMAS:
-            if not conn.dialect.has_schema(conn, schema=schema):
-                engine.execute(CreateSchema(schema))
-        conn.close()
-
-        return engine
+""""
+The main app module.
+
+This is where the main flask/connexion instance can be retrieved through a function.
+
+A function for the creation of the ORM database is also here.
+
+Nothing is connected nor read from the DB env variables at import, they are read when an application
+is created, and the parsed API specification is cached so that a new process only decodes its JSON.
+"""
+
+import hashlib
+import json
+import tempfile
+
+import connexion
+import yaml
+from sqlalchemy.schema import CreateSchema
+from sqlalchemy import create_engine
+import os
+import os.path as op
+import shutil
+from app.pool import engine_options
+from app import admission, metrics
+
+MOD_PATH = os.path.join(os.path.dirname(__file__))
+
+ROOT_DIR = os.environ['ROOT_DIR']
+LOG_DIR = os.environ['LOG_DIR']
+DATA_DIR = os.environ['DATA_DIR']
+
+DB_SCHEMAS = ["filemetadata"]
+
+SPEC_CACHE_DIR = os.environ.get('SPEC_CACHE_DIR', tempfile.gettempdir())
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def database_uri(environ=os.environ):
+    """
+    Argument:
+        environ -- The environment variables
+
+    return -- The URI of the database configured by the DB env variables
+    """
+
+    return (f"{environ['DB_TYPE']}://{environ['DB_USER']}:{environ['DB_PASSWORD']}"
+            f"@{environ['DB_HOST']}:{environ['DB_PORT']}/{environ['DB_NAME']}")
+
+
+def load_spec(name="swagger.yml", cache_dir=SPEC_CACHE_DIR):
+    """
+    Parses an API specification of the app directory, with the C YAML parser when PyYAML has one.
+    The parsed specification is cached as JSON in the cache directory under the sha1 of its source,
+    so an edited specification is parsed again and the next processes only decode the JSON.
+
+    Arguments:
+        name -- The file name of the specification
+        cache_dir -- The directory of the cached specifications, nothing is cached if None
+
+    return -- The specification as a dict, for connexion add_api
+    """
+
+    with open(os.path.join(MOD_PATH, name), "rb") as file:
+        source = file.read()
+
+    cache_path = cache_dir and os.path.join(cache_dir, f"{name}.{hashlib.sha1(source).hexdigest()}.json")
+
+    if cache_path and op.exists(cache_path):
+        with open(cache_path) as cached:
+            return json.load(cached)
+
+    # The YAML integer keys, such as the response codes, become strings as they would through the cache
+    spec = json.dumps(yaml.load(source, Loader=YAML_LOADER))
+
+    # A cache that cannot be written, such as on a read-only file system, is only skipped
+    if cache_path:
+        try:
+            with tempfile.NamedTemporaryFile("w", dir=cache_dir, prefix=".spec-", delete=False) as file:
+                file.write(spec)
+            os.replace(file.name, cache_path)
+        except OSError:
+            pass
+
+    return json.loads(spec)
+
+
+def create_app():
+    """
+    The function to call in order to get the flask/connexion object.
+    it will also specify some of the flask-sqlalchemy configurations,
+    with the connection pool configured by the DB_POOL_* env variables.
+    Every request is counted and timed for GET /metrics, and the uploads go through the admission control.
+    """
+
+    connex = connexion.FlaskApp(__name__, specification_dir="./")
+    connex.app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    connex.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
+    connex.app.config["SQLALCHEMY_ECHO"] = False
+    connex.app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    metrics.init_app(connex.app)
+    admission.init_app(connex.app)
+
+    return connex
+
+
+def create_db():
+    """
+    This will create the database, table, and schema.
+    The engine is disposed afterwards, so that it keeps no connection open.
+
+    return -- The database engine from sqlalchemy
+    """
+
+    # sqlalchemy_utils is slow to import and only needed here
+    from sqlalchemy_utils import database_exists, create_database
+
+    db_uri = database_uri()
+
+    if not database_exists(db_uri):
+        create_database(db_uri)
+
+    engine = create_engine(db_uri)
+
+    with engine.connect() as conn:
+        for schema in DB_SCHEMAS:
+            if not conn.dialect.has_schema(conn, schema=schema):
+                conn.execute(CreateSchema(schema))
+
+    engine.dispose()
+
+    return engine
@@ -0,0 +1,313 @@
+"""
+The admission control of the uploads.
+
+An upload is admitted before its body is read, or shed at once with a problem response and a Retry-After
+header, so that a burst of large uploads turns into quick rejections instead of filling the disks and
+starving the database pool:
+
+    411 -- It has no Content-Length while UPLOAD_MAX_BODY_SIZE is set, its size would only be known once read
+    413 -- Its Content-Length is over UPLOAD_MAX_BODY_SIZE
+    503 -- It would leave less than UPLOAD_MIN_FREE_BYTES free in DATA_DIR or in the temp dir, where the
+           multipart parts are spooled while they are parsed
+    429 -- UPLOAD_MAX_CONCURRENT uploads are already running in the worker, or UPLOAD_MAX_NODE_CONCURRENT
+           in all the processes of the node
+
+An upload waits up to UPLOAD_QUEUE_TIMEOUT seconds for a slot of its worker before it is shed, the uploads
+running and waiting are reported with the rejection counters. The slots of the node are lock files under
+UPLOAD_SLOTS_DIR, held with flock by the processes running an upload, so the kernel frees the slots of a
+process that died.
+
+The session completions read no body, but assemble a whole file on the disk, they are admitted like the uploads.
+"""
+
+import contextvars
+import fcntl
+import http
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from collections import Counter
+
+from flask import Response, g, request
+
+UPLOAD_OPERATIONS = ("upload_file", "upload_batch", "upload_chunk", "complete_session")
+BODYLESS_OPERATIONS = ("complete_session",)
+MAX_CONCURRENT = 32
+MIN_FREE_BYTES = 1073741824
+RETRY_AFTER = 5
+
+# Set by the asynchronous server around the uploads it admitted before delegating them to the Flask application
+ADMITTED = contextvars.ContextVar("admitted", default=False)
+
+
+class Rejected(Exception):
+
+    def __init__(self, status, reason, detail, retry_after=None):
+        """
+        An upload shed by the admission control
+
+        Arguments:
+            status -- The HTTP status code of the response
+            reason -- The counter of the rejection: size, disk, worker or node
+            detail -- The error message
+            retry_after -- The seconds after which the client may retry, None if it should not
+        """
+
+        super().__init__(detail)
+        self.status = status
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def problem(self):
+        """
+        return -- The body of the response, in the problem format of connexion
+        """
+
+        return {"detail": self.detail, "status": self.status, "title": http.HTTPStatus(self.status).phrase,
+                "type": "about:blank"}
+
+    def headers(self):
+        return {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+
+
+class NodeSlots:
+
+    def __init__(self, directory, size):
+        """
+        The upload slots shared by the processes of a node, as lock files
+
+        Arguments:
+            directory -- The directory of the lock files, created on first use
+            size -- The number of slots
+        """
+
+        self.directory = directory
+        self.size = size
+
+    def acquire(self):
+        """
+        return -- The file descriptor holding a free slot, None if every slot is held
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        start = random.randrange(self.size)
+
+        # Starting from a random slot spreads the processes over the lock files
+        for index in range(start, start + self.size):
+            fd = os.open(os.path.join(self.directory, f"slot.{index % self.size}"), os.O_RDWR | os.O_CREAT, 0o666)
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+
+        return None
+
+    @staticmethod
+    def release(fd):
+        os.close(fd)
+
+
+class Admission:
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_node_concurrent=0, max_body_size=0,
+                 min_free_bytes=MIN_FREE_BYTES, paths=(), slots_dir=None, queue_timeout=0, retry_after=RETRY_AFTER):
+        """
+        The admission control of the uploads of a process, 0 disables a limit
+
+        Arguments:
+            max_concurrent -- The uploads running at the same time in the process
+            max_node_concurrent -- The uploads running at the same time in all the processes of the node
+            max_body_size -- The size of a request body, in bytes
+            min_free_bytes -- The free space left in every path after an upload of the announced size
+            paths -- The directories the uploads are written to
+            slots_dir -- The directory of the slots of the node
+            queue_timeout -- The seconds an upload may wait for a slot of the process
+            retry_after -- The seconds after which a shed upload may be retried
+        """
+
+        self.max_concurrent = max_concurrent
+        self.max_body_size = max_body_size
+        self.min_free_bytes = min_free_bytes
+        self.paths = paths
+        self.node_slots = NodeSlots(slots_dir, max_node_concurrent) if max_node_concurrent else None
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.condition = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.counters = Counter(admitted=0, rejected_size=0, rejected_disk=0, rejected_worker=0, rejected_node=0)
+
+    def admit(self, content_length=None, wait=True):
+        """
+        Admits an upload, which must then be released once done.
+
+        Arguments:
+            content_length -- The announced size of the request body, None if unknown, then shed when the size is limited
+            wait -- Whether the upload may wait up to queue_timeout for a slot of the process
+
+        return -- The ticket of the upload, for release
+
+        raise -- Rejected when the upload is shed
+        """
+
+        try:
+            self.check_size(content_length)
+            self.check_disk(content_length)
+            self.acquire(wait)
+        except Rejected as e:
+            with self.condition:
+                self.counters[f"rejected_{e.reason}"] += 1
+            raise
+
+        ticket = None
+
+        if self.node_slots is not None:
+            try:
+                ticket = self.node_slots.acquire()
+            except OSError:
+                # The limit of the node is not enforced while its lock files cannot be opened
+                ticket = None
+            else:
+                if ticket is None:
+                    self.release(None)
+                    with self.condition:
+                        self.counters["rejected_node"] += 1
+                    raise Rejected(429, "node", "Too many uploads on this node!", self.retry_after)
+
+        with self.condition:
+            self.counters["admitted"] += 1
+
+        return ticket
+
+    def release(self, ticket):
+        """
+        Frees the slots of an admitted upload.
+
+        Argument:
+            ticket -- The ticket returned by admit
+        """
+
+        if ticket is not None:
+            self.node_slots.release(ticket)
+
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+    def check_size(self, content_length):
+        if self.max_body_size and content_length is None:
+            raise Rejected(411, "size", "The Content-Length of the upload is required!")
+
+        if self.max_body_size and content_length > self.max_body_size:
+            raise Rejected(413, "size", f"The body is larger than {self.max_body_size} bytes!")
+
+    def check_disk(self, content_length):
+        if not self.min_free_bytes:
+            return
+
+        for path in self.paths:
+            try:
+                free = shutil.disk_usage(path).free
+            except OSError:
+                continue
+
+            if free - (content_length or 0) < self.min_free_bytes:
+                raise Rejected(503, "disk", "Not enough free disk space for the upload!", self.retry_after)
+
+    def acquire(self, wait):
+        with self.condition:
+            if self.max_concurrent and self.running >= self.max_concurrent:
+                if not wait or self.queue_timeout <= 0:
+                    raise Rejected(429, "worker", "Too many uploads in progress!", self.retry_after)
+
+                self.waiting += 1
+                try:
+                    admitted = self.condition.wait_for(lambda: self.running < self.max_concurrent, self.queue_timeout)
+                finally:
+                    self.waiting -= 1
+
+                if not admitted:
+                    raise Rejected(429, "worker", "Too many uploads in progress!", self.retry_after)
+
+            self.running += 1
+
+    def stats(self):
+        """
+        return -- The admission counters, and the uploads running and waiting in the process
+        """
+
+        with self.condition:
+            return dict(self.counters, running=self.running, waiting=self.waiting)
+
+
+def create_admission(environ=os.environ):
+    """
+    Builds the admission control configured by the UPLOAD_* env variables.
+
+    Argument:
+        environ -- The environment variables
+
+    return -- The Admission object
+    """
+
+    return Admission(
+        max_concurrent=int(environ.get("UPLOAD_MAX_CONCURRENT", MAX_CONCURRENT)),
+        max_node_concurrent=int(environ.get("UPLOAD_MAX_NODE_CONCURRENT", 0)),
+        max_body_size=int(environ.get("UPLOAD_MAX_BODY_SIZE", 0)),
+        min_free_bytes=int(environ.get("UPLOAD_MIN_FREE_BYTES", MIN_FREE_BYTES)),
+        paths=tuple(path for path in (environ.get("DATA_DIR"), tempfile.gettempdir()) if path),
+        slots_dir=environ.get("UPLOAD_SLOTS_DIR", os.path.join(tempfile.gettempdir(), "fileupload-slots")),
+        queue_timeout=float(environ.get("UPLOAD_QUEUE_TIMEOUT", 0)),
+        retry_after=int(environ.get("UPLOAD_RETRY_AFTER", RETRY_AFTER)),
+    )
+
+
+ADMISSION = create_admission()
+
+
+def body_length(operation, content_length):
+    """
+    Arguments:
+        operation -- The name of the upload operation
+        content_length -- The Content-Length of the request, None if missing
+
+    return -- The size of the body admitted for the operation, 0 for the operations without body
+    """
+
+    return 0 if operation in BODYLESS_OPERATIONS else content_length
+
+
+def init_app(flask_app, admission=ADMISSION):
+    """
+    Admits the uploads of a Flask application before their body is read, by the name of their view,
+    and releases them at the end of the request.
+
+    Arguments:
+        flask_app -- The Flask application
+        admission -- The admission control of the process
+    """
+
+    @flask_app.before_request
+    def admit_upload():
+        view = flask_app.view_functions.get(request.url_rule.endpoint) if request.url_rule else None
+        operation = getattr(view, "__name__", None)
+
+        if operation not in UPLOAD_OPERATIONS or ADMITTED.get():
+            return None
+
+        try:
+            g.admission_ticket = admission.admit(body_length(operation, request.content_length))
+        except Rejected as e:
+            return Response(json.dumps(e.problem()), status=e.status, headers=e.headers(),
+                            mimetype="application/problem+json")
+
+    @flask_app.teardown_request
+    def release_upload(exc):
+        if "admission_ticket" in g:
+            admission.release(g.pop("admission_ticket"))
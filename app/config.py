@@ -1,12 +1,66 @@
-"""
-The sub module for retrieving the SQLAlchemy object, for ORM DB sessions
-and Marshmallow object, for data validation, deserialization, and serialization
-"""
-
-from flask_marshmallow import Marshmallow
-from flask_sqlalchemy import SQLAlchemy
-from app import create_app
-
-connex_app = create_app()
-db = SQLAlchemy(connex_app.app)
-ma = Marshmallow(connex_app.app)
\ No newline at end of file
+"""
+The sub module for retrieving the SQLAlchemy object, for ORM DB sessions
+and Marshmallow object, for data validation, deserialization, and serialization
+
+Both are created unbound and bound by the app factory, create_service. The application of the process,
+connex_app, is only built on first access, so importing the models builds nothing. The SQLAlchemy engine is
+created by the first query of a process, and the engines created so far are known, so that a forking server
+can close them in the parent and give every child pools of its own.
+"""
+
+import weakref
+
+from flask_marshmallow import Marshmallow
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from app import create_app, load_spec
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """
+    Flask-SQLAlchemy remembering the engines it creates
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engines = weakref.WeakSet()
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        self.engines.add(engine)
+
+        return engine
+
+
+db = SQLAlchemy()
+ma = Marshmallow()
+
+
+def create_service(api="swagger.yml"):
+    """
+    The app factory of the service: the flask/connexion object bound to the SQLAlchemy and Marshmallow
+    objects, with the API of its cached specification.
+
+    Argument:
+        api -- The specification of the API, none if None
+
+    return -- The flask/connexion object
+    """
+
+    connex = create_app()
+    db.init_app(connex.app)
+    ma.init_app(connex.app)
+
+    if api:
+        connex.add_api(load_spec(api))
+
+    return connex
+
+
+def __getattr__(name):
+    # connex_app is built by the first access to it, then kept as a module attribute
+    if name == "connex_app":
+        global connex_app
+        connex_app = create_service()
+        return connex_app
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
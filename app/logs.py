@@ -0,0 +1,138 @@
+"""
+The logging pipeline of the API server.
+
+In queue mode the request threads only put their log records in a queue, a single listener thread
+formats them and writes them to the handlers of logging.yml. The records are enqueued as they are,
+their message is formatted by the listener, so the arguments of a log call must not be changed after it.
+The log files can be named after the process, so that the gunicorn workers never rotate the same file.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line, for the log shippers
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    A QueueHandler that leaves the formatting of the records to the listener
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class Fields:
+    """
+    The fields of a log message, joined only when the message is formatted
+    """
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " / ".join(f"{k}: {e}" for k, e in self.fields.items())
+
+
+def file_name(log_dir, name, environ=os.environ):
+    """
+    Arguments:
+        log_dir -- The directory of the log files
+        name -- The name of the log file, such as info.log
+        environ -- The environment variables
+
+    return -- The path of the log file, with the pid of the process before its extension with LOG_PER_PROCESS
+    """
+
+    if environ.get("LOG_PER_PROCESS", "1") == "1":
+        root, ext = os.path.splitext(name)
+        name = f"{root}.{os.getpid()}{ext}"
+
+    return os.path.join(log_dir, name)
+
+
+def configure(config, environ=os.environ):
+    """
+    Applies the LOG_FORMAT env variable to a logging.yml configuration, "json" formats every handler
+    with the json formatter.
+
+    Arguments:
+        config -- The dictConfig configuration
+        environ -- The environment variables
+
+    return -- The configuration
+    """
+
+    if environ.get("LOG_FORMAT", "text") == "json":
+        for handler in config["handlers"].values():
+            handler["formatter"] = "json"
+
+    return config
+
+
+def start_queue(environ=os.environ):
+    """
+    Moves the handlers of the root logger behind a queue and a listener thread, with LOG_QUEUE.
+
+    Argument:
+        environ -- The environment variables
+    """
+
+    global listener
+
+    if environ.get("LOG_QUEUE", "1") != "1":
+        return
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+
+    for handler in handlers:
+        root.removeHandler(handler)
+
+    records = queue.SimpleQueue()
+    root.addHandler(LazyQueueHandler(records))
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.pid = os.getpid()
+    listener.start()
+
+
+@atexit.register
+def stop_queue():
+    """
+    Writes the records left in the queue and stops the listener. A listener started by the parent
+    process is only forgotten, its thread does not exist after the fork.
+    """
+
+    global listener
+
+    if listener is not None and listener.pid == os.getpid():
+        listener.stop()
+    listener = None
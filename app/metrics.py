@@ -0,0 +1,167 @@
+"""
+The Prometheus metrics of the API server.
+
+Every request is counted and timed by the operationId of its endpoint, and the stages of an upload
+are timed separately. With several gunicorn workers, set the prometheus_multiproc_dir env variable
+to an empty directory: every worker then writes its samples there and GET /metrics aggregates them.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client import CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REQUESTS = Counter(
+    "fileupload_requests_total", "The requests by operation and status", ["operation", "method", "status"]
+)
+REQUEST_SECONDS = Histogram(
+    "fileupload_request_duration_seconds", "The duration of the requests by operation", ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+INGESTED_BYTES = Counter(
+    "fileupload_ingested_bytes_total", "The bytes of the received files by operation", ["operation"]
+)
+UPLOAD_STAGE_SECONDS = Histogram(
+    "fileupload_upload_stage_seconds",
+    "The duration of the stages of an upload: receive, hash, sniff, commit and store", ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+DB_POOL = Gauge(
+    "fileupload_db_pool", "The connection pool counters summed over the live workers", ["counter"],
+    multiprocess_mode="livesum"
+)
+METADATA_CACHE = Gauge(
+    "fileupload_metadata_cache", "The metadata cache counters summed over the live workers", ["counter"],
+    multiprocess_mode="livesum"
+)
+ADMISSION = Gauge(
+    "fileupload_admission", "The upload admission counters and queue depth summed over the live workers", ["counter"],
+    multiprocess_mode="livesum"
+)
+
+# The components exporting their counters, and when this process last exported them
+EXPORT_INTERVAL = 1
+STATS = []
+exported = float("-inf")
+
+
+def observe_stage(name, seconds):
+    UPLOAD_STAGE_SECONDS.labels(name).observe(seconds)
+
+
+@contextmanager
+def stage(name):
+    """
+    Times one stage of an upload.
+
+    Argument:
+        name -- The name of the stage
+    """
+
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def observe_request(operation, method, status, seconds):
+    REQUESTS.labels(operation, method, str(status)).inc()
+    REQUEST_SECONDS.labels(operation).observe(seconds)
+
+
+def request_started():
+    """
+    return -- The time the current request started at
+    """
+
+    return g.get("request_started", time.perf_counter())
+
+
+def init_app(flask_app):
+    """
+    Times and counts every request of a Flask application by the name of its view,
+    which is the operationId of the endpoint without its module.
+
+    Argument:
+        flask_app -- The Flask application
+    """
+
+    @flask_app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @flask_app.after_request
+    def record_request(response):
+        view = flask_app.view_functions.get(request.url_rule.endpoint) if request.url_rule else None
+        operation = getattr(view, "__name__", "unknown")
+
+        observe_request(operation, request.method, response.status_code, time.perf_counter() - request_started())
+        export_stats()
+
+        return response
+
+
+def register_stats(gauge, stats):
+    """
+    Exports the counters of a component of the worker to a gauge, at most once per EXPORT_INTERVAL
+    seconds at the end of a request, so that every live worker contributes to the sums.
+
+    Arguments:
+        gauge -- The gauge labelled by counter
+        stats -- A function returning the counters of the component
+    """
+
+    STATS.append((gauge, stats))
+
+
+def export_stats(force=False):
+    """
+    Sets the gauges of the registered components, unless they were set less than EXPORT_INTERVAL seconds ago.
+
+    Argument:
+        force -- Whether to set them anyway
+    """
+
+    global exported
+
+    if not force and time.monotonic() - exported < EXPORT_INTERVAL:
+        return
+
+    exported = time.monotonic()
+
+    for gauge, stats in STATS:
+        for counter, value in stats().items():
+            gauge.labels(counter).set(value)
+
+
+def latest():
+    """
+    return -- The samples of every worker in the Prometheus text format, and its content type
+    """
+
+    if "prometheus_multiproc_dir" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """
+    Drops the live gauges of a worker that exited, from the gunicorn child_exit hook.
+
+    Argument:
+        pid -- The pid of the worker
+    """
+
+    if "prometheus_multiproc_dir" in os.environ:
+        multiprocess.mark_process_dead(pid)
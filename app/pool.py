@@ -0,0 +1,160 @@
+"""
+The connection pool of the SQLAlchemy engine and its settings.
+
+The pool is configured from the environment, it measures how long requests wait for a connection,
+and it never hands out a connection that was opened by another process, so that gunicorn workers
+forked from a master that already used the database do not share its sockets.
+"""
+
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_RECYCLE = 1800
+POOL_TIMEOUT = 30
+STATEMENT_TIMEOUT = 30000
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    A QueuePool recording the wait of every checkout and the number of connections in use
+    """
+
+    # The statement timeout applied to every transaction with SET LOCAL, in PgBouncer mode
+    local_statement_timeout = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics_lock = threading.Lock()
+        self.counters = dict.fromkeys(["checkouts", "timeouts"], 0)
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self.metrics_lock:
+                self.counters["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+
+            with self.metrics_lock:
+                self.counters["checkouts"] += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self):
+        """
+        return -- The checkout counters and wait times, and the connections of the pool by state
+        """
+
+        with self.metrics_lock:
+            return dict(
+                self.counters,
+                checkout_wait_seconds=round(self.wait_seconds, 6),
+                checkout_max_wait_seconds=round(self.max_wait_seconds, 6),
+                size=self.size(),
+                checked_in=self.checkedin(),
+                checked_out=self.checkedout(),
+                overflow=max(self.overflow(), 0),
+            )
+
+
+@event.listens_for(MeteredQueuePool, "connect")
+def remember_pid(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(MeteredQueuePool, "checkout")
+def checkout(dbapi_connection, connection_record, connection_proxy):
+    """
+    Discards a connection inherited from the parent process without closing it, closing it
+    would also end the session of the parent. In PgBouncer mode, where the server sessions are
+    shared and the options startup parameter is rejected, the statement timeout is then set
+    for the transaction that the checkout starts.
+    """
+
+    if connection_record.info.get("pid") != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError("Connection inherited from another process")
+
+    if MeteredQueuePool.local_statement_timeout:
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET LOCAL statement_timeout = {int(MeteredQueuePool.local_statement_timeout)}")
+        cursor.close()
+
+
+def engine_options(environ=os.environ):
+    """
+    Builds the engine options of the pool configured by the environment.
+
+    Argument:
+        environ -- The environment variables
+
+    return -- The keyword arguments of create_engine
+    """
+
+    timeout = statement_timeout(environ)
+
+    options = dict(
+        poolclass=MeteredQueuePool,
+        pool_size=int(environ.get("DB_POOL_SIZE", POOL_SIZE)),
+        max_overflow=int(environ.get("DB_MAX_OVERFLOW", MAX_OVERFLOW)),
+        pool_recycle=int(environ.get("DB_POOL_RECYCLE", POOL_RECYCLE)),
+        pool_timeout=float(environ.get("DB_POOL_TIMEOUT", POOL_TIMEOUT)),
+        pool_pre_ping=environ.get("DB_POOL_PRE_PING", "1") == "1",
+    )
+
+    if pgbouncer(environ):
+        MeteredQueuePool.local_statement_timeout = timeout
+    elif timeout:
+        options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+
+    return options
+
+
+def asyncpg_options(environ=os.environ):
+    """
+    Builds the options of the asyncpg pool of the asynchronous serving mode. In PgBouncer mode the
+    prepared statement cache is disabled, and the statement timeout is set by every transaction.
+
+    Argument:
+        environ -- The environment variables
+
+    return -- The keyword arguments of asyncpg.create_pool
+    """
+
+    timeout = statement_timeout(environ)
+
+    if pgbouncer(environ):
+        return dict(statement_cache_size=0)
+    elif timeout:
+        return dict(server_settings={"statement_timeout": str(timeout)})
+
+    return {}
+
+
+def statement_timeout(environ=os.environ):
+    """
+    return -- The statement timeout of the connections in milliseconds, 0 disables it
+    """
+
+    return int(environ.get("DB_STATEMENT_TIMEOUT", STATEMENT_TIMEOUT))
+
+
+def pgbouncer(environ=os.environ):
+    """
+    return -- Whether the database is reached through PgBouncer in transaction pooling mode,
+              where no state may outlive a transaction: no session settings and no prepared statements
+    """
+
+    return environ.get("DB_PGBOUNCER", "0") == "1"
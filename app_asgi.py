@@ -0,0 +1,23 @@
+"""
+The script to be located by the gunicorn production server in the asynchronous serving mode,
+with the uvicorn worker class: gunicorn app_asgi:application -k uvicorn.workers.UvicornWorker
+"""
+
+import os
+
+from app import database_uri
+from app.pool import asyncpg_options, pgbouncer, statement_timeout
+from app_docker import connex_app
+from fileupload.asgi import AsyncFileUpload, IO_THREADS, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE
+from fileupload.views import fileupload
+
+application = AsyncFileUpload(
+    connex_app.app,
+    fileupload,
+    database_uri(),
+    io_threads=int(os.environ.get('ASYNC_IO_THREADS', IO_THREADS)),
+    pool_min_size=int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', DB_POOL_MIN_SIZE)),
+    pool_max_size=int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', DB_POOL_MAX_SIZE)),
+    pool_options=asyncpg_options(),
+    local_statement_timeout=statement_timeout() if pgbouncer() else None,
+)
@@ -1,13 +1,12 @@
-"""
-The script to be located by the gunicorn production server
-"""
-
-from flask_migrate import Migrate
-from app.config import db, connex_app
-
-migrate = Migrate(connex_app.app, db)
-
-connex_app.add_api("swagger.yml")
-
-# if __name__ == "__main__":
+"""
+The script to be located by the gunicorn production server.
+
+The application is built by the app factory with the cached specification of its API, and it opens
+nothing at import, neither the libmagic handles, the database connections nor the log files, so it
+can be preloaded by the gunicorn master. The migrations are left to migrate.py.
+"""
+
+from app.config import connex_app
+
+# if __name__ == "__main__":
 #     connex_app.run()
\ No newline at end of file
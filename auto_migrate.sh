@@ -1,5 +1,4 @@
 #!/bin/bash
 
-python migrate.py db migrate
 python migrate.py db upgrade
 
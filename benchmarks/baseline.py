@@ -0,0 +1,159 @@
+"""
+The measures shared by the benchmarks: latency percentiles, resident memory, and the machine-readable
+baselines saved by a run and compared by a later one.
+
+A baseline is a JSON file holding the environment of the run and a result per benchmark, every result
+being a flat mapping of metric names to numbers. The metrics ending with _per_s are better when higher,
+all the others (latencies, memory) are better when lower. The maximum latencies are reported but not compared.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+
+def percentiles(values):
+    """
+    return -- The p50, p95 and p99 of the values and their maximum, None for no value
+    """
+
+    values = sorted(values)
+    if not values:
+        return dict(p50=None, p95=None, p99=None, max=None)
+
+    def rank(fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+    return dict(p50=rank(0.5), p95=rank(0.95), p99=rank(0.99), max=values[-1])
+
+
+def rss(pid=None):
+    """
+    return -- The resident memory in bytes of a process and of all its children, read from /proc
+    """
+
+    pid = pid or os.getpid()
+    total = 0
+    pending = [pid]
+
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{current}/task/{current}/children") as children:
+                pending.extend(int(child) for child in children.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+
+    return total
+
+
+class RssSampler:
+
+    def __init__(self, pid=None, interval=0.5):
+        """
+        Samples the resident memory of a process tree in a thread, while a benchmark runs
+
+        Arguments:
+            pid -- The process, the current one if None
+            interval -- The seconds between two samples
+        """
+
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="bench-rss", daemon=True)
+
+    def run(self):
+        while not self.done.is_set():
+            self.peak = max(self.peak, rss(self.pid))
+            self.done.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.thread.join()
+        self.last = rss(self.pid)
+        self.peak = max(self.peak, self.last)
+
+
+def environment():
+    """
+    return -- The description of the machine and of the code of the run
+    """
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+
+    return dict(
+        time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        commit=commit or None,
+        python=platform.python_version(),
+        machine=platform.machine(),
+        cores=os.cpu_count(),
+        argv=sys.argv[1:],
+    )
+
+
+def save(path, results, **settings):
+    """
+    Saves the results of a run as a baseline.
+
+    Arguments:
+        path -- The path of the JSON file
+        results -- The metrics of every benchmark
+        settings -- The settings of the run
+    """
+
+    with open(path, "w") as file:
+        json.dump(dict(environment=environment(), settings=settings, results=results), file, indent=2, sort_keys=True)
+
+
+def compare(path, results, tolerance=0.1):
+    """
+    Prints the change of every metric against a baseline.
+
+    Arguments:
+        path -- The path of the JSON file of the baseline
+        results -- The metrics of every benchmark of the current run
+        tolerance -- The relative change beyond which a worse metric is a regression
+
+    return -- The regressions, as benchmark, metric, baseline value and current value
+    """
+
+    with open(path) as file:
+        baseline = json.load(file)["results"]
+
+    regressions = []
+    print(f"{'':40} {'baseline':>12} {'current':>12} {'change':>8}")
+
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(name, {}).get(metric)
+            # The maximum of a run is a single sample, too noisy to compare
+            if not before or value is None or metric == "max":
+                continue
+
+            change = value / before - 1
+            worse = -change if metric.endswith("_per_s") else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            if flag:
+                regressions.append((name, metric, before, value))
+
+            print(f"{name + ' ' + metric:40} {before:12.4g} {value:12.4g} {change:+8.1%}{flag}")
+
+    return regressions
@@ -0,0 +1,121 @@
+"""
+The benchmark of the hash lookups, comparing the md5-OR-sha1 scan over hex text columns
+with the typed lookup on the one binary column matching the hash length.
+
+Both layouts are filled in a scratch schema of the configured database, with the same
+rows generated by PostgreSQL itself, then random existing hashes are looked up.
+
+Examples:
+
+$ python benchmarks/bench_hash_lookup.py
+-- 10M rows, 2000 lookups per query
+
+$ python benchmarks/bench_hash_lookup.py --rows 1000000 --lookups 500 --keep
+-- A smaller table, kept in the bench_lookup schema for a later run with --reuse
+
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from app import database_uri
+
+SCHEMA = "bench_lookup"
+
+SETUP = [
+    f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE",
+    f"CREATE SCHEMA {SCHEMA}",
+    f"""CREATE TABLE {SCHEMA}.text_hashes (
+        id serial PRIMARY KEY, size varchar, file_name varchar,
+        sha1 varchar UNIQUE, md5 varchar UNIQUE, type varchar)""",
+    f"""INSERT INTO {SCHEMA}.text_hashes (size, file_name, sha1, md5, type)
+        SELECT (i::bigint * 7919 % 1000000)::text, 'file_' || i,
+               md5(i::text) || left(md5((-i)::text), 8), md5((i + 1)::text || 'x'), 'text/plain'
+        FROM generate_series(1, :rows) AS i""",
+    f"""CREATE TABLE {SCHEMA}.typed_hashes AS
+        SELECT id, size::bigint AS size, file_name, decode(sha1, 'hex') AS sha1,
+               decode(md5, 'hex') AS md5, type
+        FROM {SCHEMA}.text_hashes""",
+    f"ALTER TABLE {SCHEMA}.typed_hashes ADD PRIMARY KEY (id)",
+    f"CREATE INDEX ON {SCHEMA}.typed_hashes (sha1)",
+    f"CREATE INDEX ON {SCHEMA}.typed_hashes (md5)",
+    f"VACUUM ANALYZE {SCHEMA}.text_hashes",
+    f"VACUUM ANALYZE {SCHEMA}.typed_hashes",
+]
+
+TEXT_LOOKUP = text(f"SELECT * FROM {SCHEMA}.text_hashes WHERE md5 = :h OR sha1 = :h")
+TYPED_LOOKUPS = {
+    32: text(f"SELECT * FROM {SCHEMA}.typed_hashes WHERE md5 = decode(:h, 'hex') ORDER BY id LIMIT 1"),
+    40: text(f"SELECT * FROM {SCHEMA}.typed_hashes WHERE sha1 = decode(:h, 'hex') ORDER BY id LIMIT 1"),
+}
+
+
+def timed(conn, queries):
+    """
+    return -- The latency of every query in milliseconds
+    """
+    latencies = []
+    for query, params in queries:
+        start = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<24} p50 {statistics.median(latencies):8.3f} ms   p99 {p99:8.3f} ms   "
+          f"mean {statistics.mean(latencies):8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--reuse", action="store_true", help="Reuse the tables of a previous run")
+    parser.add_argument("--keep", action="store_true", help="Keep the tables after the run")
+    args = parser.parse_args()
+
+    engine = create_engine(database_uri())
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not args.reuse:
+            print(f"Filling {args.rows} rows...")
+            for statement in SETUP:
+                conn.execute(text(statement), rows=args.rows)
+
+        rows = conn.execute(text(f"SELECT count(*) FROM {SCHEMA}.text_hashes")).scalar()
+        ids = [random.randint(1, rows) for _ in range(args.lookups)]
+        hashes = [
+            h for (h,) in conn.execute(
+                text(f"SELECT CASE WHEN id % 2 = 0 THEN md5 ELSE sha1 END FROM {SCHEMA}.text_hashes "
+                     "WHERE id = ANY(:ids)"), ids=ids
+            )
+        ]
+        random.shuffle(hashes)
+
+        timed(conn, [(TEXT_LOOKUP, {"h": h}) for h in hashes[:100]])
+        timed(conn, [(TYPED_LOOKUPS[len(h)], {"h": h}) for h in hashes[:100]])
+
+        print(f"{rows} rows, {len(hashes)} lookups of existing md5/sha1 hashes")
+        report("md5 OR sha1 text", timed(conn, [(TEXT_LOOKUP, {"h": h}) for h in hashes]))
+        report("typed binary column", timed(conn, [(TYPED_LOOKUPS[len(h)], {"h": h}) for h in hashes]))
+
+        for name, table in [("text", "text_hashes"), ("typed", "typed_hashes")]:
+            size = conn.execute(text(f"SELECT pg_size_pretty(pg_total_relation_size('{SCHEMA}.{table}'))")).scalar()
+            print(f"{name} table and indexes: {size}")
+
+        if not args.keep:
+            conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+The benchmark of the hashing engine, comparing the former hash_file loop with the parallel engine.
+
+A file of random content is written, then hashed with md5 and sha1 by:
+- the former hash_file loop, 64 KiB reads in Python, once per algorithm
+- the streaming engine in the calling thread, as StreamIngest did before
+- the streaming engine with parallel threads, as StreamIngest does now
+- the memory-mapped engine with parallel threads, as the session finalization and hash_file do now
+The last two are also run with the tree hash. The file is read once first, so that it is in the page cache
+and the runs measure the hashing. The speedup of the threads depends on the cores of the machine.
+
+Examples:
+
+$ python benchmarks/bench_hashing.py
+-- A 1 GiB file
+
+$ python benchmarks/bench_hashing.py --size 20480 --block-size 4194304 --threads 8
+-- A 20 GiB file, 4 MiB blocks and 8 threads
+
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fileupload.hashing import MultiHasher, hash_path, TREE_CHUNK_SIZE
+
+
+def legacy_hash_file(path, algorithm):
+    block_size = 65536
+    hasher = hashlib.sha1() if algorithm == "sha1" else hashlib.md5()
+
+    with open(path, "rb") as file:
+        buf = file.read(block_size)
+        while len(buf) > 0:
+            hasher.update(buf)
+            buf = file.read(block_size)
+
+    return hasher.hexdigest()
+
+
+def legacy(path, args):
+    return {"md5": legacy_hash_file(path, "md5"), "sha1": legacy_hash_file(path, "sha1")}
+
+
+def stream(path, args, threads, tree_chunk_size=None):
+    hasher = MultiHasher(tree_chunk_size=tree_chunk_size, threads=threads)
+
+    with open(path, "rb") as file:
+        buf = file.read(args.block_size)
+        while len(buf) > 0:
+            hasher.update(buf)
+            buf = file.read(args.block_size)
+
+    return hasher.digests()
+
+
+def main(args):
+    with tempfile.NamedTemporaryFile(dir=args.dir, prefix="bench-hashing-") as file:
+        block = os.urandom(1048576)
+        for _ in range(args.size):
+            file.write(block)
+        file.flush()
+
+        path = file.name
+        legacy(path, args)
+
+        runs = [
+            ("hash_file loop, md5 then sha1", lambda: legacy(path, args)),
+            ("stream, 1 thread", lambda: stream(path, args, 1)),
+            (f"stream, {args.threads} threads", lambda: stream(path, args, args.threads)),
+            (f"mmap, {args.threads} threads", lambda: hash_path(path, threads=args.threads)),
+            (f"stream + tree, {args.threads} threads", lambda: stream(path, args, args.threads, args.tree_chunk_size)),
+            (f"mmap + tree, {args.threads} threads",
+             lambda: hash_path(path, tree_chunk_size=args.tree_chunk_size, threads=args.threads)),
+        ]
+
+        print(f"{args.size} MiB, blocks of {args.block_size} bytes, {os.cpu_count()} cores")
+        baseline = None
+        expected = None
+
+        for name, run in runs:
+            elapsed = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                digests = run()
+                elapsed.append(time.perf_counter() - started)
+
+            best = min(elapsed)
+            baseline = baseline or best
+            expected = expected or digests
+            assert (digests["md5"], digests["sha1"]) == (expected["md5"], expected["sha1"])
+
+            print(f"{name:32} {best:8.2f} s {args.size / best:9.1f} MiB/s   x{baseline / best:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024, help="The size of the file in MiB")
+    parser.add_argument("--block-size", type=int, default=1048576, help="The block size of the streaming engine")
+    parser.add_argument("--threads", type=int, default=4, help="The number of hashing threads")
+    parser.add_argument("--tree-chunk-size", type=int, default=TREE_CHUNK_SIZE, help="The chunk size of the tree hash")
+    parser.add_argument("--repeat", type=int, default=3, help="The runs of every variant, the best one is reported")
+    parser.add_argument("--dir", default=None, help="The directory of the file, the system temp directory by default")
+    main(parser.parse_args())
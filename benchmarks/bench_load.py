@@ -0,0 +1,320 @@
+"""
+The end-to-end load generator of the upload service, exercising every endpoint of swagger.yml.
+
+Every client runs the same scenario in a loop until the end of the run, with its own HTTP connection:
+upload a file of a size drawn from the distribution, read its metadata, its content, its chunks and its
+jobs, check and look it up, rename it, list the files, read the stats, the metrics and the home page,
+upload a batch, upload a file with a chunked session and abandon another session, then delete the files.
+The run reports the throughput and the p50/p95/p99 latencies of every operation and the resident memory
+of the server, and its results can be saved as a baseline and compared with a previous one.
+
+With --serve, a server is started on a scratch database (created and migrated on the configured
+PostgreSQL server, the metadata relies on its bytea, upsert and SKIP LOCKED features so SQLite cannot
+stand in for it) and a scratch DATA_DIR, both reused by the next runs.
+
+Examples:
+
+$ python benchmarks/bench_load.py --serve --save load.json
+-- Start a sync server with 4 workers, run 16 clients for 30 seconds and save the results
+
+$ python benchmarks/bench_load.py --serve --asgi --compare load.json
+-- The same run on the async server, compared with the previous one
+
+$ python benchmarks/bench_load.py --url http://127.0.0.1:8000 --pid 1234 --clients 64 --sizes 1024:90,104857600:10
+-- A running server, whose gunicorn master is 1234, with 10% of 100 MiB files
+
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import os.path as op
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+import baseline
+
+ROOT = op.dirname(op.dirname(op.abspath(__file__)))
+SIZES = "1024:50,65536:30,1048576:15,16777216:5"
+BLOCK = os.urandom(1048576)
+
+
+def parse_sizes(value):
+    """
+    return -- The file sizes and their weights, from comma separated size:weight pairs
+    """
+
+    pairs = [item.split(":") for item in value.split(",")]
+    return [int(size) for size, _ in pairs], [float(weight) for _, weight in pairs]
+
+
+def make_content(size, rng):
+    # A unique prefix makes every content new to the store, the rest is incompressible
+    prefix = hashlib.sha1(rng.getrandbits(64).to_bytes(8, "big")).digest()
+    repeated = BLOCK * (size // len(BLOCK) + 1)
+    return (prefix + repeated[:max(0, size - len(prefix))])[:size]
+
+
+class Client:
+
+    def __init__(self, url, args, index):
+        """
+        One client of the load, running the scenario in a loop with its own connection
+
+        Arguments:
+            url -- The url of the server
+            args -- The settings of the run
+            index -- The index of the client, the seed of its random sizes
+        """
+
+        self.url = url.rstrip("/")
+        self.args = args
+        self.session = requests.Session()
+        self.rng = random.Random(index)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.uploaded = 0
+
+    def call(self, operation, method, path, expected=(200,), stream=False, **kwargs):
+        """
+        Sends one request and records its latency under its operationId.
+
+        Arguments:
+            operation -- The operationId of the endpoint
+            method -- The HTTP method
+            path -- The path of the endpoint
+            expected -- The status codes of a successful request
+            stream -- Whether to read the body block by block and drop it, for the downloads
+
+        return -- The response
+        """
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.url + path, stream=stream, **kwargs)
+            if stream:
+                for _ in response.iter_content(1048576):
+                    pass
+        except requests.RequestException:
+            self.errors[operation] += 1
+            return None
+
+        self.latencies[operation].append(time.perf_counter() - started)
+        if response.status_code not in expected:
+            self.errors[operation] += 1
+
+        return response
+
+    def size(self):
+        return self.rng.choices(self.args.sizes, self.args.weights)[0]
+
+    def scenario(self):
+        content = make_content(self.size(), self.rng)
+        sha1, md5 = hashlib.sha1(content).hexdigest(), hashlib.md5(content).hexdigest()
+        base = f"/service/fileupload/{sha1}"
+
+        response = self.call("upload_file", "POST", "/service/fileupload", (201,),
+                             files={"upfile": ("bench.bin", io.BytesIO(content))})
+        if response is None or response.status_code != 201:
+            return
+        self.uploaded += len(content)
+
+        self.call("read_file", "GET", base)
+        self.call("read_file_content", "GET", base + "/content", stream=True)
+        self.call("read_chunks", "GET", base + "/chunks", (200, 404))
+        self.call("read_jobs", "GET", base + "/jobs")
+        self.call("check_file", "POST", "/service/fileupload/check", json={"sha1": sha1, "size": len(content)})
+        self.call("lookup_files", "POST", "/service/fileupload/lookup", json={"hashes": [sha1, md5]})
+        self.call("update_file", "PUT", base, (201,), json={"file_name": "bench-renamed.bin"})
+        self.call("search_files", "GET", "/service/fileupload/search", params={"q": "bench-renamed", "limit": 100})
+        self.call("read_files", "GET", "/service/fileupload", params={"limit": 100})
+        self.call("read_stats", "GET", "/service/stats")
+        self.call("read_metrics", "GET", "/metrics")
+        self.call("load_index", "GET", "/")
+
+        batch = [make_content(min(self.size(), 65536), self.rng) for _ in range(self.args.batch_files)]
+        response = self.call("upload_batch", "POST", "/service/fileupload/batch", (201,),
+                             files=[("upfiles", (f"bench{index}.bin", io.BytesIO(item)))
+                                    for index, item in enumerate(batch)])
+        if response is not None and response.status_code == 201:
+            self.uploaded += sum(len(item) for item in batch)
+            for item in batch:
+                self.call("delete_file", "DELETE", f"/service/fileupload/{hashlib.sha1(item).hexdigest()}", (201,))
+
+        self.session_upload()
+
+        self.call("delete_file", "DELETE", base, (201,))
+
+    def session_upload(self):
+        content = make_content(self.size(), self.rng)
+        chunk_size = self.args.chunk_size
+
+        response = self.call("create_session", "POST", "/service/fileupload/sessions", (201,),
+                             json={"file_name": "bench-session.bin", "size": len(content), "chunk_size": chunk_size})
+        if response is None or response.status_code != 201:
+            return
+        session_path = f"/service/fileupload/sessions/{response.json()['session_id']}"
+
+        for index, start in enumerate(range(0, len(content), chunk_size)):
+            self.call("upload_chunk", "PUT", f"{session_path}/chunks/{index}", (201,),
+                      data=content[start:start + chunk_size], headers={"Content-Type": "application/octet-stream"})
+
+        self.call("read_session", "GET", session_path)
+        response = self.call("complete_session", "POST", f"{session_path}/complete", (201,))
+        if response is not None and response.status_code == 201:
+            self.uploaded += len(content)
+            self.call("delete_file", "DELETE", f"/service/fileupload/{hashlib.sha1(content).hexdigest()}", (201,))
+
+        response = self.call("create_session", "POST", "/service/fileupload/sessions", (201,),
+                             json={"file_name": "bench-abandoned.bin", "size": 1})
+        if response is not None and response.status_code == 201:
+            abandoned_path = f"/service/fileupload/sessions/{response.json()['session_id']}"
+            self.call("delete_session", "DELETE", abandoned_path, (201,))
+
+    def run(self, deadline):
+        while time.monotonic() < deadline:
+            self.scenario()
+
+
+class Server:
+
+    def __init__(self, args):
+        """
+        A server started for the run, on a scratch database and a scratch DATA_DIR
+
+        Argument:
+            args -- The settings of the run
+        """
+
+        self.data_dir = op.join(tempfile.gettempdir(), "bench-load")
+        self.url = f"http://127.0.0.1:{args.port}"
+        self.env = dict(
+            os.environ,
+            DB_NAME=args.db_name,
+            ROOT_DIR=ROOT,
+            DATA_DIR=op.join(self.data_dir, "data"),
+            LOG_DIR=op.join(self.data_dir, "logs"),
+            prometheus_multiproc_dir=op.join(self.data_dir, "metrics"),
+        )
+        self.command = [
+            sys.executable, "-m", "gunicorn", "app_asgi:application" if args.asgi else "app_docker:connex_app",
+            "-b", f"127.0.0.1:{args.port}", "-w", str(args.server_workers),
+        ] + (["-k", "uvicorn.workers.UvicornWorker"] if args.asgi else [])
+        self.process = None
+
+    def __enter__(self):
+        for name in ("data", "logs"):
+            os.makedirs(op.join(self.data_dir, name), exist_ok=True)
+
+        subprocess.run([sys.executable, "migrate.py", "db", "upgrade"], cwd=ROOT, env=self.env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.process = subprocess.Popen(self.command, cwd=ROOT, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        for _ in range(300):
+            try:
+                requests.get(self.url + "/", timeout=1)
+                return self
+            except requests.RequestException:
+                time.sleep(0.1)
+
+        self.__exit__()
+        raise RuntimeError(f"The server did not start: {' '.join(self.command)}")
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(op.join(self.data_dir, "data"), ignore_errors=True)
+
+
+def run(url, pid, args):
+    clients = [Client(url, args, index) for index in range(args.clients)]
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=client.run, args=(deadline,)) for client in clients]
+
+    with baseline.RssSampler(pid) as server_rss:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for client in clients:
+        for operation, values in client.latencies.items():
+            latencies[operation].extend(values)
+        for operation, count in client.errors.items():
+            errors[operation] += count
+
+    results = {
+        operation: dict(requests_per_s=len(values) / elapsed, errors=errors[operation], **baseline.percentiles(values))
+        for operation, values in sorted(latencies.items())
+    }
+    results["total"] = dict(
+        requests_per_s=sum(len(values) for values in latencies.values()) / elapsed,
+        uploaded_mib_per_s=sum(client.uploaded for client in clients) / elapsed / 1048576,
+        errors=sum(errors.values()),
+    )
+    if pid:
+        results["server"] = dict(rss_bytes=server_rss.peak, rss_last_bytes=server_rss.last)
+
+    return results
+
+
+def main(args):
+    args.sizes, args.weights = parse_sizes(args.sizes)
+
+    if args.serve:
+        with Server(args) as server:
+            results = run(server.url, server.process.pid, args)
+    else:
+        results = run(args.url, args.pid, args)
+
+    print(f"{args.clients} clients for {args.duration}s, sizes {args.sizes} weighted {args.weights}")
+    print(f"{'':20} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for operation, result in results.items():
+        if "p50" in result:
+            print(f"{operation:20} {result['requests_per_s']:9.1f} " + " ".join(
+                f"{result[rank] * 1000:9.1f}" for rank in ("p50", "p95", "p99")) + f" {result['errors']:7d}")
+    print(json.dumps({name: results[name] for name in ("total", "server") if name in results}))
+
+    if args.save:
+        baseline.save(args.save, results, clients=args.clients, duration=args.duration, sizes=args.sizes,
+                      weights=args.weights, asgi=args.asgi, server_workers=args.server_workers)
+
+    if args.compare:
+        regressions = baseline.compare(args.compare, results, args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("BENCH_URL", "http://127.0.0.1:8000"),
+                        help="The url of a running server, unless --serve")
+    parser.add_argument("--pid", type=int, default=None, help="The pid of the running server, to measure its memory")
+    parser.add_argument("--serve", action="store_true", help="Start a server on a scratch database for the run")
+    parser.add_argument("--asgi", action="store_true", help="Start the async server instead of the sync one")
+    parser.add_argument("--server-workers", type=int, default=4, help="The gunicorn workers of the started server")
+    parser.add_argument("--port", type=int, default=8765, help="The port of the started server")
+    parser.add_argument("--db-name", default="fileservice_bench", help="The scratch database of the started server")
+    parser.add_argument("--clients", type=int, default=16, help="The number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="The seconds of the run")
+    parser.add_argument("--sizes", default=SIZES, help="The file sizes and their weights, as size:weight pairs")
+    parser.add_argument("--batch-files", type=int, default=4, help="The number of files of every batch upload")
+    parser.add_argument("--chunk-size", type=int, default=1048576, help="The chunk size of the upload sessions")
+    parser.add_argument("--save", help="The JSON file the results are saved to")
+    parser.add_argument("--compare", help="The JSON file of the baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="The relative change of a regression")
+    main(parser.parse_args())
@@ -0,0 +1,164 @@
+"""
+The micro-benchmarks of the upload pipeline, run in process without a server.
+
+Every benchmark is run for a few seconds per file size, and reports its operations and bytes per
+second with the latency percentiles of one operation:
+- hash_file, the sha1 of a file on disk
+- extract_meta, the single pass hashing, sniffing and staging of an uploaded file
+- extract_file_type, the libmagic sniffing of the header of a file
+- schema_dump, the FileMetadataSchema dump of a page of files
+- serialize, the fast serialization of the same page, from its column tuples
+
+The results can be saved as a baseline, and compared with a previous one to catch regressions.
+
+Examples:
+
+$ python benchmarks/bench_micro.py --save micro.json
+-- Run every benchmark and save the results
+
+$ python benchmarks/bench_micro.py --compare micro.json
+-- Run every benchmark again and exit with 1 when a metric is more than 10% worse
+
+$ python benchmarks/bench_micro.py --only extract_meta --sizes 1048576,104857600
+-- Run one benchmark for two file sizes
+
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.datastructures import FileStorage
+
+import baseline
+from fileupload import ingest, serialize
+from fileupload.models import FileMetadata, FileMetadataSchema
+from fileupload.views import fileupload
+
+SIZES = (1024, 65536, 1048576, 16777216)
+PAGE_SIZE = 100
+
+
+def measure(run, duration, size=0):
+    """
+    Runs an operation again and again for a duration, after a warm-up run.
+
+    return -- The operations and bytes per second, and the latency percentiles of one operation
+    """
+
+    run()
+    latencies = []
+    started = time.perf_counter()
+
+    while time.perf_counter() - started < duration:
+        before = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - before)
+
+    elapsed = sum(latencies)
+    result = dict(ops_per_s=len(latencies) / elapsed, **baseline.percentiles(latencies))
+    if size:
+        result["mib_per_s"] = len(latencies) * size / elapsed / 1048576
+
+    return result
+
+
+def bench_hash_file(content, args):
+    with tempfile.NamedTemporaryFile(dir=args.dir, prefix="bench-micro-") as file:
+        file.write(content)
+        file.flush()
+
+        return measure(lambda: fileupload.hash_file(file.name), args.duration, len(content))
+
+
+def bench_extract_meta(content, args):
+    def run():
+        upfile = FileStorage(io.BytesIO(content), filename="bench.bin")
+        metadata, staging_path = fileupload.extract_meta(upfile)
+        ingest.discard(staging_path)
+
+    return measure(run, args.duration, len(content))
+
+
+def bench_extract_file_type(content, args):
+    header = content[:ingest.HEADER_SIZE]
+    return measure(lambda: fileupload.extract_file_type(header), args.duration)
+
+
+def page_of_files():
+    return [
+        FileMetadata(id=index, size=index * 1000, file_name=f"file_{index}.txt", sha1=f"{index:040x}",
+                     md5=f"{index:032x}", type="text/plain")
+        for index in range(PAGE_SIZE)
+    ]
+
+
+def bench_schema_dump(args):
+    files = page_of_files()
+    schema = FileMetadataSchema(many=True)
+
+    return measure(lambda: schema.dump(files), args.duration)
+
+
+def bench_serialize(args):
+    rows = [tuple(getattr(file, column.key) for column in serialize.COLUMNS) for file in page_of_files()]
+
+    return measure(lambda: serialize.dumps([serialize.dump(row) for row in rows]), args.duration)
+
+
+def content_of(size):
+    # Text-like content, so that libmagic sniffs it as it would sniff most uploads
+    line = b"2019-10-01T00:00:00 INFO the quick brown fox jumps over the lazy dog\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+def main(args):
+    benchmarks = {
+        "hash_file": bench_hash_file,
+        "extract_meta": bench_extract_meta,
+        "extract_file_type": bench_extract_file_type,
+    }
+    results = {}
+
+    for name, bench in benchmarks.items():
+        if args.only and name not in args.only:
+            continue
+        for size in args.sizes:
+            results[f"{name}[{size}]"] = bench(content_of(size), args)
+
+    if not args.only or "schema_dump" in args.only:
+        results[f"schema_dump[{PAGE_SIZE}]"] = bench_schema_dump(args)
+    if not args.only or "serialize" in args.only:
+        results[f"serialize[{PAGE_SIZE}]"] = bench_serialize(args)
+
+    results["process"] = dict(rss_bytes=baseline.rss())
+
+    for name, result in results.items():
+        print(f"{name:32} " + "  ".join(
+            f"{metric} {value:.4g}" for metric, value in result.items() if metric not in ("max",)
+        ))
+
+    if args.save:
+        baseline.save(args.save, results, sizes=args.sizes, duration=args.duration)
+
+    if args.compare:
+        regressions = baseline.compare(args.compare, results, args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=list(SIZES),
+                        help="The comma separated file sizes in bytes")
+    parser.add_argument("--duration", type=float, default=2, help="The seconds every benchmark runs for")
+    parser.add_argument("--only", nargs="+", help="The benchmarks to run, all of them by default")
+    parser.add_argument("--dir", default=None, help="The directory of the files, the system temp directory by default")
+    parser.add_argument("--save", help="The JSON file the results are saved to")
+    parser.add_argument("--compare", help="The JSON file of the baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="The relative change of a regression")
+    main(parser.parse_args())
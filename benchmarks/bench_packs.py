@@ -0,0 +1,138 @@
+"""
+The benchmark of the packed store of the small contents, against the blob store.
+
+Small files of random content are stored from staging files, as the uploads do, then read back in a random
+order, then half of them are deleted. Both stores run in a scratch directory, the blob store with one file
+per content in the fan-out directories, the packed store with the contents appended to its segments.
+The run reports the files per second of every step and the inodes used by every store, and the compaction
+of the packed store after the deletions.
+
+Examples:
+
+$ python benchmarks/bench_packs.py
+-- 20000 files of 1 to 16 KiB
+
+$ python benchmarks/bench_packs.py --files 200000 --max-size 65536 --dir /server/data --save packs.json
+-- More and larger files, in the filesystem of the data, with the results saved as a baseline
+
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import baseline
+from fileupload.packs import PackedStorage
+from fileupload.storage import LocalStorage
+
+
+def inodes(path):
+    return sum(1 + len(dirs) + len(files) for _, dirs, files in os.walk(path)) - 1
+
+
+def rate(count, function):
+    """
+    return -- The calls per second of a function run count times, timed by the function if it returns its time
+    """
+
+    started = time.perf_counter()
+    elapsed = function()
+
+    return count / (elapsed or time.perf_counter() - started)
+
+
+def run(storage, root, contents):
+    staging_dir = os.path.join(root, ".staging")
+    os.makedirs(staging_dir, exist_ok=True)
+    hashes = list(contents)
+
+    def put():
+        # Only the storage of the staging files is timed, the uploads write them in both cases
+        elapsed = 0
+
+        for sha1, content in contents.items():
+            staging_path = os.path.join(staging_dir, sha1)
+            with open(staging_path, "wb") as staging:
+                staging.write(content)
+
+            started = time.perf_counter()
+            storage.put(staging_path, sha1)
+            elapsed += time.perf_counter() - started
+
+        return elapsed
+
+    def read():
+        for sha1 in random.sample(hashes, len(hashes)):
+            for _ in storage.read(sha1):
+                pass
+
+    def delete():
+        for sha1 in hashes[::2]:
+            storage.delete(sha1)
+
+    results = {
+        "put_per_s": rate(len(hashes), put),
+        "read_per_s": rate(len(hashes), read),
+        "inodes": inodes(root),
+        "delete_per_s": rate(len(hashes[::2]), delete),
+    }
+
+    if isinstance(storage, PackedStorage):
+        started = time.perf_counter()
+        counts = storage.compact()
+        results["compact_seconds"] = time.perf_counter() - started
+        results["inodes_compacted"] = inodes(root)
+        print(f"compaction: {dict(counts)}")
+
+    return results
+
+
+def main(args):
+    random.seed(0)
+    contents = {}
+    while len(contents) < args.files:
+        content = os.urandom(random.randint(args.min_size, args.max_size))
+        contents[hashlib.sha1(content).hexdigest()] = content
+
+    results = {}
+    stores = {
+        "blobs": lambda root: LocalStorage(os.path.join(root, "blobs")),
+        "packed": lambda root: PackedStorage(os.path.join(root, "packs"), LocalStorage(os.path.join(root, "blobs")),
+                                             max_file_size=args.max_size + 1, segment_size=args.segment_size),
+    }
+
+    for name, create in stores.items():
+        root = tempfile.mkdtemp(prefix=f"bench-packs-{name}-", dir=args.dir)
+        try:
+            results[name] = run(create(root), root, contents)
+        finally:
+            shutil.rmtree(root)
+
+        print(f"{name:8} " + "  ".join(f"{metric} {value:.4g}" for metric, value in results[name].items()))
+
+    if args.save:
+        baseline.save(args.save, results, files=args.files, min_size=args.min_size, max_size=args.max_size)
+
+    if args.compare:
+        sys.exit(1 if baseline.compare(args.compare, results, args.tolerance) else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20000, help="The number of files")
+    parser.add_argument("--min-size", type=int, default=1024, help="The minimum size of a file in bytes")
+    parser.add_argument("--max-size", type=int, default=16384, help="The maximum size of a file in bytes")
+    parser.add_argument("--segment-size", type=int, default=16777216,
+                        help="The size of the segments in bytes, small enough to seal a few of them")
+    parser.add_argument("--dir", default=None, help="The directory of the scratch stores, the temp dir as default")
+    parser.add_argument("--save", help="The JSON file the results are saved to")
+    parser.add_argument("--compare", help="The JSON file of the baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="The relative change of a regression")
+    main(parser.parse_args())
@@ -0,0 +1,178 @@
+"""
+The benchmark of the file search, against a latency budget on a table of millions of files.
+
+The filemetadata table of a scratch database (created and migrated on the configured PostgreSQL server, then
+reused by the next runs) is filled with generated files, named after a few common words, a serial number and
+an extension matching their type. Every kind of search is then sent to GET /service/fileupload/search through
+the test client of the application, with a new fragment every time, and the run reports the p50/p95/p99
+latencies of every kind. It exits with 1 when the p95 of a kind exceeds the budget.
+
+The service only searches the substrings of the names when the pg_trgm extension was available to the migration
+and created their trigram index, otherwise it matches the prefixes only and the run skips the substring searches.
+
+Examples:
+
+$ python benchmarks/bench_search.py
+-- 2 million files, 200 searches of every kind, against a 10 ms budget
+
+$ python benchmarks/bench_search.py --rows 10000000 --budget 0.02 --save search.json
+-- 10 million files, against a 20 ms budget, with the results saved as a baseline
+
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import baseline
+
+ROWS = 2000000
+BUDGET = 0.01
+WORDS = ["report", "invoice", "photo", "scan", "contract", "backup", "notes", "slides", "draft", "summary"]
+EXTENSIONS = [("pdf", "application/pdf"), ("png", "image/png"), ("jpg", "image/jpeg"), ("txt", "text/plain"),
+              ("csv", "text/csv")]
+
+FILL = """
+    INSERT INTO filemetadata.filemetadata (size, file_name, sha1, md5, type, encoding, stored_size)
+    SELECT i::bigint * 7919 % 1000000,
+           initcap(words[1 + i / 5 % 10]) || '_' || words[1 + i / 50 % 10] || '_' || i || '.' || extensions[1 + i % 5],
+           decode(md5(i::text) || left(md5((-i)::text), 8), 'hex'), decode(md5((i + 1)::text || 'x'), 'hex'),
+           types[1 + i % 5], 'binary', i::bigint * 7919 % 1000000
+    FROM generate_series(1, :rows) AS i,
+         (SELECT CAST(:words AS text[]) AS words, CAST(:extensions AS text[]) AS extensions,
+                 CAST(:types AS text[]) AS types) AS pools
+"""
+
+
+def searches(rows):
+    """
+    return -- The query string generator of every kind of search
+    """
+
+    def serial():
+        return random.randint(1, rows)
+
+    def name(i):
+        return f"{WORDS[i // 5 % 10]}_{WORDS[i // 50 % 10]}_{i}"
+
+    def exact_name():
+        i = serial()
+        return dict(q=f"{name(i)}.{EXTENSIONS[i % 5][0]}")
+
+    return {
+        "exact_name": exact_name,
+        "rare_prefix": lambda: dict(q=name(serial())),
+        "common_prefix": lambda: dict(q=random.choice(WORDS)[:random.randint(1, 4)]),
+        "common_substring": lambda: dict(q="_" + random.choice(WORDS) + "_"),
+        "rare_substring": lambda: dict(q=f"_{serial()}."),
+        "type": lambda: dict(type=random.choice(EXTENSIONS)[1]),
+        "top_level_type": lambda: dict(type=random.choice(["image/*", "text/*", "application/*"])),
+        "prefix_and_type": lambda: dict(q=random.choice(WORDS), type=random.choice(EXTENSIONS)[1]),
+        "next_page": None,
+    }
+
+
+def fill(db, rows, force=False):
+    """
+    Fills the table with the generated files, unless it already holds them or the fill is forced.
+    """
+
+    from sqlalchemy import text
+
+    count = db.session.execute(text("SELECT count(*) FROM filemetadata.filemetadata")).scalar()
+    if count == rows and not force:
+        return
+
+    print(f"Filling {rows} rows...")
+    db.session.execute(text("TRUNCATE filemetadata.filemetadata, filemetadata.job"))
+    db.session.execute(text("SET LOCAL statement_timeout = 0"))
+    db.session.execute(text(FILL), dict(rows=rows, words=WORDS, extensions=[ext for ext, _ in EXTENSIONS],
+                                        types=[type_ for _, type_ in EXTENSIONS]))
+    db.session.commit()
+
+    with db.engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.execute(text("SET statement_timeout = 0"))
+        connection.execute(text("VACUUM ANALYZE filemetadata.filemetadata"))
+
+
+def main(args):
+    os.environ["DB_NAME"] = args.db_name
+    subprocess.run([sys.executable, "migrate.py", "db", "upgrade"], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    from sqlalchemy import text
+    from app.config import connex_app
+    from fileupload.models import db
+
+    random.seed(0)
+    results = {}
+
+    with connex_app.app.app_context():
+        fill(db, args.rows, args.refill)
+        trigram = db.session.execute(text(
+            "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_filemetadata_search_trgm'"
+        )).scalar() is not None
+        db.session.remove()
+
+    print(f"trigram index: {'yes' if trigram else 'no, the substring searches are skipped'}")
+
+    with connex_app.app.test_client() as client:
+        for kind, params in searches(args.rows).items():
+            if kind.endswith("_substring") and not trigram:
+                continue
+
+            latencies = []
+
+            for attempt in range(args.warmup + args.searches):
+                if kind == "next_page":
+                    query = dict(q=random.choice(WORDS))
+                    first = client.get("/service/fileupload/search", query_string=query)
+                    query["cursor"] = first.headers["X-Next-Cursor"]
+                else:
+                    query = params()
+
+                started = time.perf_counter()
+                response = client.get("/service/fileupload/search", query_string=query)
+                elapsed = time.perf_counter() - started
+
+                if response.status_code != 200:
+                    raise RuntimeError(f"{kind} {query}: {response.status_code} {response.get_data(as_text=True)}")
+                if attempt >= args.warmup:
+                    latencies.append(elapsed)
+
+            results[kind] = baseline.percentiles(latencies)
+
+    over = []
+    for kind, result in results.items():
+        flag = "  OVER BUDGET" if result["p95"] > args.budget else ""
+        if flag:
+            over.append(kind)
+        print(f"{kind:18} " + "  ".join(f"{metric} {value * 1000:.3g} ms" for metric, value in result.items()) + flag)
+
+    if args.save:
+        baseline.save(args.save, results, rows=args.rows, searches=args.searches, budget=args.budget,
+                      trigram=trigram)
+
+    regressions = baseline.compare(args.compare, results, args.tolerance) if args.compare else []
+    sys.exit(1 if over or regressions else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=ROWS, help="The number of files of the table")
+    parser.add_argument("--searches", type=int, default=200, help="The number of searches of every kind")
+    parser.add_argument("--warmup", type=int, default=20, help="The number of searches of every kind not measured")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="The seconds of the p95 of every kind")
+    parser.add_argument("--refill", action="store_true", help="Whether the table is filled again, as the files changed")
+    parser.add_argument("--db-name", default="fileservice_bench_search", help="The scratch database of the rows")
+    parser.add_argument("--save", help="The JSON file the results are saved to")
+    parser.add_argument("--compare", help="The JSON file of the baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="The relative change of a regression")
+    main(parser.parse_args())
@@ -0,0 +1,156 @@
+"""
+The benchmark of the serialization of the file metadata, comparing the FileMetadataSchema dump of the
+ORM objects with the fast path of fileupload.serialize, the column tuples encoded by orjson.
+
+The first rows of the filemetadata table are read by id and encoded one per line, as the ndjson listing
+of GET /service/fileupload streams them, with the query, the mapping and the encoding measured together.
+The table of a scratch database (created and migrated on the configured PostgreSQL server, then reused
+by the next runs) is filled with generated rows first. Every path reports its rows and MiB per second,
+and the peak resident memory of the run.
+
+Examples:
+
+$ python benchmarks/bench_serialize.py --save serialize.json
+-- 1k, 100k and 1M rows, saved as a baseline
+
+$ python benchmarks/bench_serialize.py --rows 1000,100000 --compare serialize.json
+-- The two smaller runs again, compared with the baseline
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import baseline
+
+ROWS = (1000, 100000, 1000000)
+PAGE_SIZE = 100
+
+FILL = """
+    INSERT INTO filemetadata.filemetadata
+        (size, file_name, sha1, md5, type, encoding, analyzed_at, stored_size, compression)
+    SELECT i::bigint * 7919 % 1000000, 'file_' || i || '.txt',
+           decode(md5(i::text) || left(md5((-i)::text), 8), 'hex'), decode(md5((i + 1)::text || 'x'), 'hex'),
+           'text/plain', 'us-ascii', now(), i::bigint * 7919 % 1000000, NULL
+    FROM generate_series(1, :rows) AS i
+"""
+
+
+def schema_path(rows):
+    """
+    The path replaced: ORM objects dumped by the marshmallow ModelSchema, encoded by json
+    """
+
+    from fileupload.models import FileMetadata, FileMetadataSchema
+
+    schema = FileMetadataSchema()
+    files = FileMetadata.query.order_by(FileMetadata.id).limit(rows).yield_per(PAGE_SIZE)
+    size = 0
+
+    for file in files:
+        data = schema.dump(file)
+        data.pop('id')
+        size += len((json.dumps(data) + "\n").encode())
+
+    return size
+
+
+def fast_path(rows):
+    """
+    The column tuples of fileupload.serialize, encoded by orjson when it is installed
+    """
+
+    from fileupload import serialize
+    from fileupload.models import FileMetadata
+
+    query = FileMetadata.query.with_entities(*serialize.COLUMNS).order_by(FileMetadata.id).limit(rows)
+    size = 0
+
+    for row in query.yield_per(PAGE_SIZE):
+        size += len(serialize.dumps(serialize.dump(row)) + b"\n")
+
+    return size
+
+
+def fill(db, rows):
+    """
+    Fills the table with the generated rows, unless it already holds them.
+    """
+
+    from sqlalchemy import text
+
+    count = db.session.execute(text("SELECT count(*) FROM filemetadata.filemetadata")).scalar()
+    if count == rows:
+        return
+
+    print(f"Filling {rows} rows...")
+    db.session.execute(text("TRUNCATE filemetadata.filemetadata, filemetadata.job"))
+    db.session.execute(text(FILL), dict(rows=rows))
+    db.session.commit()
+    db.session.execute(text("ANALYZE filemetadata.filemetadata"))
+    db.session.commit()
+
+
+def main(args):
+    os.environ["DB_NAME"] = args.db_name
+    subprocess.run([sys.executable, "migrate.py", "db", "upgrade"], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    from app.config import connex_app
+    from fileupload import serialize
+    from fileupload.models import db
+
+    paths = {"schema": schema_path, "fast": fast_path}
+    results = {}
+
+    with connex_app.app.app_context():
+        fill(db, max(args.rows))
+
+        for rows in args.rows:
+            for name, path in paths.items():
+                path(min(rows, 1000))
+                db.session.expunge_all()
+
+                with baseline.RssSampler(interval=0.1) as rss:
+                    started = time.perf_counter()
+                    size = path(rows)
+                    elapsed = time.perf_counter() - started
+
+                db.session.expunge_all()
+                results[f"{name}[{rows}]"] = dict(
+                    rows_per_s=rows / elapsed, mib_per_s=size / elapsed / 1048576, seconds=elapsed,
+                    rss_bytes=rss.peak,
+                )
+
+    print(f"encoder: {'orjson' if serialize.orjson else 'json'}")
+    for name, result in results.items():
+        print(f"{name:20} " + "  ".join(f"{metric} {value:.4g}" for metric, value in result.items()))
+
+    for rows in args.rows:
+        speedup = results[f"fast[{rows}]"]["rows_per_s"] / results[f"schema[{rows}]"]["rows_per_s"]
+        print(f"{rows} rows: {speedup:.1f}x faster")
+
+    if args.save:
+        baseline.save(args.save, results, rows=args.rows, db_name=args.db_name)
+
+    if args.compare:
+        regressions = baseline.compare(args.compare, results, args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=lambda value: [int(rows) for rows in value.split(",")], default=list(ROWS),
+                        help="The comma separated numbers of rows")
+    parser.add_argument("--db-name", default="fileservice_bench_serialize", help="The scratch database of the rows")
+    parser.add_argument("--save", help="The JSON file the results are saved to")
+    parser.add_argument("--compare", help="The JSON file of the baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="The relative change of a regression")
+    main(parser.parse_args())
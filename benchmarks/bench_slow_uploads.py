@@ -0,0 +1,140 @@
+"""
+The load benchmark of the serving modes, many slow clients uploading at the same time.
+
+Every client sends its own multipart upload in small pieces with a pause between them, while a probe
+measures the latency of GET / on the same server. Start the server in the mode to measure, then run
+the benchmark against it. The uploaded files are deleted at the end.
+
+Examples:
+
+$ gunicorn app_docker:connex_app -b 127.0.0.1:8000 -w 4
+$ python benchmarks/bench_slow_uploads.py --url http://127.0.0.1:8000
+-- The sync mode, 4 workers
+
+$ gunicorn app_asgi:application -b 127.0.0.1:8000 -w 4 -k uvicorn.workers.UvicornWorker
+$ python benchmarks/bench_slow_uploads.py --url http://127.0.0.1:8000 --clients 1000
+-- The async mode, 4 workers
+
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+from urllib.parse import urlsplit
+
+BOUNDARY = "benchslowuploads"
+
+
+async def http_request(host, port, method, path, body=b"", content_type=None, piece=None, delay=0):
+    """
+    Sends one HTTP/1.1 request, the body in pieces of the given size with a pause between them.
+
+    return -- The status code of the response
+    """
+
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        headers = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\nContent-Length: {len(body)}\r\n"
+        if content_type:
+            headers += f"Content-Type: {content_type}\r\n"
+        writer.write(headers.encode() + b"\r\n")
+
+        piece = piece or len(body) or 1
+        for start in range(0, len(body), piece):
+            writer.write(body[start:start + piece])
+            await writer.drain()
+            if delay:
+                await asyncio.sleep(delay)
+
+        status = int((await reader.readline()).split()[1])
+        length = None
+
+        line = await reader.readline()
+        while line not in (b"\r\n", b""):
+            name, _, value = line.decode("latin1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+            line = await reader.readline()
+
+        # The response is read up to its length, some servers keep the connection open a while
+        await (reader.readexactly(length) if length is not None else reader.read())
+
+        return status
+    finally:
+        writer.close()
+
+
+async def upload(host, port, index, args):
+    content = hashlib.sha1(str(index).encode()).digest() * (args.size // 20)
+    body = (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="upfile"; filename="slow_{index}.bin"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + content + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+    started = time.perf_counter()
+    try:
+        status = await http_request(host, port, "POST", "/service/fileupload", body,
+                                    f"multipart/form-data; boundary={BOUNDARY}", args.piece, args.delay)
+    except OSError:
+        status = None
+
+    return status, time.perf_counter() - started, hashlib.sha1(content).hexdigest()
+
+
+async def probe(host, port, done, latencies):
+    while not done.is_set():
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(http_request(host, port, "GET", "/"), 60)
+            latencies.append(time.perf_counter() - started)
+        except (OSError, asyncio.TimeoutError):
+            latencies.append(float("inf"))
+        await asyncio.sleep(0.1)
+
+
+def percentiles(values):
+    values = sorted(values)
+    return values[len(values) // 2], values[min(len(values) - 1, int(len(values) * 0.99))], values[-1]
+
+
+async def main(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+
+    done = asyncio.Event()
+    probes = []
+    probing = asyncio.ensure_future(probe(host, port, done, probes))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[upload(host, port, index, args) for index in range(args.clients)])
+    elapsed = time.perf_counter() - started
+
+    done.set()
+    await probing
+
+    uploaded = [result for result in results if result[0] == 201]
+    print(f"{args.clients} clients uploading {args.size} bytes in pieces of {args.piece} every {args.delay}s")
+    print(f"uploads        {len(uploaded)} ok / {len(results) - len(uploaded)} failed in {elapsed:.1f}s "
+          f"({sum(args.size for _ in uploaded) / elapsed / 1048576:.1f} MiB/s)")
+    if uploaded:
+        print("upload latency p50 {:8.2f} s   p99 {:8.2f} s   max {:8.2f} s".format(
+            *percentiles([result[1] for result in uploaded])))
+    print("probe latency  p50 {:8.1f} ms  p99 {:8.1f} ms  max {:8.1f} ms".format(
+        *[value * 1000 for value in percentiles(probes)]))
+
+    for sha1 in sorted(set(result[2] for result in uploaded)):
+        for _ in range(sum(1 for result in uploaded if result[2] == sha1)):
+            await http_request(host, port, "DELETE", f"/service/fileupload/{sha1}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("BENCH_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--clients", type=int, default=200, help="The number of concurrent uploads")
+    parser.add_argument("--size", type=int, default=1048576, help="The size of every file")
+    parser.add_argument("--piece", type=int, default=65536, help="The bytes sent at once by a client")
+    parser.add_argument("--delay", type=float, default=0.05, help="The seconds between two pieces")
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,137 @@
+"""
+The benchmark of the startup of the service, against a startup-time budget.
+
+A cold start runs a new interpreter, as a new container does: it imports app_docker, then serves its first
+requests, GET / and a first database query through GET /service/fileupload. A preloaded start forks a worker
+from a process that already imported the application, as the gunicorn master does with preload_app, and
+measures the time from the fork to the first response of the worker. Every start is repeated, and the run
+exits with 1 when the p95 of a start exceeds its budget.
+
+Examples:
+
+$ python benchmarks/bench_startup.py
+-- 5 cold and 20 preloaded starts, against the default budgets
+
+$ python benchmarks/bench_startup.py --budget 1.5 --fork-budget 0.1 --save startup.json
+-- Other budgets, with the results saved as a baseline
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import baseline
+
+BUDGET = 2.0
+FORK_BUDGET = 0.25
+
+COLD = """
+import json, time
+started = time.perf_counter()
+
+import app_docker
+imported = time.perf_counter()
+
+with app_docker.connex_app.app.test_client() as client:
+    client.get("/")
+    index = time.perf_counter()
+    client.get("/service/fileupload?limit=1")
+    query = time.perf_counter()
+
+print(json.dumps(dict(imported=imported - started, index=index - started, query=query - started)))
+"""
+
+PRELOADED = """
+import json, os, sys, time
+
+import app_docker
+
+for _ in range(int(sys.argv[1])):
+    forked = time.perf_counter()
+    pid = os.fork()
+
+    if pid == 0:
+        with app_docker.connex_app.app.test_client() as client:
+            client.get("/")
+            index = time.perf_counter()
+            client.get("/service/fileupload?limit=1")
+            query = time.perf_counter()
+
+        print(json.dumps(dict(index=index - forked, query=query - forked)), flush=True)
+        os._exit(0)
+
+    os.waitpid(pid, 0)
+"""
+
+
+def run(script, *args):
+    """
+    return -- The JSON lines printed by a script run in a new interpreter, and its wall time
+    """
+
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-W", "ignore", "-c", script, *args], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    elapsed = time.perf_counter() - started
+
+    return [json.loads(line) for line in output.splitlines() if line.startswith("{")], elapsed
+
+
+def summary(samples, metric):
+    return baseline.percentiles([sample[metric] for sample in samples])
+
+
+def main(args):
+    cold = []
+
+    for _ in range(args.cold):
+        (sample,), elapsed = run(COLD)
+        cold.append(dict(sample, process=elapsed))
+
+    preloaded, _ = run(PRELOADED, str(args.forks))
+
+    results = {
+        "cold_import": summary(cold, "imported"),
+        "cold_first_response": summary(cold, "index"),
+        "cold_first_query": summary(cold, "query"),
+        "cold_process": summary(cold, "process"),
+        "preloaded_first_response": summary(preloaded, "index"),
+        "preloaded_first_query": summary(preloaded, "query"),
+    }
+    budgets = {"cold_first_response": args.budget, "preloaded_first_response": args.fork_budget}
+    over = []
+
+    for name, result in results.items():
+        budget = budgets.get(name)
+        flag = ""
+        if budget is not None:
+            flag = f"  budget {budget:.3g}" + ("  OVER BUDGET" if result["p95"] > budget else "")
+            if result["p95"] > budget:
+                over.append(name)
+        print(f"{name:28} " + "  ".join(f"{metric} {value:.4g}" for metric, value in result.items()) + flag)
+
+    if args.save:
+        baseline.save(args.save, results, cold=args.cold, forks=args.forks, budgets=budgets)
+
+    regressions = baseline.compare(args.compare, results, args.tolerance) if args.compare else []
+    sys.exit(1 if over or regressions else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cold", type=int, default=5, help="The number of cold starts")
+    parser.add_argument("--forks", type=int, default=20, help="The number of preloaded starts")
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("STARTUP_BUDGET", BUDGET)),
+                        help="The seconds of a cold start to its first response")
+    parser.add_argument("--fork-budget", type=float, default=float(os.environ.get("STARTUP_FORK_BUDGET", FORK_BUDGET)),
+                        help="The seconds of a preloaded start to its first response")
+    parser.add_argument("--save", help="The JSON file the results are saved to")
+    parser.add_argument("--compare", help="The JSON file of the baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="The relative change of a regression")
+    main(parser.parse_args())
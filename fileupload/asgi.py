@@ -0,0 +1,514 @@
+"""
+The asynchronous serving mode of the API server.
+
+The upload endpoints are served natively: the request bodies are read from the event loop as they
+arrive, while the multipart parsing, the hashing and the disk writes run in a thread pool, and the
+metadata is written with asyncpg through a pool of connections. A slow client then only costs a
+coroutine, so thousands of concurrent uploads share a few processes. Every other endpoint is
+delegated to the connexion application running in the same thread pool.
+
+Every upload is admitted before its body is read, also the batches and the session completions delegated
+to the connexion application, whose adapter reads the whole body before the Flask hooks run.
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from multipart.multipart import MultipartParser, parse_options_header
+
+from app import admission, logs, metrics
+from fileupload import ingest
+from fileupload.ingest import BLOCK_SIZE
+from fileupload.sessions import SessionNotFound, InvalidChunk, ChunkConflict
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+IO_THREADS = 32
+DB_POOL_MIN_SIZE = 2
+DB_POOL_MAX_SIZE = 10
+
+UPLOAD_PATH = "/service/fileupload"
+BATCH_PATH = "/service/fileupload/batch"
+CHUNK_PATH = re.compile(r"^/service/fileupload/sessions/(?P<session_id>[^/]+)/chunks/(?P<chunk_index>[0-9]+)$")
+COMPLETE_PATH = re.compile(r"^/service/fileupload/sessions/[^/]+/complete$")
+
+INSERT_FILE = """
+    INSERT INTO filemetadata.filemetadata (size, file_name, sha1, md5, type, tree_hash, tree_chunk_size, chunk_hashes)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8) RETURNING id
+"""
+ENQUEUE_JOB = """
+    INSERT INTO filemetadata.job (file_id, kind, max_attempts) VALUES ($1, $2, $3)
+"""
+REFERENCE_BLOB = """
+    INSERT INTO filemetadata.fileblob (sha1, ref_count) VALUES ($1, 1)
+    ON CONFLICT (sha1) DO UPDATE SET ref_count = fileblob.ref_count + 1
+    RETURNING ref_count
+"""
+RECORD_STORAGE = """
+    UPDATE filemetadata.filemetadata SET stored_size = $2, compression = $3 WHERE id = $1
+"""
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, detail):
+        """
+        An error response, in the problem format of connexion
+
+        Arguments:
+            status -- The HTTP status code
+            detail -- The error message
+        """
+
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class MultipartUpload:
+
+    def __init__(self, boundary, stream, field="upfile"):
+        """
+        The push parser of a multipart body, feeding the content of one file part to a stream ingest
+
+        Arguments:
+            boundary -- The boundary of the multipart body
+            stream -- The StreamIngest of the file
+            field -- The name of the file part
+        """
+
+        self.stream = stream
+        self.field = field
+        self.file_name = None
+        self.found = False
+        self.in_file = False
+        self.header_field = b""
+        self.header_value = b""
+        self.headers = {}
+
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+        })
+
+    def on_part_begin(self):
+        self.headers = {}
+        self.in_file = False
+
+    def on_header_field(self, data, start, end):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = self.header_value = b""
+
+    def on_headers_finished(self):
+        disposition, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+
+        # Only the first part of the file field is ingested, like the request.files of the sync mode
+        if options.get(b"name") == self.field.encode() and b"filename" in options and not self.found:
+            self.found = self.in_file = True
+            self.file_name = options[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(self, data, start, end):
+        if self.in_file:
+            self.stream.feed(data[start:end])
+
+    def write(self, buf):
+        self.parser.write(buf)
+
+
+class AsyncFileUpload:
+
+    def __init__(self, wsgi_app, fileupload, dsn, io_threads=IO_THREADS,
+                 pool_min_size=DB_POOL_MIN_SIZE, pool_max_size=DB_POOL_MAX_SIZE,
+                 pool_options=None, local_statement_timeout=None):
+        """
+        The ASGI application of the asynchronous serving mode
+
+        Arguments:
+            wsgi_app -- The connexion WSGI application serving the other endpoints
+            fileupload -- The FileUpload object, for its storage, staging directory and file type detection
+            dsn -- The PostgreSQL connection string of asyncpg
+            io_threads -- The size of the thread pool of the file I/O, the hashing and the WSGI endpoints
+            pool_min_size -- The number of connections kept open by the asyncpg pool
+            pool_max_size -- The maximum number of connections of the asyncpg pool
+            pool_options -- The other keyword arguments of asyncpg.create_pool
+            local_statement_timeout -- The statement timeout set by every transaction, for PgBouncer
+        """
+
+        if asyncpg is None:
+            raise RuntimeError("The asynchronous serving mode requires asyncpg")
+
+        self.fileupload = fileupload
+        self.dsn = dsn
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self.pool_options = pool_options or {}
+        self.local_statement_timeout = local_statement_timeout
+        self.executor = ThreadPoolExecutor(io_threads, thread_name_prefix="fileupload-io")
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        self.pool = None
+        self.pool_lock = None
+        self.logger = logging.getLogger("fileupload")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        operation = self.upload_operation(scope) if scope["type"] == "http" else None
+
+        if operation is not None:
+            started = time.perf_counter()
+            status = 500
+            ticket = None
+            admitted = delegated = False
+
+            try:
+                # The event loop must not block, an upload over the limits is shed instead of queued
+                ticket = admission.ADMISSION.admit(
+                    admission.body_length(operation, self.content_length(scope)), wait=False
+                )
+                admitted = True
+
+                if self.native(scope):
+                    status = await self.dispatch(scope, receive, send)
+                else:
+                    # The Flask hooks of the delegated upload, run in a copy of this context, do not admit it again
+                    token = admission.ADMITTED.set(True)
+                    delegated = True
+                    try:
+                        return await self.wsgi(scope, receive, send)
+                    finally:
+                        admission.ADMITTED.reset(token)
+            except admission.Rejected as e:
+                status = e.status
+                await self.respond(send, e.status, e.problem(), content_type=b"application/problem+json",
+                                   headers=e.headers())
+            except ConnectionError:
+                status = 499
+                self.logger.warning("Client disconnected during %s %s", scope['method'], scope['path'])
+            except HTTPError as e:
+                status = e.status
+                await self.respond(send, e.status, {
+                    "detail": e.detail, "status": e.status, "title": e.__class__.__name__, "type": "about:blank"
+                }, content_type=b"application/problem+json")
+            finally:
+                if admitted:
+                    admission.ADMISSION.release(ticket)
+                # The native and the shed uploads bypass the Flask hooks, they are counted and timed here
+                if not delegated:
+                    metrics.observe_request(operation, scope["method"], status, time.perf_counter() - started)
+
+            return
+
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                self.fileupload.init_logging()
+                await self.connect()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.pool is not None:
+                    await self.pool.close()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def connect(self):
+        """
+        return -- The asyncpg pool of the process, created on first use
+        """
+
+        if self.pool_lock is None:
+            self.pool_lock = asyncio.Lock()
+
+        async with self.pool_lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(
+                    self.dsn, min_size=self.pool_min_size, max_size=self.pool_max_size, **self.pool_options
+                )
+
+        return self.pool
+
+    @staticmethod
+    def upload_operation(scope):
+        """
+        return -- The name of the upload operation of the request, None if it is not an upload
+        """
+
+        path = scope["path"].rstrip("/")
+
+        if scope["method"] == "POST":
+            if path == UPLOAD_PATH:
+                return "upload_file"
+            if path == BATCH_PATH:
+                return "upload_batch"
+            if COMPLETE_PATH.match(path):
+                return "complete_session"
+        elif scope["method"] == "PUT" and CHUNK_PATH.match(path):
+            return "upload_chunk"
+
+        return None
+
+    @staticmethod
+    def native(scope):
+        """
+        return -- Whether the request is served natively, the others are delegated to the WSGI application
+        """
+
+        headers = dict(scope["headers"])
+
+        if scope["method"] == "POST" and scope["path"].rstrip("/") == UPLOAD_PATH:
+            return headers.get(b"content-type", b"").startswith(b"multipart/form-data")
+
+        return scope["method"] == "PUT" and CHUNK_PATH.match(scope["path"]) is not None
+
+    @staticmethod
+    def content_length(scope):
+        """
+        return -- The Content-Length of the request, None if it is missing or invalid
+        """
+
+        try:
+            return int(dict(scope["headers"])[b"content-length"])
+        except (KeyError, ValueError):
+            return None
+
+    async def dispatch(self, scope, receive, send):
+        if scope["method"] == "POST":
+            status, body = await self.upload_file(scope, receive)
+        else:
+            match = CHUNK_PATH.match(scope["path"])
+            status, body = await self.upload_chunk(
+                match.group("session_id"), int(match.group("chunk_index")), receive
+            )
+
+        await self.respond(send, status, body)
+
+        return status
+
+    async def run(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    @staticmethod
+    async def receive_blocks(receive):
+        """
+        Reads a request body from the event loop.
+
+        Argument:
+            receive -- The ASGI receive callable
+
+        return -- An asynchronous iterator over blocks of up to BLOCK_SIZE bytes
+        """
+
+        buf = bytearray()
+        more_body = True
+
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ConnectionError("Client disconnected")
+
+            buf += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if len(buf) >= BLOCK_SIZE or not more_body:
+                yield bytes(buf)
+                buf = bytearray()
+
+    async def upload_file(self, scope, receive):
+        """
+        The asynchronous version of the POST request to upload a file, with the same claimed
+        sha1, md5 and size query parameters. The multipart body is parsed as it arrives.
+
+        Arguments:
+            scope -- The ASGI scope of the request
+            receive -- The ASGI receive callable
+
+        responses:
+            201 -- The uploaded file metadata information
+            400 -- No upfile part
+            403 -- Invalid metadata
+            422 -- The content does not match the claimed size or hashes
+        """
+
+        query = {key: values[0] for key, values in parse_qs(scope["query_string"].decode()).items()}
+        claimed = dict(file_sha1=query.get("sha1"), file_md5=query.get("md5"), file_size=query.get("size"))
+
+        try:
+            if claimed["file_size"] is not None:
+                claimed["file_size"] = int(claimed["file_size"])
+        except ValueError:
+            raise HTTPError(400, "The size must be an integer!")
+
+        _, options = parse_options_header(dict(scope["headers"]).get(b"content-type", b""))
+        if not options.get(b"boundary"):
+            raise HTTPError(400, "Missing multipart boundary!")
+
+        stream = await self.run(lambda: ingest.StreamIngest(self.fileupload.staging_dir(), claimed=claimed))
+        upload = MultipartUpload(options[b"boundary"], stream)
+
+        # The body is hashed as it arrives, the time spent waiting for the client is the receive stage
+        started = time.perf_counter()
+        hashing = 0.0
+
+        try:
+            async for buf in self.receive_blocks(receive):
+                written = time.perf_counter()
+                await self.run(upload.write, buf)
+                hashing += time.perf_counter() - written
+
+            if not upload.found:
+                raise HTTPError(400, "Missing upfile part!")
+
+            finished = time.perf_counter()
+            metadata = await self.run(stream.finish)
+            hashing += time.perf_counter() - finished
+
+            metrics.observe_stage("receive", time.perf_counter() - started - hashing)
+            metrics.observe_stage("hash", hashing)
+        except ingest.ContentMismatch as e:
+            stream.discard()
+            self.logger.error("Content mismatch! %s: %s", upload.file_name, e)
+            raise HTTPError(422, "The content does not match the claimed size or hashes!")
+        except BaseException:
+            stream.discard()
+            raise
+
+        metadata["file_name"] = upload.file_name
+        metrics.INGESTED_BYTES.labels("upload_file").inc(metadata["file_size"])
+
+        with metrics.stage("sniff"):
+            metadata["file_type"] = await self.run(self.fileupload.extract_file_type, bytes(stream.header))
+
+        try:
+            return await self.create_file(metadata, stream.path)
+        finally:
+            ingest.discard(stream.path)
+
+    async def create_file(self, metadata, staging_path):
+        """
+        Adds the metadata of an ingested file and a reference to its content in one transaction,
+        then moves its staging file to the storage and queues its analysis.
+
+        Arguments:
+            metadata -- The metadata extracted from the file
+            staging_path -- The staging file of the file
+
+        return -- The status and the body of the response
+        """
+
+        data = {
+            "analyzed_at": None,
+            "description": None,
+            "encoding": None,
+            "file_name": metadata["file_name"],
+            "md5": metadata["file_md5"],
+            "sha1": metadata["file_sha1"],
+            "size": metadata["file_size"],
+            "type": metadata["file_type"],
+            "tree_hash": metadata.get("file_tree_hash"),
+            "tree_chunk_size": metadata.get("tree_chunk_size"),
+        }
+        pool = await self.connect()
+
+        try:
+            async with pool.acquire() as connection:
+                with metrics.stage("commit"):
+                    async with connection.transaction():
+                        if self.local_statement_timeout:
+                            await connection.execute(
+                                f"SET LOCAL statement_timeout = {int(self.local_statement_timeout)}"
+                            )
+                        file_id = await connection.fetchval(
+                            INSERT_FILE, data["size"], data["file_name"], bytes.fromhex(data["sha1"]),
+                            bytes.fromhex(data["md5"]), data["type"],
+                            bytes.fromhex(data["tree_hash"]) if data["tree_hash"] else None,
+                            data["tree_chunk_size"], metadata.get("file_chunk_hashes")
+                        )
+                        references = await connection.fetchval(REFERENCE_BLOB, bytes.fromhex(data["sha1"]))
+        except (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError):
+            self.logger.error("Invalid metadata! %s", logs.Fields(metadata))
+            raise HTTPError(403, "Invalid metadata!")
+
+        with metrics.stage("store"):
+            data["stored_size"], data["compression"] = await self.run(
+                self.fileupload.save_to_host, data["sha1"], staging_path, data["type"], data["size"]
+            )
+            # The analysis job is only visible to the workers once the content can be read
+            async with pool.acquire() as connection, connection.transaction():
+                await connection.execute(RECORD_STORAGE, file_id, data["stored_size"], data["compression"])
+                if self.fileupload.analyze:
+                    await connection.execute(ENQUEUE_JOB, file_id, "analyze", self.fileupload.jobs.max_attempts)
+
+        # A lookup between the two transactions may have cached the first file of a new content without its stored size
+        if references == 1:
+            await self.run(self.fileupload.cache.invalidate, data["md5"], data["sha1"])
+
+        self.logger.info("File uploaded! %s", logs.Fields(data))
+
+        return 201, data
+
+    async def upload_chunk(self, session_id, chunk_index, receive):
+        """
+        The asynchronous version of the PUT request of one chunk of an upload session.
+        The chunk is received from the event loop and written by the thread pool.
+
+        Arguments:
+            session_id -- The id of the upload session
+            chunk_index -- The index of the chunk, starting at 0
+            receive -- The ASGI receive callable
+
+        responses:
+            201 -- The offset and the length of the written chunk
+            403 -- Invalid chunk index or length
+            404 -- Session not found
+            409 -- The chunk was already received with other bytes
+        """
+
+        chunk = b"".join([buf async for buf in self.receive_blocks(receive)])
+        metrics.INGESTED_BYTES.labels("upload_chunk").inc(len(chunk))
+
+        try:
+            return 201, await self.run(self.fileupload.sessions.write_chunk, session_id, chunk_index, chunk)
+        except InvalidChunk as e:
+            self.logger.error("Invalid chunk for session %s! %s", session_id, e)
+            raise HTTPError(403, "Invalid chunk index or length!")
+        except ChunkConflict as e:
+            self.logger.error("Conflicting chunk for session %s! %s", session_id, e)
+            raise HTTPError(409, "The chunk was already received with other bytes!")
+        except SessionNotFound:
+            raise HTTPError(404, "Session not found!")
+
+    @staticmethod
+    async def respond(send, status, body, content_type=b"application/json", headers=None):
+        payload = json.dumps(body, sort_keys=True).encode() + b"\n"
+        extra = [(name.lower().encode(), str(value).encode()) for name, value in (headers or {}).items()]
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(payload)).encode())] + extra,
+        })
+        await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,148 @@
+"""
+The batch ingest of many files sent in a single request.
+
+The files arrive either as many multipart parts or as one tar or zip archive expanded on the fly.
+Every file goes through the single pass streaming ingest into its own staging file. Multipart parts
+and zip members are ingested by a pool of threads, hashlib and zlib release the GIL on large blocks.
+Tar archives are read as a stream, so their members are ingested one after the other.
+"""
+
+import tarfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from fileupload import ingest
+
+MAX_FILES = 10000
+WORKERS = 4
+
+ITEM_ERRORS = (OSError, EOFError, zlib.error, zipfile.BadZipFile, tarfile.TarError)
+
+
+class InvalidBatch(Exception):
+    """
+    The archive cannot be read or the batch holds too many files
+    """
+
+
+class BatchIngest:
+
+    def __init__(self, staging_dir=None, workers=WORKERS, max_files=MAX_FILES):
+        """
+        The ingest of the files of one batch
+
+        Arguments:
+            staging_dir -- The directory of the staging files
+            workers -- The number of files ingested at the same time
+            max_files -- The maximum number of files in a batch
+        """
+
+        self.staging_dir = staging_dir
+        self.workers = workers
+        self.max_files = max_files
+
+    def ingest(self, file_name, open_stream):
+        """
+        Ingests one file of the batch. A file that cannot be read does not fail the batch.
+
+        Arguments:
+            file_name -- The name of the file
+            open_stream -- A function returning the stream of the file
+
+        return -- The item of the file, with its metadata, header and staging path, or its error
+        """
+
+        try:
+            with ingest.StreamIngest(self.staging_dir) as stream:
+                stream.consume(open_stream())
+                metadata = stream.finish()
+        except ITEM_ERRORS as e:
+            return {"file_name": file_name, "error": str(e) or type(e).__name__}
+
+        metadata["file_name"] = file_name
+
+        return {"file_name": file_name, "metadata": metadata, "header": bytes(stream.header), "path": stream.path}
+
+    def check_count(self, count):
+        if count > self.max_files:
+            raise InvalidBatch(f"More than {self.max_files} files in the batch")
+
+    def ingest_files(self, upfiles):
+        """
+        Ingests the files of the multipart parts concurrently.
+
+        Argument:
+            upfiles -- The file objects of the parts
+
+        return -- The items of the files, in the order of the parts
+        """
+
+        self.check_count(len(upfiles))
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(lambda upfile: self.ingest(upfile.filename, lambda: upfile.stream), upfiles))
+
+    def ingest_archive(self, stream):
+        """
+        Expands a tar archive, optionally compressed, or a zip archive and ingests its regular files.
+
+        Argument:
+            stream -- The seekable stream of the archive
+
+        return -- The items of the files, in the order of the archive
+        """
+
+        if zipfile.is_zipfile(stream):
+            stream.seek(0)
+            return self.ingest_zip(stream)
+
+        stream.seek(0)
+        items = []
+
+        try:
+            with tarfile.open(fileobj=stream, mode="r|*") as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    self.check_count(len(items) + 1)
+                    items.append(self.ingest(member.name, lambda: archive.extractfile(member)))
+        except tarfile.TarError as e:
+            self.discard(items)
+            raise InvalidBatch(f"Invalid archive: {e}")
+        except InvalidBatch:
+            self.discard(items)
+            raise
+
+        return items
+
+    def ingest_zip(self, stream):
+        # The SpooledTemporaryFile of the multipart parser only has seekable() from Python 3.8
+        if not hasattr(stream, "seekable"):
+            stream = stream._file
+
+        try:
+            archive = zipfile.ZipFile(stream)
+        except zipfile.BadZipFile as e:
+            raise InvalidBatch(f"Invalid archive: {e}")
+
+        with archive:
+            members = [member for member in archive.infolist() if not member.is_dir()]
+            self.check_count(len(members))
+
+            # The members share the archive file, ZipFile serializes their reads and decompresses them in parallel
+            with ThreadPoolExecutor(self.workers) as executor:
+                return list(executor.map(lambda member: self.ingest(member.filename, lambda: archive.open(member)),
+                                         members))
+
+    @staticmethod
+    def discard(items):
+        """
+        Removes the staging files of the items that were not stored.
+
+        Argument:
+            items -- The items of the batch
+        """
+
+        for item in items:
+            ingest.discard(item.get("path"))
@@ -0,0 +1,227 @@
+"""
+The read-through cache of the file metadata looked up by hash.
+
+Every worker keeps a bounded LRU of the serialized metadata with a short ttl. An optional shared tier,
+any client speaking the Redis protocol, lets the gunicorn workers share their hits. Updates and
+deletions invalidate both tiers explicitly; the local tiers of the other workers expire with the ttl.
+
+A load that read a row before an update committed must not write it back after the invalidation.
+Every invalidation bumps the generation of the local tier, and a load started before it is not cached.
+In the shared tier the invalidated keys are replaced by tombstones for a few seconds, and the loads
+only add missing keys, so a load of any worker that overlaps an invalidation is not shared either.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+MAX_SIZE = 10000
+TTL = 5
+SHARED_TTL = 300
+TOMBSTONE_TTL = 10
+TOMBSTONE = "null"
+PREFIX = "fileupload:metadata:"
+
+
+class MetadataCache:
+
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL, shared=None, shared_ttl=SHARED_TTL, prefix=PREFIX,
+                 tombstone_ttl=TOMBSTONE_TTL):
+        """
+        A two tier cache of the file metadata
+
+        Arguments:
+            max_size -- The maximum number of entries of the local tier, 0 disables the local tier
+            ttl -- The seconds an entry stays in the local tier, and so the staleness of the other workers
+            shared -- A Redis protocol client for the shared tier, or None
+            shared_ttl -- The seconds an entry stays in the shared tier
+            prefix -- The prefix of the keys in the shared tier
+            tombstone_ttl -- The seconds an invalidated key is not shared again, longer than any load
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.prefix = prefix
+        self.tombstone_ttl = tombstone_ttl
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(["hits", "shared_hits", "misses", "evictions", "shared_errors", "stale_loads"], 0)
+
+    def get(self, key, loader=None):
+        """
+        Reads an entry, from the local tier, then the shared tier, then the loader.
+
+        Arguments:
+            key -- The key of the entry
+            loader -- A function returning the value of a missing entry, or None if it does not exist
+
+        return -- The value of the entry or None
+        """
+
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[1]
+            generation = self.generation
+
+        value = self.get_shared(key)
+        if value is not None:
+            self.count("shared_hits")
+            self.set_local(key, value, generation)
+            return value
+
+        self.count("misses")
+
+        if loader is None:
+            return None
+
+        value = loader()
+        if value is not None:
+            self.add(key, value, generation)
+
+        return value
+
+    def get_shared(self, key):
+        if self.shared is None:
+            return None
+
+        try:
+            raw = self.shared.get(self.prefix + key)
+        except Exception:
+            self.count("shared_errors")
+            return None
+
+        return None if raw is None else json.loads(raw)
+
+    def set_local(self, key, value, generation=None):
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            # The value was read before an invalidation of this worker, it may be stale
+            if generation is not None and generation != self.generation:
+                self.counters["stale_loads"] += 1
+                return
+
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def set(self, key, value):
+        """
+        Writes an entry in both tiers.
+
+        Arguments:
+            key -- The key of the entry
+            value -- A JSON serializable value
+        """
+
+        self.set_local(key, value)
+
+        if self.shared is not None:
+            try:
+                self.shared.set(self.prefix + key, json.dumps(value), ex=self.shared_ttl)
+            except Exception:
+                self.count("shared_errors")
+
+    def add(self, key, value, generation):
+        """
+        Writes the entry of a load in both tiers, unless it was invalidated since the load started.
+
+        Arguments:
+            key -- The key of the entry
+            value -- A JSON serializable value
+            generation -- The generation of the local tier when the load started
+        """
+
+        if self.shared is not None:
+            try:
+                added = self.shared.set(self.prefix + key, json.dumps(value), ex=self.shared_ttl, nx=True)
+            except Exception:
+                self.count("shared_errors")
+            else:
+                # The key holds a tombstone, or the entry of a concurrent load that is kept
+                if not added:
+                    self.count("stale_loads")
+                    return
+
+        self.set_local(key, value, generation)
+
+    def invalidate(self, *keys):
+        """
+        Removes entries from both tiers, the keys of the shared tier are replaced by tombstones.
+
+        Argument:
+            keys -- The keys of the entries
+        """
+
+        keys = [key for key in keys if key]
+
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+        if self.shared is not None and keys:
+            try:
+                pipeline = self.shared.pipeline(transaction=False)
+                for key in keys:
+                    pipeline.set(self.prefix + key, TOMBSTONE, ex=self.tombstone_ttl)
+                pipeline.execute()
+            except Exception:
+                self.count("shared_errors")
+
+    def stats(self):
+        """
+        return -- The counters of the cache and the size of the local tier
+        """
+
+        with self.lock:
+            return dict(self.counters, size=len(self.entries))
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+
+def create_cache(environ):
+    """
+    Creates the metadata cache configured by the environment.
+
+    Argument:
+        environ -- The environment variables
+
+    return -- The metadata cache
+    """
+
+    shared = None
+    redis_url = environ.get("REDIS_URL")
+
+    if redis_url:
+        if redis is None:
+            raise RuntimeError("The shared metadata cache requires the redis library")
+        shared = redis.Redis.from_url(redis_url, socket_timeout=0.1, socket_connect_timeout=0.1)
+
+    return MetadataCache(
+        max_size=int(environ.get("METADATA_CACHE_SIZE", MAX_SIZE)),
+        ttl=float(environ.get("METADATA_CACHE_TTL", TTL)),
+        shared=shared,
+        shared_ttl=int(environ.get("METADATA_CACHE_SHARED_TTL", SHARED_TTL)),
+        tombstone_ttl=int(environ.get("METADATA_CACHE_TOMBSTONE_TTL", TOMBSTONE_TTL)),
+    )
@@ -0,0 +1,251 @@
+"""
+The compression at rest of the stored contents.
+
+A content is compressed while it is streamed to the storage backend when STORAGE_COMPRESSION is
+set, without a compressed copy of its staging file, and decompressed block by block on every read,
+so neither side holds a whole file in memory:
+
+    gzip -- zlib in the gzip format, always available, the blobs can be read with zcat
+    zstd -- Zstandard, faster and smaller, it requires the zstandard package
+
+Contents whose type is already compressed (images, videos, archives...) and small contents are
+stored as they are, and so is a content whose first block does not shrink by at least MIN_SAVING.
+"""
+
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ("gzip", "zstd")
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+LEVELS = {"gzip": 6, "zstd": 3}
+MIN_SIZE = 4096
+MIN_SAVING = 0.1
+
+# The compression of the new contents, None when STORAGE_COMPRESSION is not set
+CODEC = os.environ.get("STORAGE_COMPRESSION", "none").lower()
+CODEC = None if CODEC in ("", "none") else CODEC
+LEVEL = int(os.environ["STORAGE_COMPRESSION_LEVEL"]) if os.environ.get("STORAGE_COMPRESSION_LEVEL") else None
+
+# The types detected by libmagic whose contents are already compressed
+COMPRESSED_PREFIXES = ("image/", "video/", "audio/")
+UNCOMPRESSED_TYPES = {"image/svg+xml", "image/bmp", "image/x-ms-bmp", "image/tiff", "audio/x-wav", "audio/wav"}
+COMPRESSED_TYPES = {
+    "application/gzip", "application/x-gzip", "application/zip", "application/x-bzip2", "application/x-xz",
+    "application/zstd", "application/x-zstd", "application/x-7z-compressed", "application/x-rar",
+    "application/vnd.rar", "application/x-lzip", "application/x-lzma", "application/java-archive",
+    "application/epub+zip", "application/pdf", "application/x-compress",
+}
+COMPRESSED_TYPE_PREFIXES = ("application/vnd.openxmlformats-officedocument.", "application/vnd.oasis.opendocument.")
+
+
+def check(codec):
+    """
+    Checks that a codec can be used.
+
+    Argument:
+        codec -- The name of the codec, None for no compression
+
+    return -- The codec
+    """
+
+    if codec is not None and codec not in CODECS:
+        raise ValueError(f"Unknown storage compression {codec}")
+    if codec == "zstd" and zstandard is None:
+        raise RuntimeError("The zstd storage compression requires zstandard")
+
+    return codec
+
+
+def compressible(file_type, size=None):
+    """
+    Tells if a content is worth compressing.
+
+    Arguments:
+        file_type -- The mime type detected by libmagic
+        size -- The size of the content in bytes
+
+    return -- False for small contents and already compressed types
+    """
+
+    if size is not None and size < MIN_SIZE:
+        return False
+
+    file_type = (file_type or "").lower()
+
+    if file_type in UNCOMPRESSED_TYPES:
+        return True
+
+    return not (file_type in COMPRESSED_TYPES or file_type.startswith(COMPRESSED_PREFIXES)
+                or file_type.startswith(COMPRESSED_TYPE_PREFIXES))
+
+
+def compressor(codec, level=LEVEL):
+    """
+    return -- A streaming compressor with the compress(buf) and flush() methods of zlib
+    """
+
+    level = LEVELS[codec] if level is None else level
+
+    if codec == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    elif codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+
+    raise ValueError(f"Unknown storage compression {codec}")
+
+
+def inflate(blocks, codec, block_size):
+    """
+    Decompresses the blocks of a compressed content. Every decompressed block is at most block_size
+    bytes long, so a highly compressed block does not expand in memory.
+
+    Arguments:
+        blocks -- An iterator over the blocks of the compressed content
+        codec -- The name of the codec
+        block_size -- The maximum size of the decompressed blocks
+
+    return -- An iterator over the decompressed blocks
+    """
+
+    if codec == "gzip":
+        decompress = zlib.decompressobj(31)
+
+        for block in blocks:
+            while block:
+                buf = decompress.decompress(block, block_size)
+                block = decompress.unconsumed_tail
+                yield buf
+    elif codec == "zstd":
+        yield from zstandard.ZstdDecompressor().read_to_iter(BlockReader(blocks), read_size=block_size,
+                                                                 write_size=block_size)
+    else:
+        raise ValueError(f"Unknown storage compression {codec}")
+
+
+class BlockReader:
+
+    def __init__(self, blocks):
+        """
+        A file-like object reading an iterator over blocks
+
+        Argument:
+            blocks -- An iterator over blocks of bytes
+        """
+
+        self.blocks = iter(blocks)
+        self.buf = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buf) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.buf += block
+
+        buf, self.buf = (self.buf, b"") if size < 0 else (self.buf[:size], self.buf[size:])
+        return buf
+
+
+class CompressingReader:
+
+    def __init__(self, source, codec, block_size, level=LEVEL):
+        """
+        A file-like object reading the compressed content of a stream, compressed block by block as it is read
+
+        Arguments:
+            source -- The file-like object of the content, opened in binary mode
+            codec -- The name of the codec
+            block_size -- The size of the blocks read from the source
+            level -- The compression level, the default of the codec if None
+        """
+
+        self.source = source
+        self.compress = compressor(codec, level)
+        self.block_size = block_size
+        self.buf = bytearray()
+        self.done = False
+        self.size = self.stored_size = 0
+
+    def read(self, size=-1):
+        while not self.done and (size is None or size < 0 or len(self.buf) < size):
+            block = self.source.read(self.block_size)
+
+            if block:
+                self.size += len(block)
+                self.buf += self.compress.compress(block)
+            else:
+                self.buf += self.compress.flush()
+                self.done = True
+
+        if size is None or size < 0 or size >= len(self.buf):
+            buf, self.buf = bytes(self.buf), bytearray()
+        else:
+            buf = bytes(self.buf[:size])
+            del self.buf[:size]
+
+        self.stored_size += len(buf)
+        return buf
+
+
+def compress_bytes(buf, codec, level=LEVEL):
+    """
+    return -- The compressed bytes of a content held in memory
+    """
+
+    compress = compressor(codec, level)
+    return compress.compress(buf) + compress.flush()
+
+
+def worth(size, stored_size):
+    """
+    return -- True if a compressed content saves at least MIN_SAVING of its size
+    """
+
+    return stored_size <= size * (1 - MIN_SAVING)
+
+
+def decompress(blocks, codec, block_size, start=0, length=None):
+    """
+    Decompresses the blocks of a stored content and slices a byte range of the original content.
+
+    Arguments:
+        blocks -- An iterator over the blocks of the compressed content
+        codec -- The name of the codec
+        block_size -- The maximum size of the decompressed blocks
+        start -- The offset of the first byte of the range in the original content
+        length -- The number of bytes of the range, up to the end if None
+
+    return -- An iterator over the blocks of the range
+    """
+
+    if length == 0:
+        return
+
+    skipped = start
+    remaining = length
+
+    try:
+        for buf in inflate(blocks, codec, block_size):
+            if skipped:
+                taken = min(skipped, len(buf))
+                buf = buf[taken:]
+                skipped -= taken
+
+            if remaining is not None:
+                buf = buf[:remaining]
+                remaining -= len(buf)
+
+            if buf:
+                yield buf
+
+            if remaining == 0:
+                return
+    finally:
+        # The rest of the content is not read, its file or its response is closed
+        if hasattr(blocks, "close"):
+            blocks.close()
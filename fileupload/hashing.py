@@ -0,0 +1,213 @@
+"""
+The hashing engine of the ingest pipeline.
+
+hashlib releases the GIL while it hashes a buffer of more than 2 KiB, so the digests of a file are
+computed by parallel threads over the same shared buffers: every block is handed to the md5, the sha1
+and the tree hashers at the same time, and a file on disk is memory-mapped and hashed in a few large
+updates. The optional tree hash is made of independent BLAKE2b digests of fixed-size chunks and of a
+root digest over them, so that the chunks of a transfer can be verified in parallel and on their own.
+"""
+
+import hashlib
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITHMS = ("md5", "sha1")
+THREADS = int(os.environ.get("HASH_THREADS", os.cpu_count() or 1))
+PARALLEL_MIN_SIZE = 262144
+TREE_CHUNK_SIZE = int(os.environ.get("TREE_CHUNK_SIZE", 8388608))
+TREE_DIGEST_SIZE = 32
+MAP_BLOCK_SIZE = 67108864
+
+# The chunk size of the tree hashes of the ingested files, None when TREE_HASH is disabled
+INGEST_TREE_CHUNK_SIZE = TREE_CHUNK_SIZE if os.environ.get("TREE_HASH", "0") == "1" else None
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor(threads=THREADS):
+    """
+    return -- The hashing threads of the process, started on first use so that they are not forked
+    """
+
+    global executor
+
+    with executor_lock:
+        if executor is None or executor.pid != os.getpid():
+            executor = ThreadPoolExecutor(threads, thread_name_prefix="fileupload-hash")
+            executor.pid = os.getpid()
+
+    return executor
+
+
+class TreeHash:
+
+    def __init__(self, chunk_size=TREE_CHUNK_SIZE, digest_size=TREE_DIGEST_SIZE):
+        """
+        The BLAKE2b digests of the chunks of a stream and their root digest
+
+        Arguments:
+            chunk_size -- The size of every chunk except the last one
+            digest_size -- The size of the digests in bytes
+        """
+
+        self.chunk_size = chunk_size
+        self.digest_size = digest_size
+        self.chunks = []
+        self.current = self.chunk_hasher()
+        self.filled = 0
+
+    def chunk_hasher(self):
+        return hashlib.blake2b(digest_size=self.digest_size)
+
+    def update(self, buf):
+        view = memoryview(buf)
+
+        while len(view):
+            taken = view[:self.chunk_size - self.filled]
+            self.current.update(taken)
+            self.filled += len(taken)
+            view = view[len(taken):]
+
+            if self.filled == self.chunk_size:
+                self.chunks.append(self.current.digest())
+                self.current, self.filled = self.chunk_hasher(), 0
+
+    def chunk_digests(self):
+        """
+        return -- The digests of the chunks, the digest of the empty chunk for an empty stream
+        """
+
+        if self.filled or not self.chunks:
+            return self.chunks + [self.current.digest()]
+
+        return self.chunks[:]
+
+    def root(self, chunk_digests=None):
+        """
+        return -- The hex root digest, the BLAKE2b digest of the concatenated chunk digests
+        """
+
+        return hashlib.blake2b(b"".join(chunk_digests or self.chunk_digests()), digest_size=self.digest_size).hexdigest()
+
+
+class MultiHasher:
+
+    def __init__(self, algorithms=ALGORITHMS, tree_chunk_size=None, threads=THREADS):
+        """
+        The digests of one stream, every block is hashed by every algorithm in parallel
+
+        Arguments:
+            algorithms -- The hashlib algorithms of the digests
+            tree_chunk_size -- The chunk size of the tree hash, no tree hash if None
+            threads -- The number of hashing threads, 1 hashes in the calling thread
+        """
+
+        self.hashers = [hashlib.new(name) for name in algorithms]
+        self.algorithms = algorithms
+        self.tree = TreeHash(tree_chunk_size) if tree_chunk_size else None
+        self.threads = threads
+
+        if self.tree is not None:
+            self.hashers.append(self.tree)
+
+    def update(self, buf):
+        if self.threads <= 1 or len(buf) < PARALLEL_MIN_SIZE:
+            for hasher in self.hashers:
+                hasher.update(buf)
+            return
+
+        # The calling thread hashes the first digest while the others are hashed by the pool
+        futures = [get_executor(self.threads).submit(hasher.update, buf) for hasher in self.hashers[1:]]
+        self.hashers[0].update(buf)
+
+        for future in futures:
+            future.result()
+
+    def hexdigest(self, algorithm):
+        return self.hashers[self.algorithms.index(algorithm)].hexdigest()
+
+    def digests(self):
+        """
+        return -- The hex digest of every algorithm, with the tree_hash root, the concatenated
+                  chunk_hashes and the tree_chunk_size when the tree hash is enabled
+        """
+
+        digests = {name: hasher.hexdigest() for name, hasher in zip(self.algorithms, self.hashers)}
+
+        if self.tree is not None:
+            chunks = self.tree.chunk_digests()
+            digests["tree_hash"] = self.tree.root(chunks)
+            digests["chunk_hashes"] = b"".join(chunks)
+            digests["tree_chunk_size"] = self.tree.chunk_size
+
+        return digests
+
+
+def hash_path(path, algorithms=ALGORITHMS, tree_chunk_size=None, threads=THREADS):
+    """
+    Hashes a file on disk through a memory map. Every algorithm hashes the mapped file in its own thread
+    in blocks of MAP_BLOCK_SIZE, and the chunks of the tree hash are hashed in parallel by the other threads.
+
+    Arguments:
+        path -- The path of the file
+        algorithms -- The hashlib algorithms of the digests
+        tree_chunk_size -- The chunk size of the tree hash, no tree hash if None
+        threads -- The number of hashing threads
+
+    return -- The digests like MultiHasher.digests
+    """
+
+    with open(path, "rb") as file:
+        # An empty file cannot be mapped
+        if os.fstat(file.fileno()).st_size == 0:
+            return MultiHasher(algorithms, tree_chunk_size, threads=1).digests()
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+
+            try:
+                return hash_buffer(view, algorithms, tree_chunk_size, threads)
+            finally:
+                view.release()
+
+
+def hash_buffer(view, algorithms=ALGORITHMS, tree_chunk_size=None, threads=THREADS):
+    """
+    Hashes a buffer in parallel, like hash_path.
+
+    return -- The digests like MultiHasher.digests
+    """
+
+    hashers = [hashlib.new(name) for name in algorithms]
+
+    def run(hasher):
+        for offset in range(0, len(view), MAP_BLOCK_SIZE):
+            hasher.update(view[offset:offset + MAP_BLOCK_SIZE])
+
+    def chunk_digest(offset):
+        return hashlib.blake2b(view[offset:offset + tree_chunk_size], digest_size=TREE_DIGEST_SIZE).digest()
+
+    if threads <= 1:
+        for hasher in hashers:
+            run(hasher)
+        chunks = [chunk_digest(offset) for offset in range(0, len(view), tree_chunk_size)] if tree_chunk_size else []
+    else:
+        pool = get_executor(threads)
+        futures = [pool.submit(run, hasher) for hasher in hashers]
+        chunks = list(pool.map(chunk_digest, range(0, len(view), tree_chunk_size))) if tree_chunk_size else []
+
+        for future in futures:
+            future.result()
+
+    digests = {name: hasher.hexdigest() for name, hasher in zip(algorithms, hashers)}
+
+    if tree_chunk_size:
+        digests["tree_hash"] = TreeHash(tree_chunk_size).root(chunks)
+        digests["chunk_hashes"] = b"".join(chunks)
+        digests["tree_chunk_size"] = tree_chunk_size
+
+    return digests
@@ -0,0 +1,180 @@
+"""
+The streaming ingest pipeline for the uploaded files.
+
+The incoming stream is read only once, block by block. Every block feeds the md5, sha1 and optional
+tree hashers in parallel, the byte counter and the libmagic header buffer at the same time, and is written
+straight to a staging file which is moved to its final location once the database commit succeeded.
+"""
+
+import errno
+import os
+import os.path as op
+import shutil
+import tempfile
+
+from fileupload import hashing
+
+BLOCK_SIZE = int(os.environ.get("INGEST_BLOCK_SIZE", 1048576))
+HEADER_SIZE = 262144
+
+
+class ContentMismatch(Exception):
+    """
+    The content does not match the size or the hashes claimed by the client
+    """
+
+
+class StreamIngest:
+
+    def __init__(self, staging_dir=None, block_size=BLOCK_SIZE, header_size=HEADER_SIZE, claimed=None,
+                 tree_chunk_size=hashing.INGEST_TREE_CHUNK_SIZE):
+        """
+        A single pass ingest of a file stream into a staging file
+
+        Arguments:
+            staging_dir -- The directory of the staging file, the system temp directory if None
+            block_size -- The size of the blocks read from the stream
+            header_size -- The number of leading bytes kept for the file type detection
+            claimed -- The file_size, file_sha1 and file_md5 claimed by the client, verified while streaming
+            tree_chunk_size -- The chunk size of the tree hash, no tree hash if None
+        """
+
+        self.block_size = block_size
+        self.header_size = header_size
+        self.claimed = claimed or {}
+        self.size = 0
+        self.header = bytearray()
+        self.hasher = hashing.MultiHasher(tree_chunk_size=tree_chunk_size)
+
+        fd, self.path = tempfile.mkstemp(prefix="ingest-", dir=staging_dir)
+        os.chmod(self.path, 0o644)
+        self.file = os.fdopen(fd, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.discard()
+
+    def feed(self, buf):
+        """
+        Feeds one block of the file to every consumer of the pipeline.
+
+        Argument:
+            buf -- The bytes of the block
+        """
+
+        if len(self.header) < self.header_size:
+            self.header += buf[:self.header_size - len(self.header)]
+
+        self.hasher.update(buf)
+        self.size += len(buf)
+
+        # A stream longer than the claimed size is abandoned before it is read to the end
+        if self.claimed.get("file_size") is not None and self.size > self.claimed["file_size"]:
+            raise ContentMismatch(f"More than the claimed {self.claimed['file_size']} bytes")
+
+        self.file.write(buf)
+
+    def consume(self, stream):
+        """
+        Reads the whole stream and feeds it block by block.
+
+        Argument:
+            stream -- A file-like object opened in binary mode
+        """
+
+        buf = stream.read(self.block_size)
+        while len(buf) > 0:
+            self.feed(buf)
+            buf = stream.read(self.block_size)
+
+    def finish(self):
+        """
+        Closes the staging file.
+
+        return -- The size and the hashes of the ingested file
+        """
+
+        self.file.close()
+
+        return verify(digest_metadata(self.size, self.hasher.digests()), self.claimed)
+
+    def discard(self):
+        """
+        Closes and removes the staging file.
+        """
+
+        self.file.close()
+        discard(self.path)
+
+
+def digest_metadata(size, digests):
+    """
+    Arguments:
+        size -- The size of a file
+        digests -- The digests of the file, from the hashing engine
+
+    return -- The metadata of the file, with its tree hash when it was computed
+    """
+
+    metadata = {"file_size": size, "file_sha1": digests["sha1"], "file_md5": digests["md5"]}
+
+    if "tree_hash" in digests:
+        metadata["file_tree_hash"] = digests["tree_hash"]
+        metadata["file_chunk_hashes"] = digests["chunk_hashes"]
+        metadata["tree_chunk_size"] = digests["tree_chunk_size"]
+
+    return metadata
+
+
+def verify(metadata, claimed):
+    """
+    Compares the metadata of a file with the values claimed by the client.
+
+    Arguments:
+        metadata -- The file_size, file_sha1 and file_md5 of the file
+        claimed -- The claimed values, the missing or None ones are not verified
+
+    return -- The metadata
+    """
+
+    for key in ("file_size", "file_sha1", "file_md5"):
+        value = claimed.get(key) if claimed else None
+
+        if value is not None and str(value).lower() != str(metadata[key]):
+            raise ContentMismatch(f"The {key} {metadata[key]} does not match the claimed {value}")
+
+    return metadata
+
+
+def commit(staging_path, file_path):
+    """
+    Atomically moves a staging file to its final location.
+    The move is only atomic when the staging file is in the same filesystem as the final location,
+    otherwise the file is copied.
+
+    Arguments:
+        staging_path -- The path of the staging file
+        file_path -- The final path of the file
+    """
+
+    try:
+        os.replace(staging_path, file_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(staging_path, file_path)
+
+
+def discard(staging_path):
+    """
+    Removes a staging file, if it still exists.
+
+    Argument:
+        staging_path -- The path of the staging file
+    """
+
+    if staging_path and op.exists(staging_path):
+        os.remove(staging_path)
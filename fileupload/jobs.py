@@ -0,0 +1,278 @@
+"""
+The durable queue of the background jobs of the files.
+
+The jobs are rows of the job table, added in the transaction of their file. The workers claim the
+ready jobs with SELECT ... FOR UPDATE SKIP LOCKED, so that concurrent workers never wait for each
+other nor claim the same job. A claimed job is hidden for a visibility timeout: when its worker dies,
+the job is claimed again once the timeout expires. A failed job is retried with an exponential
+delay, up to its maximum number of attempts.
+"""
+
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from sqlalchemy import and_, func, or_, select
+
+from fileupload.models import Job, db
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 5
+VISIBILITY_TIMEOUT = 300
+RETRY_DELAY = 30
+POLL_INTERVAL = 1
+BATCH_SIZE = 10
+
+
+class JobQueue:
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, visibility_timeout=VISIBILITY_TIMEOUT, retry_delay=RETRY_DELAY):
+        """
+        The job table seen as a queue, through the session of the application
+
+        Arguments:
+            max_attempts -- The number of times a job is run before it fails
+            visibility_timeout -- The seconds a claimed job stays hidden from the other workers
+            retry_delay -- The seconds before the first retry of a job, doubled by every further attempt
+        """
+
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+
+    def enqueue(self, file_ids, kind):
+        """
+        Adds a job for every file in the current transaction, the jobs are visible once it commits.
+
+        Arguments:
+            file_ids -- The ids of the files
+            kind -- The kind of the jobs
+        """
+
+        if file_ids:
+            db.session.execute(Job.__table__.insert().values([
+                dict(file_id=file_id, kind=kind, max_attempts=self.max_attempts) for file_id in file_ids
+            ]))
+
+    def claim(self, worker, limit=BATCH_SIZE):
+        """
+        Claims the ready jobs: the queued jobs that are due and the running jobs whose worker
+        did not finish them before their visibility timeout. The claim is committed at once.
+
+        Arguments:
+            worker -- The name of the worker
+            limit -- The maximum number of jobs to claim
+
+        return -- The claimed jobs, as rows of the job table
+        """
+
+        table = Job.__table__
+        ready = select([table.c.id]).where(and_(
+            table.c.attempts < table.c.max_attempts,
+            or_(
+                and_(table.c.status == QUEUED, table.c.run_at <= func.now()),
+                and_(table.c.status == RUNNING, table.c.locked_until < func.now()),
+            )
+        )).order_by(table.c.run_at).limit(limit).with_for_update(skip_locked=True)
+
+        jobs = db.session.execute(
+            table.update().where(table.c.id.in_(ready.as_scalar())).values(
+                status=RUNNING,
+                attempts=table.c.attempts + 1,
+                locked_until=func.now() + timedelta(seconds=self.visibility_timeout),
+                locked_by=worker,
+                updated_at=func.now(),
+            ).returning(*table.c)
+        ).fetchall()
+        db.session.commit()
+
+        return sorted(jobs, key=lambda job: job.run_at)
+
+    def reap(self):
+        """
+        Fails the running jobs whose visibility timeout expired after their last attempt.
+
+        return -- The number of failed jobs
+        """
+
+        table = Job.__table__
+        result = db.session.execute(table.update().where(and_(
+            table.c.status == RUNNING,
+            table.c.locked_until < func.now(),
+            table.c.attempts >= table.c.max_attempts,
+        )).values(status=FAILED, locked_until=None, last_error="Visibility timeout expired", updated_at=func.now()))
+        db.session.commit()
+
+        return result.rowcount
+
+    @staticmethod
+    def claimed(job):
+        # The attempt fences the updates of a worker whose job was claimed again by another one
+        table = Job.__table__
+        return and_(table.c.id == job.id, table.c.status == RUNNING, table.c.attempts == job.attempts)
+
+    def complete(self, job):
+        """
+        Marks a job as done in the current transaction, with the changes of its handler.
+
+        Argument:
+            job -- The claimed job
+
+        return -- Whether the job was still claimed by the worker
+        """
+
+        return db.session.execute(Job.__table__.update().where(self.claimed(job)).values(
+            status=DONE, locked_until=None, last_error=None, updated_at=func.now()
+        )).rowcount == 1
+
+    def fail(self, job, error):
+        """
+        Queues a failed job again after its retry delay, or fails it after its last attempt.
+        The failure is committed at once.
+
+        Arguments:
+            job -- The claimed job
+            error -- The error of the attempt
+        """
+
+        if job.attempts >= job.max_attempts:
+            values = dict(status=FAILED)
+        else:
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            values = dict(status=QUEUED, run_at=func.now() + timedelta(seconds=delay))
+
+        db.session.execute(Job.__table__.update().where(self.claimed(job)).values(
+            locked_until=None, last_error=str(error)[:1000] or type(error).__name__, updated_at=func.now(), **values
+        ))
+        db.session.commit()
+
+
+class Worker:
+
+    def __init__(self, queue, handlers, poll_interval=POLL_INTERVAL, batch_size=BATCH_SIZE, name=None, tasks=None):
+        """
+        A worker process running the claimed jobs one after the other
+
+        Arguments:
+            queue -- The JobQueue
+            handlers -- The function running every kind of job, called with the id of the file
+            poll_interval -- The seconds between two polls of an empty queue
+            batch_size -- The number of jobs claimed at once
+            name -- The name of the worker, the host and the pid by default
+            tasks -- The periodic tasks of the worker, by name, as the seconds between two runs and the function
+        """
+
+        self.queue = queue
+        self.handlers = handlers
+        self.tasks = tasks or {}
+        self.tasks_due = {name: time.monotonic() for name in self.tasks}
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.running = True
+        self.logger = logging.getLogger("fileupload")
+
+    def run_job(self, job):
+        """
+        Runs one claimed job, its handler changes and its completion are committed together.
+
+        Argument:
+            job -- The claimed job
+
+        return -- Whether the job is done
+        """
+
+        try:
+            self.handlers[job.kind](job.file_id)
+
+            if not self.queue.complete(job):
+                db.session.rollback()
+                self.logger.warning("Job %d was claimed again by another worker", job.id)
+                return False
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.logger.exception("Job %d (%s) of file %d failed at attempt %d", job.id, job.kind, job.file_id,
+                                  job.attempts)
+            self.queue.fail(job, e)
+            return False
+
+        self.logger.info("Job %d (%s) of file %d done", job.id, job.kind, job.file_id)
+
+        return True
+
+    def run_once(self):
+        """
+        Runs the jobs that are ready.
+
+        return -- The number of jobs claimed
+        """
+
+        self.queue.reap()
+        self.run_tasks()
+        jobs = self.queue.claim(self.name, self.batch_size)
+
+        for job in jobs:
+            self.run_job(job)
+
+        return len(jobs)
+
+    def run_tasks(self):
+        """
+        Runs the periodic tasks that are due, a failed task runs again at its next period.
+        """
+
+        for name, (interval, function) in self.tasks.items():
+            if time.monotonic() < self.tasks_due[name]:
+                continue
+
+            self.tasks_due[name] = time.monotonic() + interval
+
+            try:
+                self.logger.info("Task %s done: %s", name, function())
+            except Exception:
+                self.logger.exception("Task %s failed", name)
+
+    def run(self):
+        """
+        Runs the jobs until stop is called, the queue is polled again at once after a full batch.
+        """
+
+        self.logger.info("Worker %s started", self.name)
+
+        while self.running:
+            if self.run_once() < self.batch_size and self.running:
+                time.sleep(self.poll_interval)
+
+        self.logger.info("Worker %s stopped", self.name)
+
+    def stop(self, *args):
+        """
+        Stops the worker after its current job, it can be used as a signal handler.
+        """
+
+        self.running = False
+
+
+def create_queue(environ=os.environ):
+    """
+    Builds the job queue configured by the JOB_* env variables.
+
+    Argument:
+        environ -- The environment variables
+
+    return -- The JobQueue
+    """
+
+    return JobQueue(
+        max_attempts=int(environ.get("JOB_MAX_ATTEMPTS", MAX_ATTEMPTS)),
+        visibility_timeout=int(environ.get("JOB_VISIBILITY_TIMEOUT", VISIBILITY_TIMEOUT)),
+        retry_delay=int(environ.get("JOB_RETRY_DELAY", RETRY_DELAY)),
+    )
@@ -1,32 +1,129 @@
-"""
-The Database tables are described here by using a Model together
-with its Model schema.
-"""
-
-from app.config import ma, db
-
-class FileMetadata(db.Model):
-    """
-    The FileMetaData table
-    """
-
-    __tablename__ = "filemetadata"
-    __table_args__ = {"schema": "filemetadata"}
-
-    id = db.Column(db.Integer, primary_key=True)
-    size = db.Column(db.String)
-    file_name = db.Column(db.String)
-    sha1 = db.Column(db.String, unique=True)
-    md5 = db.Column(db.String, unique=True)
-    type = db.Column(db.String, default="unknown/unknown")
-
-class FileMetadataSchema(ma.ModelSchema):
-    """
-    The schema for the FileMetadata table
-    """
-
-    class Meta:
-        model = FileMetadata
-        sqla_session = db.session
-
-
+"""
+The Database tables are described here by using a Model together
+with its Model schema.
+"""
+
+import binascii
+
+from sqlalchemy import collate, func
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from sqlalchemy.dialects import postgresql
+from app.config import ma, db
+
+
+class HexDigest(TypeDecorator):
+    """
+    A hash digest stored as fixed-width binary (bytea in PostgreSQL),
+    exposed as its lowercase hex string in python.
+    """
+
+    impl = LargeBinary
+
+    def __init__(self, length):
+        super().__init__(length)
+        self.hex_length = 2 * length
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.BYTEA(self.impl.length))
+        return dialect.type_descriptor(self.impl)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return binascii.unhexlify(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return binascii.hexlify(value).decode()
+
+    @property
+    def python_type(self):
+        return str
+
+
+class FileMetadata(db.Model):
+    """
+    The FileMetaData table
+    """
+
+    __tablename__ = "filemetadata"
+    # The pattern operators of the type index serve the LIKE prefixes of the top-level types in any collation
+    __table_args__ = (
+        db.Index("ix_filemetadata_type_id", "type", "id", postgresql_ops={"type": "text_pattern_ops"}),
+        {"schema": "filemetadata"},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.BigInteger)
+    file_name = db.Column(db.String)
+    sha1 = db.Column(HexDigest(20), index=True)
+    md5 = db.Column(HexDigest(16), index=True)
+    type = db.Column(db.String, default="unknown/unknown")
+    description = db.Column(db.String)
+    encoding = db.Column(db.String)
+    analyzed_at = db.Column(db.DateTime(timezone=True))
+    tree_hash = db.Column(HexDigest(32))
+    tree_chunk_size = db.Column(db.Integer)
+    chunk_hashes = db.Column(db.LargeBinary)
+    stored_size = db.Column(db.BigInteger)
+    compression = db.Column(db.String)
+
+# The file name of the search, its case ignored and compared byte by byte so that its index serves
+# both the LIKE prefixes and the order of the names
+SEARCH_NAME = collate(func.lower(FileMetadata.file_name), "C")
+db.Index("ix_filemetadata_search_name", SEARCH_NAME, FileMetadata.id)
+
+class FileBlob(db.Model):
+    """
+    The FileBlob table, the reference count of every stored content
+    """
+
+    __tablename__ = "fileblob"
+    __table_args__ = {"schema": "filemetadata"}
+
+    sha1 = db.Column(HexDigest(20), primary_key=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    """
+    The Job table, the background jobs of the files, claimed by the workers with SKIP LOCKED
+    """
+
+    __tablename__ = "job"
+    __table_args__ = (db.Index("ix_job_ready", "status", "run_at"), {"schema": "filemetadata"})
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey("filemetadata.filemetadata.id", ondelete="CASCADE"),
+                        nullable=False, index=True)
+    kind = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default="queued", server_default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_until = db.Column(db.DateTime(timezone=True))
+    locked_by = db.Column(db.String)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class FileMetadataSchema(ma.ModelSchema):
+    """
+    The schema for the FileMetadata table
+    """
+
+    class Meta:
+        model = FileMetadata
+        sqla_session = db.session
+        exclude = ("chunk_hashes",)
+
+class JobSchema(ma.ModelSchema):
+    """
+    The schema for the Job table
+    """
+
+    class Meta:
+        model = Job
+        include_fk = True
+        exclude = ("locked_by",)
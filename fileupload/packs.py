@@ -0,0 +1,510 @@
+"""
+The packed store of the small contents.
+
+A content stored as a blob of its own costs a file, and on a store of millions of small contents the inodes,
+the directory entries and the metadata syscalls of every write cost more than the contents themselves.
+The contents smaller than PACK_MAX_FILE_SIZE are instead appended to segment files of up to PACK_SEGMENT_SIZE
+bytes, and the location of every one of them is kept in an SQLite index next to the segments:
+
+    DATA_DIR/packs/index.sqlite -- The segment, offset and length of every packed content,
+                                   and the used and garbage bytes of every segment
+    DATA_DIR/packs/00000001.pack -- The contents of a segment, one after the other
+
+The appends of all the processes of a node are serialized by the write transaction of the index, and the
+contents are read with pread from the segment files, opened once per process. A deletion only removes the
+location of a content: its bytes are left in the segment as garbage, until the compactor copies the live
+contents of the segments with too much garbage to the active segment and removes them.
+
+The larger contents are stored by the blob store, as they are without the packed store.
+"""
+
+import fcntl
+import heapq
+import os
+import os.path as op
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from fileupload import compression, ingest
+from fileupload.ingest import BLOCK_SIZE
+from fileupload.storage import StorageBackend, compress_stream, compression_suffix
+
+MAX_FILE_SIZE = 65536
+SEGMENT_SIZE = 268435456
+MIN_GARBAGE = 0.5
+COMPACT_INTERVAL = 3600
+COMPACT_BATCH_SIZE = 1000
+LIST_PAGE_SIZE = 1000
+BUSY_TIMEOUT = 60
+REOPEN_INTERVAL = 60
+SEGMENT_NAME = re.compile(r"^(\d{8})\.pack$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segment (
+    id INTEGER PRIMARY KEY,
+    size INTEGER NOT NULL DEFAULT 0,
+    garbage INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS packed (
+    sha1 BLOB PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    compression TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_packed_segment ON packed (segment, start);
+"""
+
+
+class Prefixed:
+
+    def __init__(self, head, stream):
+        """
+        A stream whose first bytes were already read
+
+        Arguments:
+            head -- The bytes already read
+            stream -- The rest of the stream
+        """
+
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+
+        if size is None or size < 0:
+            buf, self.head = self.head + self.stream.read(), b""
+        else:
+            buf, self.head = self.head[:size], self.head[size:]
+
+        return buf
+
+
+class PackedStorage(StorageBackend):
+
+    def __init__(self, root, blobs, max_file_size=MAX_FILE_SIZE, segment_size=SEGMENT_SIZE):
+        """
+        A content-addressed store packing the small contents in segment files
+
+        Arguments:
+            root -- The directory of the segments and of their index
+            blobs -- The backend of the contents of max_file_size bytes or more
+            max_file_size -- The size from which a content is stored by the blob store
+            segment_size -- The size from which a segment is sealed and a new one is started
+        """
+
+        self.root = root
+        self.blobs = blobs
+        self.max_file_size = max_file_size
+        self.segment_size = segment_size
+        self.index_path = op.join(root, "index.sqlite")
+        self.connections = threading.local()
+        self.segments = {}
+        self.segments_pid = None
+        self.segments_checked = time.monotonic()
+        self.segments_lock = threading.Lock()
+
+    @property
+    def index(self):
+        """
+        The connection of the current thread to the index, opened on first use in every process
+        """
+
+        connections = self.connections
+
+        if getattr(connections, "pid", None) != os.getpid():
+            os.makedirs(self.root, exist_ok=True)
+            index = sqlite3.connect(self.index_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            index.execute("PRAGMA journal_mode=WAL")
+            index.execute("PRAGMA synchronous=NORMAL")
+            index.executescript(SCHEMA)
+            connections.index = index
+            connections.pid = os.getpid()
+
+        return connections.index
+
+    @contextmanager
+    def transaction(self):
+        """
+        A write transaction of the index, it holds the write lock of the node from its start
+        """
+
+        index = self.index
+        index.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield index
+        except BaseException:
+            index.execute("ROLLBACK")
+            raise
+
+        index.execute("COMMIT")
+
+    def segment_path(self, segment):
+        return op.join(self.root, f"{segment:08d}.pack")
+
+    def segment_fd(self, segment):
+        """
+        return -- The file descriptor of a segment in the current process, opened on first use
+        """
+
+        with self.segments_lock:
+            if self.segments_pid != os.getpid():
+                # The descriptors inherited from the parent process are closed in this one only
+                for fd in self.segments.values():
+                    os.close(fd)
+                self.segments = {}
+                self.segments_pid = os.getpid()
+
+            # The segments removed by a compaction in another process stay allocated while they are open
+            if time.monotonic() - self.segments_checked > REOPEN_INTERVAL:
+                for removed in [number for number, fd in self.segments.items() if os.fstat(fd).st_nlink == 0]:
+                    os.close(self.segments.pop(removed))
+                self.segments_checked = time.monotonic()
+
+            if segment not in self.segments:
+                self.segments[segment] = os.open(self.segment_path(segment), os.O_RDONLY)
+
+            return self.segments[segment]
+
+    def forget(self, segment):
+        with self.segments_lock:
+            if self.segments_pid == os.getpid() and segment in self.segments:
+                os.close(self.segments.pop(segment))
+
+    def locate(self, sha1):
+        """
+        return -- The segment, offset, length and compression of a packed content, None if it is not packed
+        """
+
+        return self.index.execute(
+            "SELECT segment, start, length, compression FROM packed WHERE sha1 = ?", (bytes.fromhex(sha1),)
+        ).fetchone()
+
+    def location(self, sha1):
+        location = self.locate(sha1)
+
+        if location is None:
+            return self.blobs.location(sha1)
+
+        return f"{self.segment_path(location[0])}@{location[1]}"
+
+    def local_path(self, sha1):
+        # A packed content is only a range of its segment
+        return None if self.locate(sha1) else self.blobs.local_path(sha1)
+
+    def stat(self, sha1):
+        location = self.locate(sha1)
+        return (location[2], location[3]) if location else self.blobs.stat(sha1)
+
+    def exists(self, sha1):
+        return self.locate(sha1) is not None or self.blobs.exists(sha1)
+
+    def check(self):
+        self.blobs.check()
+        self.index.execute("SELECT 1 FROM segment LIMIT 1")
+
+    def list(self, after=""):
+        return heapq.merge(self.list_packed(after), self.blobs.list(after))
+
+    def list_packed(self, after=""):
+        # The listing is paged so that no read transaction is kept open while it is consumed
+        key = bytes.fromhex(after)
+
+        while True:
+            rows = self.index.execute(
+                "SELECT sha1, length FROM packed WHERE sha1 > ? ORDER BY sha1 LIMIT ?", (key, LIST_PAGE_SIZE)
+            ).fetchall()
+
+            yield from ((sha1.hex(), length) for sha1, length in rows)
+
+            if len(rows) < LIST_PAGE_SIZE:
+                return
+
+            key = rows[-1][0]
+
+    def quarantine(self, sha1):
+        location = self.locate(sha1)
+
+        if location is None:
+            return self.blobs.quarantine(sha1)
+
+        segment, start, length, codec = location
+        quarantine_dir = op.join(op.dirname(self.root), ".quarantine")
+        quarantine_path = op.join(quarantine_dir, sha1 + compression_suffix(codec))
+
+        os.makedirs(quarantine_dir, exist_ok=True)
+        with open(quarantine_path, "wb") as target:
+            for buf in self.read_blocks(self.segment_fd(segment), start, 0, length):
+                target.write(buf)
+
+        self.delete(sha1)
+
+        return quarantine_path
+
+    def put(self, staging_path, sha1, compression=None):
+        if op.getsize(staging_path) >= self.max_file_size:
+            return self.blobs.put(staging_path, sha1, compression)
+
+        try:
+            # A content under max_file_size is only in the blob store if it was stored before a raise of max_file_size
+            if self.locate(sha1) is not None:
+                return False
+
+            with open(staging_path, "rb") as source:
+                stream, codec = compress_stream(source, compression)
+                return self.append(sha1, stream.read(), codec)
+        finally:
+            ingest.discard(staging_path)
+
+    def write(self, sha1, stream, compression=None):
+        buf = stream.read(self.max_file_size)
+
+        if len(buf) < self.max_file_size:
+            self.append(sha1, buf, compression)
+        else:
+            self.blobs.write(sha1, Prefixed(buf, stream), compression)
+
+    def append(self, sha1, buf, compression=None):
+        """
+        Appends a content to the active segment.
+
+        Arguments:
+            sha1 -- The sha1 hash of the content
+            buf -- The content, as it is stored
+            compression -- The codec the content is compressed with
+
+        return -- True if the content was added, False if it was already packed
+        """
+
+        key = bytes.fromhex(sha1)
+
+        with self.transaction() as index:
+            if index.execute("SELECT 1 FROM packed WHERE sha1 = ?", (key,)).fetchone():
+                return False
+
+            segment, start = self.allocate(index, len(buf))
+            self.write_segment(segment, start, buf)
+            index.execute("INSERT INTO packed VALUES (?, ?, ?, ?, ?)", (key, segment, start, len(buf), compression))
+
+        return True
+
+    def allocate(self, index, length):
+        """
+        Reserves the space of a content at the end of the active segment, in a write transaction.
+        The bytes written past the used size of a segment by a transaction that did not commit are
+        overwritten by the next one.
+
+        Arguments:
+            index -- The connection of the transaction
+            length -- The length of the content
+
+        return -- The segment and the offset of the content
+        """
+
+        active = index.execute("SELECT id, size FROM segment ORDER BY id DESC LIMIT 1").fetchone()
+
+        if active is None or (active[1] and active[1] + length > self.segment_size):
+            segment, start = (active[0] + 1 if active else 1), 0
+            index.execute("INSERT INTO segment (id) VALUES (?)", (segment,))
+        else:
+            segment, start = active
+
+        index.execute("UPDATE segment SET size = size + ? WHERE id = ?", (length, segment))
+
+        return segment, start
+
+    def write_segment(self, segment, start, buf):
+        fd = os.open(self.segment_path(segment), os.O_WRONLY | os.O_CREAT, 0o644)
+
+        try:
+            view = memoryview(buf)
+            while view:
+                written = os.pwrite(fd, view, start)
+                view = view[written:]
+                start += written
+        finally:
+            os.close(fd)
+
+    def read(self, sha1, start=0, length=None):
+        location = self.locate(sha1)
+
+        if location is None:
+            return self.blobs.read(sha1, start, length)
+
+        try:
+            fd = self.segment_fd(location[0])
+        except FileNotFoundError:
+            # The segment was removed by a compaction since the content was located
+            location = self.locate(sha1)
+            if location is None:
+                raise
+            fd = self.segment_fd(location[0])
+
+        segment, offset, size, codec = location
+
+        if codec:
+            return compression.decompress(self.read_blocks(fd, offset, 0, size), codec, BLOCK_SIZE, start, length)
+
+        return self.read_blocks(fd, offset, start, size if length is None else min(size, start + length))
+
+    @staticmethod
+    def read_blocks(fd, offset, start, end):
+        """
+        Reads a range of a packed content.
+
+        Arguments:
+            fd -- The file descriptor of its segment
+            offset -- The offset of the content in the segment
+            start -- The offset of the first byte in the content
+            end -- The offset after the last byte in the content
+
+        return -- An iterator over the blocks of the range
+        """
+
+        position = start
+
+        while position < end:
+            buf = os.pread(fd, min(BLOCK_SIZE, end - position), offset + position)
+            if not buf:
+                break
+            position += len(buf)
+            yield buf
+
+    def delete(self, sha1):
+        # The bytes of a packed content are left as garbage in its segment, until its compaction
+        deleted = self.blobs.delete(sha1)
+        key = bytes.fromhex(sha1)
+
+        with self.transaction() as index:
+            packed = index.execute("SELECT segment, length FROM packed WHERE sha1 = ?", (key,)).fetchone()
+
+            if packed is not None:
+                index.execute("DELETE FROM packed WHERE sha1 = ?", (key,))
+                index.execute("UPDATE segment SET garbage = garbage + ? WHERE id = ?", (packed[1], packed[0]))
+
+        return deleted or packed is not None
+
+    def stats(self):
+        """
+        return -- The number and bytes of the packed contents, and the used and garbage bytes of the segments
+        """
+
+        contents, live_bytes = self.index.execute("SELECT count(*), coalesce(sum(length), 0) FROM packed").fetchone()
+        segments, size, garbage = self.index.execute(
+            "SELECT count(*), coalesce(sum(size), 0), coalesce(sum(garbage), 0) FROM segment"
+        ).fetchone()
+
+        return dict(contents=contents, live_bytes=live_bytes, segments=segments, segment_bytes=size,
+                    garbage_bytes=garbage)
+
+    def compact(self, min_garbage=MIN_GARBAGE):
+        """
+        Reclaims the space of the deleted contents: the live contents of the sealed segments whose garbage
+        is at least min_garbage of their size are copied to the active segment, then the segments are removed.
+        A single compaction runs at a time on a node, the others return at once.
+
+        Argument:
+            min_garbage -- The garbage ratio from which a segment is compacted, 0 compacts every sealed segment
+
+        return -- The counts of the compacted segments, of the moved contents and bytes, and of the reclaimed bytes
+        """
+
+        counts = Counter(segments=0, contents=0, moved_bytes=0, reclaimed_bytes=0)
+        os.makedirs(self.root, exist_ok=True)
+        lock = os.open(op.join(self.root, "compact.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return counts
+
+            active = self.index.execute("SELECT max(id) FROM segment").fetchone()[0] or 0
+            segments = self.index.execute(
+                "SELECT id, size FROM segment WHERE id < ? AND garbage >= ? * size ORDER BY id", (active, min_garbage)
+            ).fetchall()
+
+            for segment, size in segments:
+                moved = self.compact_segment(segment, counts)
+                counts["segments"] += 1
+                counts["reclaimed_bytes"] += size - moved
+
+            # The segments left behind by a compaction interrupted between the index and the file
+            indexed = {segment for segment, in self.index.execute("SELECT id FROM segment")}
+            for name in os.listdir(self.root):
+                match = SEGMENT_NAME.match(name)
+                if match and int(match.group(1)) < active and int(match.group(1)) not in indexed:
+                    os.remove(op.join(self.root, name))
+        finally:
+            os.close(lock)
+
+        return counts
+
+    def compact_segment(self, segment, counts):
+        """
+        Moves the live contents of a sealed segment to the active one, then removes the segment.
+
+        Arguments:
+            segment -- The number of the segment
+            counts -- The counters of the compaction
+
+        return -- The number of bytes moved
+        """
+
+        moved = 0
+        after = -1
+
+        try:
+            fd = os.open(self.segment_path(segment), os.O_RDONLY)
+        except FileNotFoundError:
+            fd = None
+
+        try:
+            while fd is not None:
+                rows = self.index.execute(
+                    "SELECT sha1, start, length FROM packed WHERE segment = ? AND start > ? ORDER BY start LIMIT ?",
+                    (segment, after, COMPACT_BATCH_SIZE)
+                ).fetchall()
+
+                if not rows:
+                    break
+
+                after = rows[-1][1]
+                # The contents are read out of the transaction, which only holds the write lock for the copies
+                contents = [(key, start, os.pread(fd, length, start)) for key, start, length in rows]
+
+                with self.transaction() as index:
+                    for key, start, buf in contents:
+                        # A content deleted or packed again since it was read is not moved
+                        if index.execute("SELECT 1 FROM packed WHERE sha1 = ? AND segment = ? AND start = ?",
+                                         (key, segment, start)).fetchone() is None:
+                            continue
+
+                        target, target_start = self.allocate(index, len(buf))
+                        self.write_segment(target, target_start, buf)
+                        index.execute("UPDATE packed SET segment = ?, start = ? WHERE sha1 = ?",
+                                      (target, target_start, key))
+                        counts["contents"] += 1
+                        counts["moved_bytes"] += len(buf)
+                        moved += len(buf)
+
+            with self.transaction() as index:
+                index.execute("DELETE FROM segment WHERE id = ? AND NOT EXISTS "
+                              "(SELECT 1 FROM packed WHERE segment = ?)", (segment, segment))
+                removed = index.execute("SELECT changes()").fetchone()[0] == 1
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+        if removed:
+            self.forget(segment)
+            ingest.discard(self.segment_path(segment))
+
+        return moved
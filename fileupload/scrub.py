@@ -0,0 +1,461 @@
+"""
+The consistency scrubber of the stored contents and of their metadata.
+
+An upload commits its metadata before its content is stored, and a deletion commits before its content
+is removed, so a crash in between leaves files without a content or contents without a file. The scrubber
+walks the stored contents, the FileMetadata rows and the FileBlob rows side by side, all three in the order
+of their sha1 hashes and one page at a time, and finds:
+
+    missing -- Files whose content is not stored
+    orphan -- Stored contents that no file refers to
+    ref_count -- Contents whose FileBlob reference count does not match their number of files
+    corrupt -- Stored contents whose sha1, md5 or size do not match their files, when they are verified
+
+A finding is only reported once it still holds after a grace period, so that the uploads and the deletions
+in progress are not mistaken for crashes. It is then checked again, with the FileBlob row of its content
+locked like the uploads and the deletions do, before it is repaired: orphan contents are removed, corrupt
+contents are quarantined, the files of missing and corrupt contents are deleted, and the reference count
+is set to the number of files left.
+
+The verification reads the contents with a bounded pool of threads, paced to a maximum rate, and the
+progress is saved to a checkpoint file so that an interrupted scrub resumes where it stopped.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import os.path as op
+import queue
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from fileupload.hashing import MultiHasher
+from fileupload.models import FileBlob, FileMetadata, db
+
+MISSING = "missing"
+ORPHAN = "orphan"
+REF_COUNT = "ref_count"
+CORRUPT = "corrupt"
+
+PAGE_SIZE = 1000
+WORKERS = 4
+GRACE_PERIOD = 300
+CHECKPOINT_INTERVAL = 10
+PREFETCH_SIZE = 10000
+
+
+class Throttle:
+
+    def __init__(self, rate=None):
+        """
+        Paces the bytes read by all the threads to a maximum rate
+
+        Argument:
+            rate -- The maximum number of bytes per second, no limit if None
+        """
+
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self, size):
+        """
+        Waits for the turn of size bytes.
+
+        Argument:
+            size -- The number of bytes read
+        """
+
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_time, now)
+            self.next_time = start + size / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+
+def prefetch(iterator, size=PREFETCH_SIZE):
+    """
+    Runs an iterator in a thread, so that a slow listing runs ahead of its consumer.
+
+    Arguments:
+        iterator -- The iterator
+        size -- The maximum number of items fetched in advance
+
+    return -- An iterator over the same items
+    """
+
+    items = queue.Queue(size)
+    end = object()
+
+    def run():
+        try:
+            for item in iterator:
+                items.put((item, None))
+            items.put((end, None))
+        except BaseException as e:
+            items.put((end, e))
+
+    threading.Thread(target=run, name="fileupload-scrub-list", daemon=True).start()
+
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is end:
+            return
+        yield item
+
+
+def merge(streams):
+    """
+    Merges iterators sorted by sha1 hash.
+
+    Argument:
+        streams -- The iterators by name, their items start with a sha1 hash
+
+    return -- An iterator over every sha1 hash and its items by name
+    """
+
+    def tag(name, stream):
+        return ((item[0], name, item) for item in stream)
+
+    merged = heapq.merge(*[tag(name, stream) for name, stream in streams.items()], key=lambda tagged: tagged[0])
+
+    for sha1, tagged in itertools.groupby(merged, key=lambda tagged: tagged[0]):
+        yield sha1, {name: item for _, name, item in tagged}
+
+
+def issues(files, ref_count, stored):
+    """
+    return -- The findings of a content, from its number of files, its reference count and if it is stored
+    """
+
+    found = []
+
+    if files and not stored:
+        found.append(MISSING)
+    if stored and not files:
+        found.append(ORPHAN)
+    if ref_count != files:
+        found.append(REF_COUNT)
+
+    return found
+
+
+class Scrubber:
+
+    def __init__(self, storage, verify=False, repair=False, workers=WORKERS, max_rate=None,
+                 grace_period=GRACE_PERIOD, checkpoint=None, report=sys.stdout, page_size=PAGE_SIZE, cache=None):
+        """
+        The consistency scrubber, through the session of the application
+
+        Arguments:
+            storage -- The storage backend
+            verify -- Whether to read every content again to verify its sha1, md5 and size
+            repair -- Whether to repair the findings, they are only reported otherwise
+            workers -- The number of verification threads
+            max_rate -- The maximum number of bytes read per second by the verification, no limit if None
+            grace_period -- The seconds a finding must hold before it is reported
+            checkpoint -- The path of the checkpoint file, no checkpoint if None
+            report -- The file the findings are written to, as JSON lines
+            page_size -- The number of rows read at once
+            cache -- The metadata cache the deleted files are invalidated from, None without cache
+        """
+
+        self.storage = storage
+        self.verify = verify
+        self.repair = repair
+        self.workers = workers
+        self.throttle = Throttle(max_rate)
+        self.grace_period = grace_period
+        self.checkpoint = checkpoint
+        self.report = report
+        self.page_size = page_size
+        self.cache = cache
+        self.counts = Counter()
+
+    def run(self, resume=False):
+        """
+        Scrubs the whole store, or the rest of it from the checkpoint.
+
+        Argument:
+            resume -- Whether to start from the checkpoint file
+
+        return -- The number of contents scanned, verified and of every finding
+        """
+
+        self.storage.check()
+        after = self.load_checkpoint() if resume else ""
+
+        streams = {
+            "files": self.pages(self.files_query, after),
+            "blobs": self.pages(self.blobs_query, after),
+            "stored": prefetch(self.storage.list(after)),
+        }
+
+        # The verifications in the order of the hashes, and the findings waiting for their grace period
+        pending = deque()
+        deferred = deque()
+        previous = after
+        saved_at = time.monotonic()
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="fileupload-scrub") as executor:
+            for sha1, entry in merge(streams):
+                self.counts["scanned"] += 1
+                files = entry["files"].files if "files" in entry else 0
+                ref_count = entry["blobs"].ref_count if "blobs" in entry else 0
+
+                if issues(files, ref_count, "stored" in entry):
+                    deferred.append((time.monotonic(), sha1, previous, None))
+                elif self.verify and files:
+                    pending.append((sha1, previous, entry["files"], executor.submit(self.read, sha1)))
+
+                while len(pending) > 2 * self.workers:
+                    self.verified(*pending.popleft(), deferred)
+                while deferred and time.monotonic() - deferred[0][0] >= self.grace_period:
+                    _, deferred_sha1, _, corruption = deferred.popleft()
+                    self.confirm(deferred_sha1, corruption)
+
+                previous = sha1
+
+                if time.monotonic() - saved_at >= CHECKPOINT_INTERVAL:
+                    # The scrub resumes before the first content that is not done yet
+                    unfinished = [item[1] for item in itertools.islice(pending, 1)] + [item[2] for item in deferred]
+                    self.save_checkpoint(min(unfinished) if unfinished else sha1)
+                    saved_at = time.monotonic()
+
+            while pending:
+                self.verified(*pending.popleft(), deferred)
+
+        while deferred:
+            detected_at, sha1, _, corruption = deferred.popleft()
+            time.sleep(max(0.0, detected_at + self.grace_period - time.monotonic()))
+            self.confirm(sha1, corruption)
+
+        if self.checkpoint and op.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+        return self.counts
+
+    def files_query(self, after):
+        return (
+            select([
+                FileMetadata.sha1,
+                func.count().label("files"),
+                func.min(func.encode(FileMetadata.md5, "hex")).label("md5"),
+                func.max(func.encode(FileMetadata.md5, "hex")).label("max_md5"),
+                func.min(FileMetadata.size).label("size"),
+                func.max(FileMetadata.size).label("max_size"),
+            ])
+            .where(FileMetadata.sha1 > after)
+            .group_by(FileMetadata.sha1)
+            .order_by(FileMetadata.sha1)
+            .limit(self.page_size)
+        )
+
+    def blobs_query(self, after):
+        return (
+            select([FileBlob.sha1, FileBlob.ref_count])
+            .where(FileBlob.sha1 > after)
+            .order_by(FileBlob.sha1)
+            .limit(self.page_size)
+        )
+
+    def pages(self, query, after):
+        """
+        Reads the rows of a query one page at a time, every page in its own short transaction.
+
+        Arguments:
+            query -- The function returning the query of the page after a sha1 hash
+            after -- The sha1 hash after which the rows start
+
+        return -- An iterator over the rows
+        """
+
+        while True:
+            rows = db.session.execute(query(after)).fetchall()
+            db.session.commit()
+
+            yield from rows
+
+            if len(rows) < self.page_size:
+                return
+            after = rows[-1].sha1
+
+    def read(self, sha1):
+        """
+        Reads a stored content again, in a verification thread.
+
+        Argument:
+            sha1 -- The sha1 hash of the content
+
+        return -- The sha1, the md5 and the size of the content, or the error of the read
+        """
+
+        hasher = MultiHasher(threads=1)
+        size = 0
+
+        try:
+            for block in self.storage.read(sha1):
+                hasher.update(block)
+                size += len(block)
+                self.throttle.wait(len(block))
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+        return {"sha1": hasher.hexdigest("sha1"), "md5": hasher.hexdigest("md5"), "size": size}
+
+    def verified(self, sha1, previous, files, future, deferred):
+        """
+        Compares a verified content with its files, a mismatch is deferred like the other findings.
+        """
+
+        actual = future.result()
+        self.counts["verified"] += 1
+        self.counts["verified_bytes"] += actual.get("size", 0)
+
+        expected = {"sha1": sha1, "md5": files.md5, "size": files.size}
+        if files.max_md5 != files.md5 or files.max_size != files.size or "error" in actual or any(
+                actual[key] != value for key, value in expected.items()):
+            deferred.append((time.monotonic(), sha1, previous, {"expected": expected, "actual": actual}))
+
+    def lock(self, sha1):
+        """
+        Locks the FileBlob row of a content until the transaction ends, the row is added if it is missing.
+
+        return -- The reference count of the content
+        """
+
+        table = FileBlob.__table__
+        statement = insert(table).values(sha1=sha1, ref_count=0)
+        return db.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.sha1],
+            set_=dict(ref_count=table.c.ref_count),
+        ).returning(table.c.ref_count)).scalar()
+
+    def confirm(self, sha1, corruption=None):
+        """
+        Checks a finding again and reports it, then repairs it when repairs are enabled.
+
+        Arguments:
+            sha1 -- The sha1 hash of the content
+            corruption -- The expected and actual digests of a content that failed its verification
+        """
+
+        try:
+            if self.repair:
+                ref_count = self.lock(sha1)
+            else:
+                ref_count = db.session.query(FileBlob.ref_count).filter(FileBlob.sha1 == sha1).scalar() or 0
+
+            files = db.session.query(func.count()).filter(FileMetadata.sha1 == sha1).scalar()
+            stat = self.storage.stat(sha1)
+            found = issues(files, ref_count, stat is not None)
+
+            if corruption and files and stat is not None:
+                found.append(CORRUPT)
+
+            if not found:
+                db.session.rollback()
+                return
+
+            finding = dict(sha1=sha1, issues=found, files=files, ref_count=ref_count,
+                           stored_size=stat and stat[0], repaired=self.repair)
+            if CORRUPT in found:
+                finding.update(corruption)
+
+            if self.repair:
+                deleted = self.fix(sha1, found, finding)
+                db.session.commit()
+
+                # The lookups would return the deleted files from the cache until their entries expire
+                if deleted and self.cache is not None:
+                    self.cache.invalidate(*deleted)
+            else:
+                db.session.rollback()
+        except BaseException:
+            db.session.rollback()
+            raise
+
+        self.counts.update(found)
+        self.report.write(json.dumps(finding) + "\n")
+        self.report.flush()
+
+    def fix(self, sha1, found, finding):
+        """
+        Repairs the findings of a content in the current transaction, its FileBlob row being locked.
+
+        return -- The md5 and sha1 hashes of the deleted files
+        """
+
+        if CORRUPT in found:
+            finding["quarantined"] = self.storage.quarantine(sha1)
+        elif ORPHAN in found:
+            self.storage.delete(sha1)
+
+        files = finding["files"]
+        deleted = []
+
+        if MISSING in found or CORRUPT in found:
+            table = FileMetadata.__table__
+            deleted = db.session.execute(
+                table.delete().where(table.c.sha1 == sha1).returning(
+                    table.c.id, table.c.file_name, table.c.md5, table.c.sha1
+                )
+            ).fetchall()
+            finding["deleted"] = [dict(id=row.id, file_name=row.file_name) for row in deleted]
+            files = 0
+
+        if files:
+            db.session.query(FileBlob).filter(FileBlob.sha1 == sha1).update(
+                {FileBlob.ref_count: files}, synchronize_session=False
+            )
+        else:
+            db.session.query(FileBlob).filter(FileBlob.sha1 == sha1).delete(synchronize_session=False)
+
+        self.counts["repaired"] += 1
+
+        return sorted({row.md5 for row in deleted} | {row.sha1 for row in deleted})
+
+    def load_checkpoint(self):
+        """
+        return -- The sha1 hash the scrub stopped after, an empty string without checkpoint
+        """
+
+        if not self.checkpoint or not op.exists(self.checkpoint):
+            return ""
+
+        with open(self.checkpoint) as file:
+            checkpoint = json.load(file)
+
+        self.counts.update(checkpoint["counts"])
+        return checkpoint["after"]
+
+    def save_checkpoint(self, after):
+        """
+        Atomically saves the progress of the scrub.
+
+        Argument:
+            after -- The sha1 hash up to which every content is scrubbed
+        """
+
+        if not self.checkpoint:
+            return
+
+        fd, path = tempfile.mkstemp(prefix=".checkpoint-", dir=op.dirname(op.abspath(self.checkpoint)))
+        with os.fdopen(fd, "w") as file:
+            json.dump({"after": after, "counts": self.counts}, file)
+        os.replace(path, self.checkpoint)
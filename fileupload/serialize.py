@@ -0,0 +1,73 @@
+"""
+The fast serialization of the file metadata, for the paths returning many files.
+
+The FileMetadataSchema dump builds an ORM object per row, adds it to the identity map of the session,
+then runs every field of the schema on it. Here the columns are selected as plain tuples, mapped to the
+output keys once, and encoded by orjson when it is installed. The output is the same as the dump of the
+schema without the id, marshmallow is only kept for validating the input of the updates.
+
+A query selects the COLUMNS, then the id last so that it can be used by the keyset cursors:
+
+    rows = FileMetadata.query.with_entities(*serialize.COLUMNS).order_by(FileMetadata.id)
+    data = [serialize.dump(row) for row in rows]
+"""
+
+import datetime
+import json
+
+from fileupload.models import FileMetadata
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EXCLUDED = ("id", "chunk_hashes")
+FIELDS = [column for column in FileMetadata.__table__.columns if column.key not in EXCLUDED]
+KEYS = tuple(column.key for column in FIELDS)
+COLUMNS = [getattr(FileMetadata, key) for key in KEYS] + [FileMetadata.id]
+DATETIME_KEYS = tuple(column.key for column in FIELDS if column.type.python_type is datetime.datetime)
+
+
+def dump(row):
+    """
+    Maps a row selected with the COLUMNS to the serialized metadata of its file, without the id.
+    The trailing id of the row has no key, so zip leaves it out.
+
+    Argument:
+        row -- The tuple of the values of the COLUMNS
+
+    return -- The serialized metadata
+    """
+
+    data = dict(zip(KEYS, row))
+
+    for key in DATETIME_KEYS:
+        if data[key] is not None:
+            data[key] = data[key].isoformat()
+
+    return data
+
+
+def dump_file(file):
+    """
+    return -- The serialized metadata of a FileMetadata object, without the id
+    """
+
+    return dump([getattr(file, key) for key in KEYS])
+
+
+def dumps(data):
+    """
+    Encodes serialized metadata as JSON, with orjson when it is installed.
+
+    Argument:
+        data -- The serialized metadata of one or many files
+
+    return -- The UTF-8 encoded JSON
+    """
+
+    if orjson is not None:
+        return orjson.dumps(data)
+
+    return json.dumps(data, separators=(",", ":")).encode()
@@ -0,0 +1,373 @@
+"""
+The resumable chunked upload sessions.
+
+A session is a directory under the sessions root holding the session description,
+the data file preallocated to the full size of the file and one marker file per received chunk.
+Chunks are written with positional writes, so they can be sent in parallel and retried
+in any order. The md5 and sha1 hashes are advanced over the contiguous received prefix
+while the chunks arrive, so finalizing a session does not read the file again. A session whose
+beginning was not seen by the process is hashed at once by the parallel engine when it is finalized.
+A chunk is received once: sent again with the same bytes it is accepted as it is, with other bytes
+it is rejected, so the hashed prefix always matches the data file.
+"""
+
+import json
+import os
+import os.path as op
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from fileupload import hashing, ingest
+from fileupload.ingest import BLOCK_SIZE, HEADER_SIZE
+
+CHUNK_SIZE = 8388608
+MAX_CHUNK_SIZE = 67108864
+SESSION_TTL = 86400
+
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SessionNotFound(Exception):
+    """
+    The session does not exist, has expired or was already finalized
+    """
+
+
+class InvalidChunk(Exception):
+    """
+    The chunk index or the chunk length does not match the session
+    """
+
+
+class IncompleteSession(Exception):
+    """
+    The session was finalized while some of its chunks are missing
+    """
+
+
+class ChunkConflict(Exception):
+    """
+    The chunk was already received with other bytes
+    """
+
+
+class SessionHasher:
+
+    def __init__(self):
+        """
+        The md5, sha1 and tree hash state of the contiguous received prefix of a session
+        """
+
+        self.hasher = hashing.MultiHasher(tree_chunk_size=hashing.INGEST_TREE_CHUNK_SIZE)
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def update(self, buf):
+        self.hasher.update(buf)
+        self.offset += len(buf)
+
+
+class UploadSessions:
+
+    def __init__(self, root, ttl=SESSION_TTL):
+        """
+        The upload sessions stored under a root directory
+
+        Arguments:
+            root -- The directory of the sessions, it must be in the same filesystem as DATA_DIR
+            ttl -- The seconds of inactivity after which a session is garbage collected
+        """
+
+        self.root = root
+        self.ttl = ttl
+        self.hashers = {}
+        self.lock = threading.Lock()
+
+    def path(self, session_id, *parts):
+        if not SESSION_ID.match(session_id):
+            raise SessionNotFound(session_id)
+
+        return op.join(self.root, session_id, *parts)
+
+    def create(self, file_name, size, chunk_size=CHUNK_SIZE, sha1=None, md5=None):
+        """
+        Creates a new session with its data file preallocated to the size of the file.
+
+        Arguments:
+            file_name -- The name of the file to upload
+            size -- The total size of the file in bytes
+            chunk_size -- The size of every chunk except the last one
+            sha1 -- The sha1 hash claimed by the client, verified by the finalization
+            md5 -- The md5 hash claimed by the client, verified by the finalization
+
+        return -- The description of the session
+        """
+
+        if size < 0 or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise InvalidChunk(f"Invalid size {size} or chunk size {chunk_size}")
+
+        self.collect()
+
+        session_id = uuid.uuid4().hex
+        os.makedirs(self.path(session_id, "chunks"))
+
+        with open(self.path(session_id, "data"), "wb") as data:
+            data.truncate(size)
+
+        session = {
+            "session_id": session_id,
+            "file_name": file_name,
+            "size": size,
+            "chunk_size": chunk_size,
+            "chunk_count": max(1, -(-size // chunk_size)),
+        }
+        if sha1:
+            session["sha1"] = sha1.lower()
+        if md5:
+            session["md5"] = md5.lower()
+
+        with open(self.path(session_id, "session.json"), "w") as file:
+            json.dump(session, file)
+
+        return session
+
+    def load(self, session_id):
+        """
+        Reads the description of a session.
+
+        Argument:
+            session_id -- The id of the session
+
+        return -- The description of the session
+        """
+
+        try:
+            with open(self.path(session_id, "session.json")) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            raise SessionNotFound(session_id)
+
+    def received(self, session_id):
+        """
+        return -- The sorted indexes of the received chunks of a session
+        """
+
+        try:
+            return sorted(int(index) for index in os.listdir(self.path(session_id, "chunks")))
+        except FileNotFoundError:
+            raise SessionNotFound(session_id)
+
+    def status(self, session_id):
+        """
+        return -- The description of a session with the offsets of its received chunks
+        """
+
+        session = self.load(session_id)
+        received = self.received(session_id)
+
+        session["received"] = [index * session["chunk_size"] for index in received]
+        session["missing"] = sorted(set(range(session["chunk_count"])) - set(received))
+
+        return session
+
+    def write_chunk(self, session_id, index, buf):
+        """
+        Writes one chunk of a session at its offset. Sending the same chunk twice is harmless,
+        a chunk already received is not written again.
+
+        Arguments:
+            session_id -- The id of the session
+            index -- The index of the chunk, starting at 0
+            buf -- The bytes of the chunk
+
+        return -- The offset and the length of the written chunk
+
+        raise -- ChunkConflict when the chunk was already received with other bytes
+        """
+
+        session = self.load(session_id)
+        offset = index * session["chunk_size"]
+        length = min(session["chunk_size"], session["size"] - offset)
+
+        if not 0 <= index < session["chunk_count"] or len(buf) != max(length, 0):
+            raise InvalidChunk(f"Invalid chunk {index} of {len(buf)} bytes")
+
+        try:
+            fd = os.open(self.path(session_id, "data"), os.O_RDWR)
+        except FileNotFoundError:
+            raise SessionNotFound(session_id)
+
+        try:
+            # The received chunks may already be hashed, in this process or in another one
+            if op.exists(self.path(session_id, "chunks", str(index))):
+                if os.pread(fd, len(buf), offset) != buf:
+                    raise ChunkConflict(f"Chunk {index} was already received with other bytes")
+                return {"offset": offset, "length": len(buf)}
+
+            os.pwrite(fd, buf, offset)
+        finally:
+            os.close(fd)
+
+        open(self.path(session_id, "chunks", str(index)), "wb").close()
+        os.utime(self.path(session_id, "session.json"))
+
+        self.advance(session_id, session, offset, buf)
+
+        return {"offset": offset, "length": len(buf)}
+
+    def advance(self, session_id, session, offset=None, buf=None, data_path=None):
+        """
+        Advances the hashes of a session over its contiguous received prefix.
+        The bytes of a chunk that starts exactly at the hashed offset are used as they are,
+        only chunks that arrived out of order are read back from the data file.
+
+        The hash state lives in the memory of the process, a process that never saw the
+        beginning of the session leaves the hashing to the finalization.
+
+        Arguments:
+            session_id -- The id of the session
+            session -- The description of the session
+            offset -- The offset of the chunk that was just written
+            buf -- The bytes of the chunk that was just written
+            data_path -- The data file to read from, the session data file if None
+
+        return -- The hasher of the session or None if this process cannot advance it
+        """
+
+        with self.lock:
+            hasher = self.hashers.get(session_id)
+            created = hasher is None and offset == 0
+            if created:
+                hasher = self.hashers[session_id] = SessionHasher()
+
+        if hasher is None:
+            return None
+
+        if created:
+            self.collect_hashers()
+
+        with hasher.lock:
+            if offset is not None and offset == hasher.offset:
+                hasher.update(buf)
+
+            received = set(self.received(session_id)) if data_path is None else None
+            chunk_size = session["chunk_size"]
+            path = data_path or self.path(session_id, "data")
+
+            with open(path, "rb") as data:
+                data.seek(hasher.offset)
+                while hasher.offset < session["size"]:
+                    if received is not None and hasher.offset // chunk_size not in received:
+                        break
+                    end = min(session["size"], (hasher.offset // chunk_size + 1) * chunk_size)
+                    hasher.update(data.read(min(BLOCK_SIZE, end - hasher.offset)))
+
+        return hasher
+
+    def finalize(self, session_id, staging_path):
+        """
+        Claims a complete session and moves its data file to a staging path.
+        The session is removed even when its content does not match the claimed hashes.
+
+        Arguments:
+            session_id -- The id of the session
+            staging_path -- The path that receives the data file, in the same filesystem
+
+        return -- The metadata of the file and its header bytes for the file type detection
+        """
+
+        session = self.load(session_id)
+        if len(self.received(session_id)) != session["chunk_count"]:
+            raise IncompleteSession(session_id)
+
+        try:
+            os.rename(self.path(session_id, "data"), staging_path)
+        except FileNotFoundError:
+            raise SessionNotFound(session_id)
+
+        hasher = self.advance(session_id, session, data_path=staging_path)
+
+        if hasher is not None:
+            digests = hasher.hasher.digests()
+        else:
+            digests = hashing.hash_path(staging_path, tree_chunk_size=hashing.INGEST_TREE_CHUNK_SIZE)
+
+        with open(staging_path, "rb") as data:
+            header = data.read(HEADER_SIZE)
+
+        self.delete(session_id)
+
+        metadata = ingest.digest_metadata(session["size"], digests)
+        metadata["file_name"] = session["file_name"]
+        ingest.verify(metadata, {"file_sha1": session.get("sha1"), "file_md5": session.get("md5")})
+
+        return metadata, header
+
+    def delete(self, session_id):
+        """
+        Removes a session and its received chunks.
+
+        Argument:
+            session_id -- The id of the session
+        """
+
+        with self.lock:
+            self.hashers.pop(session_id, None)
+        shutil.rmtree(self.path(session_id), ignore_errors=True)
+
+    def collect(self):
+        """
+        Removes the sessions that have been inactive for longer than the ttl.
+
+        return -- The ids of the removed sessions
+        """
+
+        self.collect_hashers()
+
+        if not op.isdir(self.root):
+            return []
+
+        expired = []
+        deadline = time.time() - self.ttl
+        for session_id in os.listdir(self.root):
+            try:
+                if op.getmtime(self.path(session_id, "session.json")) < deadline:
+                    expired.append(session_id)
+            except (SessionNotFound, FileNotFoundError):
+                continue
+
+        for session_id in expired:
+            self.delete(session_id)
+
+        return expired
+
+    def collect_hashers(self):
+        """
+        Drops the hash states kept by this process for the sessions that were finalized, deleted or
+        garbage collected, by any process, or that have been inactive for longer than the ttl.
+
+        return -- The ids of the dropped sessions
+        """
+
+        with self.lock:
+            session_ids = list(self.hashers)
+
+        dropped = []
+        deadline = time.time() - self.ttl
+        for session_id in session_ids:
+            try:
+                if op.getmtime(self.path(session_id, "session.json")) >= deadline:
+                    continue
+            except FileNotFoundError:
+                pass
+
+            dropped.append(session_id)
+
+        with self.lock:
+            for session_id in dropped:
+                self.hashers.pop(session_id, None)
+
+        return dropped
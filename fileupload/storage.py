@@ -0,0 +1,549 @@
+"""
+The storage backends of the uploaded files.
+
+Every distinct content is stored once, under its sha1 hash. The file names only live in the
+database, and the number of FileMetadata rows sharing a content is tracked by the FileBlob
+reference count. The backend is selected with the STORAGE_BACKEND environment variable:
+
+    local -- Fan-out directories (ab/cd/abcdef...) under DATA_DIR/blobs (default), the contents
+             under PACK_MAX_FILE_SIZE are packed in segment files when it is set (see fileupload.packs)
+    s3 -- An S3-compatible object store (AWS S3, MinIO, Ceph...), it requires boto3
+
+Backends write from streams and read byte ranges, so a file never has to sit in memory.
+A content can be stored compressed (see fileupload.compression), its ranges are then read from
+the decompressed stream.
+"""
+
+import io
+import os
+import os.path as op
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from fileupload import compression, ingest
+from fileupload.ingest import BLOCK_SIZE
+
+PART_SIZE = 8388608
+BLOB_NAME = re.compile(r"^[0-9a-f]{40}$")
+MAX_POOL_CONNECTIONS = 32
+MAX_CONCURRENCY = 4
+
+
+class StorageBackend:
+    """
+    The interface of the storage backends, contents are addressed by their sha1 hash
+    """
+
+    def exists(self, sha1):
+        raise NotImplementedError
+
+    def stat(self, sha1):
+        """
+        return -- The stored size of a content in bytes and its compression,
+                  or None if the content is not stored
+        """
+        raise NotImplementedError
+
+    def size(self, sha1):
+        """
+        return -- The stored size of a content in bytes
+        """
+        return self.stat(sha1)[0]
+
+    def write(self, sha1, stream, compression=None):
+        """
+        Stores a content read from a stream.
+
+        Arguments:
+            sha1 -- The sha1 hash of the content
+            stream -- A file-like object opened in binary mode
+            compression -- The codec the stream is compressed with, it is stored as it is
+        """
+        raise NotImplementedError
+
+    def read(self, sha1, start=0, length=None):
+        """
+        Reads a byte range of a content, decompressed if it is stored compressed.
+
+        Arguments:
+            sha1 -- The sha1 hash of the content
+            start -- The offset of the first byte
+            length -- The number of bytes to read, up to the end if None
+
+        return -- An iterator over the blocks of the range
+        """
+        raise NotImplementedError
+
+    def delete(self, sha1):
+        """
+        Removes a content.
+
+        Argument:
+            sha1 -- The sha1 hash of the content
+
+        return -- True if the content was removed, False if it was not stored
+        """
+        raise NotImplementedError
+
+    def location(self, sha1):
+        """
+        return -- A human readable location of a content, for the logs
+        """
+        raise NotImplementedError
+
+    def local_path(self, sha1):
+        """
+        return -- The path of a content in the local filesystem or None if it is not stored locally
+        """
+        return None
+
+    def check(self):
+        """
+        Checks that the backend is reachable, raises an exception otherwise.
+        """
+        raise NotImplementedError
+
+    def list(self, after=""):
+        """
+        Lists the stored contents in the order of their sha1 hashes.
+
+        Argument:
+            after -- The sha1 hash after which the listing starts
+
+        return -- An iterator over the sha1 hash and the stored size of every content
+        """
+        raise NotImplementedError
+
+    def quarantine(self, sha1):
+        """
+        Moves a content out of the store, where it can still be inspected.
+
+        Argument:
+            sha1 -- The sha1 hash of the content
+
+        return -- The location of the quarantined content
+        """
+        raise NotImplementedError
+
+    def put(self, staging_path, sha1, compression=None):
+        """
+        Stores a staging file, unless the content is already stored.
+        The staging file is consumed in both cases.
+
+        Arguments:
+            staging_path -- The path of the staging file
+            sha1 -- The sha1 hash of the content
+            compression -- The codec to compress the content with, None to store it as it is
+
+        return -- True if the content was added, False if it was already stored
+        """
+
+        try:
+            if self.exists(sha1):
+                return False
+
+            with open(staging_path, "rb") as source:
+                self.write(sha1, *compress_stream(source, compression))
+
+            return True
+        finally:
+            ingest.discard(staging_path)
+
+
+class LocalStorage(StorageBackend):
+
+    def __init__(self, root):
+        """
+        A content-addressed blob store in a local directory
+
+        Argument:
+            root -- The directory of the blobs, in the same filesystem as the staging files
+                    so that they can be renamed instead of copied
+        """
+
+        self.root = root
+
+    def path(self, sha1, compression=None):
+        """
+        return -- The path of the blob with the given sha1 hash, suffixed with the extension of its compression
+        """
+
+        return op.join(self.root, sha1[:2], sha1[2:4], sha1 + compression_suffix(compression))
+
+    def location(self, sha1):
+        stat = self.stat(sha1)
+        return self.path(sha1, stat and stat[1])
+
+    def local_path(self, sha1):
+        # A compressed blob cannot be sent as it is
+        stat = self.stat(sha1)
+        return self.path(sha1) if stat is not None and stat[1] is None else None
+
+    def stat(self, sha1):
+        for codec in (None,) + compression.CODECS:
+            try:
+                return os.stat(self.path(sha1, codec)).st_size, codec
+            except FileNotFoundError:
+                pass
+
+        return None
+
+    def exists(self, sha1):
+        return self.stat(sha1) is not None
+
+    def check(self):
+        if not op.isdir(self.root):
+            raise FileNotFoundError(f"The blob directory {self.root} does not exist")
+
+    def list(self, after=""):
+        # The fan-out directories are walked in order, the ones before the checkpoint are skipped
+        for first in sorted(os.listdir(self.root)):
+            if first < after[:2] or not op.isdir(op.join(self.root, first)):
+                continue
+
+            for second in sorted(os.listdir(op.join(self.root, first))):
+                if first + second < after[:4] or not op.isdir(op.join(self.root, first, second)):
+                    continue
+
+                blobs = {}
+                with os.scandir(op.join(self.root, first, second)) as entries:
+                    for entry in entries:
+                        sha1 = entry.name.split(".")[0]
+                        if BLOB_NAME.match(sha1) and sha1 > after:
+                            blobs[sha1] = (sha1, entry.stat().st_size)
+
+                yield from (blobs[sha1] for sha1 in sorted(blobs))
+
+    def quarantine(self, sha1):
+        stat = self.stat(sha1)
+        quarantine_dir = op.join(op.dirname(self.root), ".quarantine")
+        quarantine_path = op.join(quarantine_dir, op.basename(self.path(sha1, stat and stat[1])))
+
+        os.makedirs(quarantine_dir, exist_ok=True)
+        os.replace(self.path(sha1, stat and stat[1]), quarantine_path)
+
+        return quarantine_path
+
+    def put(self, staging_path, sha1, compression=None):
+        if self.exists(sha1):
+            ingest.discard(staging_path)
+            return False
+
+        # A compressed content is written from the staging file, an uncompressed one is only renamed
+        if compression:
+            with open(staging_path, "rb") as source:
+                stream, codec = compress_stream(source, compression)
+                if codec:
+                    self.write(sha1, stream, codec)
+
+            if codec:
+                ingest.discard(staging_path)
+                return True
+
+        blob_path = self.path(sha1)
+        os.makedirs(op.dirname(blob_path), exist_ok=True)
+        ingest.commit(staging_path, blob_path)
+
+        return True
+
+    def write(self, sha1, stream, compression=None):
+        blob_path = self.path(sha1, compression)
+        os.makedirs(op.dirname(blob_path), exist_ok=True)
+
+        fd, staging_path = tempfile.mkstemp(prefix="write-", dir=op.dirname(blob_path))
+        try:
+            with os.fdopen(fd, "wb") as staging:
+                shutil.copyfileobj(stream, staging, BLOCK_SIZE)
+            os.chmod(staging_path, 0o644)
+            ingest.commit(staging_path, blob_path)
+        except BaseException:
+            ingest.discard(staging_path)
+            raise
+
+    def read(self, sha1, start=0, length=None):
+        stat = self.stat(sha1)
+        codec = stat and stat[1]
+
+        if codec:
+            return compression.decompress(self.read_blob(self.path(sha1, codec)), codec, BLOCK_SIZE, start, length)
+
+        return self.read_blob(self.path(sha1), start, length)
+
+    def read_blob(self, blob_path, start=0, length=None):
+        with open(blob_path, "rb") as blob:
+            blob.seek(start)
+            remaining = length
+
+            while remaining is None or remaining > 0:
+                buf = blob.read(BLOCK_SIZE if remaining is None else min(BLOCK_SIZE, remaining))
+                if not buf:
+                    break
+                if remaining is not None:
+                    remaining -= len(buf)
+                yield buf
+
+    def delete(self, sha1):
+        deleted = False
+
+        for codec in (None,) + compression.CODECS:
+            try:
+                os.remove(self.path(sha1, codec))
+                deleted = True
+            except FileNotFoundError:
+                pass
+
+        return deleted
+
+
+class S3Storage(StorageBackend):
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None, client=None,
+                 max_pool_connections=MAX_POOL_CONNECTIONS, part_size=PART_SIZE,
+                 max_concurrency=MAX_CONCURRENCY):
+        """
+        A content-addressed blob store in an S3-compatible bucket.
+        Large contents are sent with multipart uploads, a few parts at a time, so the memory
+        used by an upload is bounded by part_size * max_concurrency.
+
+        Arguments:
+            bucket -- The name of the bucket
+            prefix -- The prefix of the keys in the bucket
+            endpoint_url -- The url of the S3-compatible service, AWS S3 if None
+            region -- The region of the bucket
+            client -- A boto3 S3 client, created lazily in every process if None
+            max_pool_connections -- The size of the HTTP connection pool of the client
+            part_size -- The size of the multipart upload parts, at least 5 MiB
+            max_concurrency -- The number of parts uploaded at the same time
+        """
+
+        # boto3 takes longer to import than the rest of the service, only the s3 backend imports it
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("The s3 storage backend requires boto3")
+
+        self.boto3 = boto3
+        self.config_class = Config
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.max_pool_connections = max_pool_connections
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self._client = client
+        self._pid = os.getpid() if client else None
+
+    @property
+    def client(self):
+        """
+        The S3 client of the current process, with its own pool of HTTP connections
+        """
+
+        if self._client is None or self._pid != os.getpid():
+            self._client = self.boto3.session.Session().client(
+                "s3",
+                endpoint_url=self.endpoint_url,
+                region_name=self.region,
+                config=self.config_class(max_pool_connections=self.max_pool_connections, retries={"max_attempts": 5}),
+            )
+            self._pid = os.getpid()
+
+        return self._client
+
+    def key(self, sha1):
+        return f"{self.prefix}{sha1[:2]}/{sha1[2:4]}/{sha1}"
+
+    def location(self, sha1):
+        return f"s3://{self.bucket}/{self.key(sha1)}"
+
+    def head(self, sha1):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(sha1))
+        except self.client_error as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def stat(self, sha1):
+        # The compression is kept in the metadata of the object, under the same key
+        head = self.head(sha1)
+        return head and (head["ContentLength"], head.get("Metadata", {}).get("compression"))
+
+    def exists(self, sha1):
+        return self.head(sha1) is not None
+
+    def check(self):
+        self.client.head_bucket(Bucket=self.bucket)
+
+    def list(self, after=""):
+        pages = self.client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=self.prefix, StartAfter=self.key(after) if after else ""
+        )
+
+        for page in pages:
+            for item in page.get("Contents", []):
+                sha1 = item["Key"][len(self.prefix):].split("/")[-1]
+                if BLOB_NAME.match(sha1) and item["Key"] == self.key(sha1):
+                    yield sha1, item["Size"]
+
+    def quarantine(self, sha1):
+        key = f"{self.prefix}quarantine/{sha1}"
+        self.client.copy_object(Bucket=self.bucket, Key=key, CopySource={"Bucket": self.bucket, "Key": self.key(sha1)})
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(sha1))
+
+        return f"s3://{self.bucket}/{key}"
+
+    def write(self, sha1, stream, compression=None):
+        key = self.key(sha1)
+        metadata = {"compression": compression} if compression else {}
+        buf = stream.read(self.part_size)
+
+        if len(buf) < self.part_size:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=buf, Metadata=metadata)
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key, Metadata=metadata)["UploadId"]
+
+        def upload_part(number, body):
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body
+            )
+            return {"ETag": response["ETag"], "PartNumber": number}
+
+        try:
+            parts = []
+            pending = []
+            with ThreadPoolExecutor(self.max_concurrency) as executor:
+                number = 1
+                while len(buf) > 0:
+                    if len(pending) >= self.max_concurrency:
+                        parts.append(pending.pop(0).result())
+                    pending.append(executor.submit(upload_part, number, buf))
+                    number += 1
+                    buf = stream.read(self.part_size)
+                parts.extend(future.result() for future in pending)
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def read(self, sha1, start=0, length=None):
+        if length == 0:
+            return iter(())
+
+        # A whole content is read in a single request, its metadata tells if it is compressed
+        if start == 0 and length is None:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(sha1))
+            codec = response.get("Metadata", {}).get("compression")
+            blocks = self.read_body(response["Body"])
+            return compression.decompress(blocks, codec, BLOCK_SIZE) if codec else blocks
+
+        codec = self.stat(sha1)[1]
+        if codec:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.key(sha1))["Body"]
+            return compression.decompress(self.read_body(body), codec, BLOCK_SIZE, start, length)
+
+        end = "" if length is None else start + length - 1
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(sha1), Range=f"bytes={start}-{end}")
+        return self.read_body(response["Body"])
+
+    def read_body(self, body):
+        try:
+            buf = body.read(BLOCK_SIZE)
+            while len(buf) > 0:
+                yield buf
+                buf = body.read(BLOCK_SIZE)
+        finally:
+            body.close()
+
+    def delete(self, sha1):
+        if not self.exists(sha1):
+            return False
+
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(sha1))
+        return True
+
+
+def compression_suffix(codec):
+    """
+    return -- The file extension of a compressed blob, an empty string if it is not compressed
+    """
+
+    return compression.SUFFIXES[codec] if codec else ""
+
+
+def compress_stream(source, codec):
+    """
+    Compresses a staging file while the backend reads it, unless its first block does not shrink
+    by MIN_SAVING. The first block is compressed on its own to tell, which is the whole content of
+    most files, so the staging file is never written again compressed.
+
+    Arguments:
+        source -- The staging file, opened in binary mode
+        codec -- The name of the codec, None for no compression
+
+    return -- The stream to store and its compression, the staging file and None if it is not compressed
+    """
+
+    if not codec:
+        return source, None
+
+    sample = source.read(BLOCK_SIZE)
+    compressed = compression.compress_bytes(sample, codec)
+
+    if not compression.worth(len(sample), len(compressed)):
+        source.seek(0)
+        return source, None
+
+    if len(sample) < BLOCK_SIZE:
+        return io.BytesIO(compressed), codec
+
+    source.seek(0)
+    return compression.CompressingReader(source, codec, BLOCK_SIZE), codec
+
+
+def create_storage(data_dir, environ=os.environ):
+    """
+    Creates the storage backend selected by the environment.
+
+    Arguments:
+        data_dir -- The DATA_DIR of the local backend
+        environ -- The environment variables
+
+    return -- The storage backend
+    """
+
+    backend = environ.get("STORAGE_BACKEND", "local")
+
+    if backend == "local":
+        blobs = LocalStorage(op.join(data_dir, "blobs"))
+        max_file_size = int(environ.get("PACK_MAX_FILE_SIZE", 0))
+
+        if not max_file_size:
+            return blobs
+
+        from fileupload.packs import PackedStorage, SEGMENT_SIZE
+
+        return PackedStorage(op.join(data_dir, "packs"), blobs, max_file_size,
+                             segment_size=int(environ.get("PACK_SEGMENT_SIZE", SEGMENT_SIZE)))
+    elif backend == "s3":
+        return S3Storage(
+            environ["S3_BUCKET"],
+            prefix=environ.get("S3_PREFIX", ""),
+            endpoint_url=environ.get("S3_ENDPOINT_URL") or None,
+            region=environ.get("S3_REGION") or None,
+            max_pool_connections=int(environ.get("S3_MAX_POOL_CONNECTIONS", MAX_POOL_CONNECTIONS)),
+            part_size=int(environ.get("S3_PART_SIZE", PART_SIZE)),
+            max_concurrency=int(environ.get("S3_MAX_CONCURRENCY", MAX_CONCURRENCY)),
+        )
+
+    raise ValueError(f"Unknown storage backend {backend}")
@@ -1,440 +1,1611 @@
-"""
-The module that the flask/connexion will lookout for to perform the functionalities for the request methods
-of the API server.
-"""
-
-import tempfile
-import hashlib
-import os.path as op
-import os
-import shutil
-from sqlalchemy import or_
-from magic import Magic, MagicException
-from flask import abort, jsonify
-from sqlalchemy.exc import DataError, IntegrityError
-from fileupload.models import FileMetadata, FileMetadataSchema, db
-import logging.config
-import logging
-import yaml
-from app import MOD_PATH
-from marshmallow.exceptions import ValidationError
-
-f = Magic(mime=True)
-
-ROOT_DIR = os.environ['ROOT_DIR']
-LOG_DIR = os.environ['LOG_DIR']
-DATA_DIR = os.environ['DATA_DIR']
-
-
-class FileUpload:
-
-    def __init__(self):
-        """
-        The file upload service functions encapsulated in a class
-        """
-
-        self.setup_logging()
-        self.logger = logging.getLogger("fileupload")
-
-    @staticmethod
-    def setup_logging(default_path='logging.yml', default_level=logging.INFO):
-        """
-        A method to setup the logging configurations.
-
-        Arguments:
-            default_path -- The yaml logging specification file
-            default_level -- The default level for the logging configuration
-        """
-        path = op.join(MOD_PATH, default_path)
-        handlers = [("info_file_handler", "info.log"),
-                    ("error_file_handler", "error.log"),
-                    ("debug_file_handler", "debug.log"),
-                    ("critical_file_handler", "critical.log"),
-                    ("warn_file_handler", "warn.log")]
-
-        if op.exists(path):
-            if not op.exists(LOG_DIR):
-                os.mkdir(LOG_DIR)
-            with open(path, 'rt') as file:
-                try:
-                    config = yaml.safe_load(file.read())
-                    for handler, fname in handlers:
-                        config['handlers'][handler]['filename'] = f'{LOG_DIR}/{fname}'
-                    logging.config.dictConfig(config)
-                except Exception:
-                    logging.basicConfig(level=default_level)
-        else:
-            logging.basicConfig(level=default_level)
-            logging.warning('Failed to load configuration file. Using default configs')
-
-    def load_index(self):
-        """
-        A method that will return a string object for a basic request method
-
-        response -- API server description
-        """
-
-        return "File Upload service by Reagan Balongcas, GRID Trainee"
-
-    def upload_file(self, upfile):
-        """
-        The method for a POST request to upload a file.
-        It will extract the metadata of the file argument and add
-        those information in the database.
-
-        Arguments:
-            upfile - The file object sent to the server\
-
-        responses:
-            201 -- The uploaded file metadata information
-            403 -- File already exist
-        """
-
-        self.logger.info(f"Filetype: {type(upfile)}")
-
-        metadata = self.extract_meta(upfile)
-
-        schema = FileMetadataSchema()
-        new_file = FileMetadata(
-            size=metadata['file_size'],
-            file_name=metadata['file_name'],
-            sha1=metadata['file_sha1'],
-            md5=metadata['file_md5'],
-            type=metadata['file_type'],
-        )
-
-        try:
-            db.session.add(new_file)
-            db.session.commit()
-            data = schema.dump(new_file)
-            data.pop('id')
-
-            self.logger.info(f"File uploaded! {' / '.join([ f'{k}: {e}' for k,e in data.items() ])}")
-
-            self.save_to_host(new_file.id, upfile)
-
-            return jsonify(data), 201
-        except DataError:
-            db.session.rollback()
-            db.session.commit()
-
-            self.logger.error(f"File exist! {' / '.join([ f'{k}: {e}' for k,e in metadata.items() ])}")
-            return abort(403, "File already exist!")
-        except IntegrityError:
-            db.session.rollback()
-            db.session.commit()
-
-            self.logger.error(f"File exist! {' / '.join([f'{k}: {e}' for k, e in metadata.items()])}")
-            return abort(403, "File already exist!")
-
-    def read_files(self):
-        """
-        The method for a GET request of retrieving all the uploaded files in the database.
-        Metadata information for each file are the response to be expected.
-
-
-        response:
-            200 - List of metadata objects
-        """
-
-        all_files = (
-            FileMetadata.query.all()
-        )
-
-        schema = FileMetadataSchema()
-
-        def remove_id(dct):
-            d = schema.dump(dct)
-            d.pop('id')
-            return d
-
-        data = [remove_id(af) for af in all_files]
-
-        return jsonify(data), 200
-
-    def read_file(self, file_hash):
-        """
-        Another method for a GET request but for retrieving a single file only
-
-        Argument:
-            file_hash -- Hash string format in md5 or sha1
-
-        response:
-            200 - The metadata object for the file with given hash
-        """
-        file = FileMetadata.query.filter(or_(FileMetadata.md5 == file_hash, FileMetadata.sha1 == file_hash)).one_or_none()
-
-        if file:
-            schema = FileMetadataSchema()
-            data = schema.dump(file)
-
-            data.pop('id')
-
-            return jsonify(data), 200
-        else:
-            abort(
-                404,
-                "File not found!"
-            )
-
-    def update_file(self, file_hash, file):
-        """
-        A PUT request dedicated method. It accepts both the hash for a file and the object containing
-        the information to be updated
-
-        Argument:
-            file_hash -- The hash for a specific file uploaded in the server
-            file -- The metadata objects to be updated (file type or filename)
-
-        responses:
-            201 - The metadata for the file with the updated fields
-            403 - Invalid schema or properties provided
-            404 - File not found
-        """
-
-        update_file = FileMetadata.query.filter(or_(FileMetadata.md5 == file_hash, FileMetadata.sha1 == file_hash)).one_or_none()
-
-        if update_file:
-            old_fname = update_file.file_name[:]
-
-            if len(file) <= 2 and ('file_name' in file or 'type' in file):
-                try:
-                    schema = FileMetadataSchema()
-                    update = schema.load(file, session=db.session, instance=update_file)
-
-                    update.id = update_file.id
-                    db.session.merge(update)
-                    db.session.commit()
-                    data = schema.dump(update)
-                    data.pop('id')
-
-                    self.logger.info(f"File updated! {' / '.join([f'{k}: {e}' for k, e in data.items()])}")
-
-                    if 'file_name' in  file:
-                        self.rename_file_in_host(update_file.id, old_fname, file['file_name'])
-
-                    return jsonify(data), 201
-                except ValidationError:
-                    self.logger.error(f"Invalid schema provided!")
-                    return abort(
-                        403,
-                        "Invalid schema provided!"
-                    )
-            else:
-                self.logger.error(f"Invalid properties provided!")
-                return abort(
-                    403,
-                    "Invalid properties provided!"
-                )
-        else:
-            self.logger.error(f"File with hash {file_hash} not found!")
-            abort(
-                404,
-                f"File with {file_hash} not found!"
-            )
-
-    def save_to_host(self, file_id, file):
-        """
-        This method will save the file sent by the request.
-
-        Arguments:
-            file_id -- The database id of the uploaded file
-            file -- The actual file object
-        """
-        if op.exists(DATA_DIR):
-            dir_path = op.join(DATA_DIR, str(file_id))
-            os.mkdir(dir_path)
-            file_path = op.join(dir_path, file.filename)
-            file.save(file_path)
-            self.logger.info(f"File saved in {file_path}")
-
-    def rename_file_in_host(self, id_, old_fname, new_fname):
-        """
-        An essential method to call under the PUT request method.
-        It will rename the existing file stored in the local storage.
-
-        Arguments:
-            id_ -- The id of the updated file
-            old_fname -- the previous file name
-            new_fname -- the new file name
-        """
-        rename_id = str(id_)
-        dir_path = op.join(DATA_DIR, rename_id)
-        file_path_old = op.join(dir_path, old_fname)
-        file_path_new = op.join(dir_path, new_fname)
-        print(file_path_old)
-        print(file_path_new)
-
-        if op.isdir(dir_path) and op.isfile(file_path_old):
-            os.rename(file_path_old, file_path_new)
-            self.logger.info(f"File renamed from {old_fname} to {new_fname}")
-
-    def delete_file(self, file_hash):
-        """
-        The method dedicated for the DEL request. It will delete the file metadata in the database
-        and the file object in the storage based from the given hash.
-
-        Argument:
-            file_hash -- md5 or sha1 hash of a specific file
-
-        responses:
-            201 - File deletion success
-            404 - File not found
-        """
-        file = FileMetadata.query.filter(or_(FileMetadata.md5 == file_hash, FileMetadata.sha1 == file_hash)).one_or_none()
-
-        if file:
-            db.session.delete(file)
-            db.session.commit()
-            self.delete_file_in_host(file.id)
-            self.logger.warning(f"File {file.file_name} deleted!")
-
-            return jsonify(f"File {file.file_name} deleted!"), 201
-        else:
-            self.logger.error(f"File with hash {file_hash} not found!")
-            abort(
-                404,
-                "File not found!"
-            )
-
-    def delete_file_in_host(self, id_):
-        """
-        The method for deleting the actual file in the storage
-
-        Argument:
-            id_ -- The id of the file
-        """
-
-        delete_id = str(id_)
-        dir_path = op.join(DATA_DIR, delete_id)
-
-        if op.isdir(dir_path):
-            shutil.rmtree(dir_path)
-            self.logger.warning(f"File in {dir_path} deleted!")
-
-    def extract_meta(self, upfile):
-        """
-        This will extract the metadata information of the given file
-
-        Argument:
-            upfile -- The file object
-        """
-        with tempfile.TemporaryDirectory() as tmp:
-            file_name = upfile.filename
-
-            temp_file = op.join(tmp, file_name)
-            upfile.save(temp_file)
-
-            file_size = op.getsize(temp_file)
-            file_type = self.extract_file_type(temp_file)
-            file_md5 = self.hash_file(temp_file, algorithm="md5")
-            file_sha1 = self.hash_file(temp_file)
-
-            return {
-                "file_size": file_size,
-                "file_name": file_name,
-                "file_sha1": file_sha1,
-                "file_md5": file_md5,
-                "file_type": file_type
-            }
-
-    def extract_file_type(self, file):
-        """
-        Method for extracting the file type of the given file
-
-        Argument:
-            file -- The file object
-        """
-        try:
-            return f.from_file(file)
-        except MagicException:
-            self.logger.error(f"File type for {file.file_name} not found!")
-            return "unknown/unknown"
-
-    def hash_file(self, file, algorithm='sha1'):
-        """
-        Computes the hash of the given file.
-
-        Argument:
-            algorithm -- sha1(default) or md5
-        """
-
-        block_size = 65536
-        if algorithm == 'sha1':
-            hasher = hashlib.sha1()
-        else:
-            hasher = hashlib.md5()
-
-        with open(file, 'rb') as hash_file:
-            buf = hash_file.read(block_size)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = hash_file.read(block_size)
-
-        return hasher.hexdigest()
-
-
-fileupload = FileUpload()
-
-
-def load_index():
-    """
-    Abstract function to call the method of the
-    fileupload object load_index()
-    """
-
-    return fileupload.load_index()
-
-
-def upload_file(upfile):
-    """
-    Abstract function to call the method of the
-    fileupload object upload_file()
-    """
-
-    return fileupload.upload_file(upfile)
-
-
-def read_files():
-    """
-    Abstract function to call the method of the
-    fileupload object read_files()
-    """
-
-    return fileupload.read_files()
-
-
-def read_file(file_hash):
-    """
-    Abstract function to call the method of the
-    fileupload object read_file()
-    """
-
-    return fileupload.read_file(file_hash)
-
-
-def update_file(file_hash, file):
-    """
-    Abstract function to call the method of the
-    fileupload object update_file()
-    """
-
-    return fileupload.update_file(file_hash, file)
-
-
-def delete_file(file_hash):
-    """
-    Abstract function to call the method of the
-    fileupload object delete_file()
-    """
-
-    return fileupload.delete_file(file_hash)
-
-
-
-
-
-
-
-
-
+"""
+The module that the flask/connexion will lookout for to perform the functionalities for the request methods
+of the API server.
+"""
+
+import base64
+import binascii
+import json
+import os.path as op
+import os
+from urllib.parse import quote, urlencode
+import re
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import and_, any_, bindparam, select, text, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from magic import Magic, MagicException
+from flask import abort, jsonify, request, Response, stream_with_context
+from werkzeug.wsgi import wrap_file
+from sqlalchemy.exc import DataError, IntegrityError
+from fileupload.models import FileMetadata, FileMetadataSchema, FileBlob, Job, JobSchema, SEARCH_NAME, db
+from fileupload.storage import create_storage
+from fileupload.cache import create_cache
+from fileupload.jobs import create_queue
+from fileupload.batch import BatchIngest, InvalidBatch, MAX_FILES, WORKERS
+from fileupload import compression, hashing, ingest, serialize
+from fileupload.ingest import BLOCK_SIZE
+from fileupload.sessions import UploadSessions, SessionNotFound, InvalidChunk, IncompleteSession, ChunkConflict, \
+    CHUNK_SIZE, SESSION_TTL
+import logging.config
+import logging
+import yaml
+from app import MOD_PATH, YAML_LOADER
+from app.pool import MeteredQueuePool
+from app import admission, logs, metrics
+from marshmallow.exceptions import ValidationError
+
+ROOT_DIR = os.environ['ROOT_DIR']
+LOG_DIR = os.environ['LOG_DIR']
+DATA_DIR = os.environ['DATA_DIR']
+STAGING_DIR = op.join(DATA_DIR, ".staging")
+SESSIONS_DIR = op.join(DATA_DIR, ".sessions")
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX')
+HASH_COLUMNS = {32: FileMetadata.md5, 40: FileMetadata.sha1}
+HEX_DIGEST = re.compile(r"^[0-9a-fA-F]+$")
+PAGE_SIZE = 100
+SORT_KEYS = {
+    "id": FileMetadata.id,
+    "size": FileMetadata.size,
+    "file_name": FileMetadata.file_name,
+}
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', SESSION_TTL))
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', MAX_FILES))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', WORKERS))
+BULK_INSERT_SIZE = 1000
+LOOKUP_MAX_HASHES = int(os.environ.get('LOOKUP_MAX_HASHES', 100000))
+LOOKUP_CHUNK_SIZE = 5000
+SEARCH_MIN_SUBSTRING = 3
+LIKE_SPECIAL = re.compile(r"([\\%_])")
+# The statements of the search ranks and their compiled forms, a few shapes reused by every search
+SEARCH_STATEMENTS = {}
+SEARCH_COMPILED = {}
+ANALYZE_FILES = os.environ.get('ANALYZE_FILES', '1') == '1'
+ANALYZE_BYTES = 1048576
+
+
+class FileUpload:
+
+    def __init__(self):
+        """
+        The file upload service functions encapsulated in a class.
+        Nothing is opened here: the logging and the libmagic handles are set up on their first use
+        in every process, so that none of them is shared by the processes forked after the import.
+        """
+
+        self.sessions = UploadSessions(SESSIONS_DIR, UPLOAD_SESSION_TTL)
+        self.storage = create_storage(DATA_DIR)
+        self.cache = create_cache(os.environ)
+        self.jobs = create_queue(os.environ)
+        self.analyze = ANALYZE_FILES
+        self.compression = compression.check(compression.CODEC)
+        self.substring_index = None
+        self.magics = {}
+        self.magics_pid = None
+        self.logging_pid = None
+        self.logging_lock = threading.Lock()
+
+        metrics.register_stats(metrics.METADATA_CACHE, self.cache.stats)
+        metrics.register_stats(metrics.DB_POOL, self.pool_stats)
+        metrics.register_stats(metrics.ADMISSION, admission.ADMISSION.stats)
+
+    @property
+    def logger(self):
+        """
+        The logger of the service, the logging of the process is set up on its first use
+        """
+
+        self.init_logging()
+        return logging.getLogger("fileupload")
+
+    def init_logging(self):
+        """
+        Sets up the logging once in every process, so that the log files and the listener of the logging
+        queue belong to the process writing them, even when it was forked after the import.
+        """
+
+        if self.logging_pid != os.getpid():
+            with self.logging_lock:
+                if self.logging_pid != os.getpid():
+                    self.setup_logging()
+                    self.logging_pid = os.getpid()
+
+    def libmagic(self, **flags):
+        """
+        Argument:
+            flags -- The flags of the Magic object, such as mime=True
+
+        return -- The libmagic handle of the current process with these flags, opened on first use
+        """
+
+        if self.magics_pid != os.getpid():
+            self.magics = {}
+            self.magics_pid = os.getpid()
+
+        key = tuple(sorted(flags.items()))
+
+        if key not in self.magics:
+            self.magics[key] = Magic(**flags)
+
+        return self.magics[key]
+
+    @staticmethod
+    def setup_logging(default_path='logging.yml', default_level=logging.INFO):
+        """
+        A method to setup the logging configurations, called by init_logging on the first use of the
+        logging in every process.
+
+        Arguments:
+            default_path -- The yaml logging specification file
+            default_level -- The default level for the logging configuration
+        """
+        path = op.join(MOD_PATH, default_path)
+        handlers = [("info_file_handler", "info.log"),
+                    ("error_file_handler", "error.log"),
+                    ("debug_file_handler", "debug.log"),
+                    ("critical_file_handler", "critical.log"),
+                    ("warn_file_handler", "warn.log")]
+
+        # The records still queued are written to the handlers of the previous configuration
+        logs.stop_queue()
+
+        if op.exists(path):
+            if not op.exists(LOG_DIR):
+                os.mkdir(LOG_DIR)
+            with open(path, 'rt') as file:
+                try:
+                    config = logs.configure(yaml.load(file.read(), Loader=YAML_LOADER))
+                    for handler, fname in handlers:
+                        config['handlers'][handler]['filename'] = logs.file_name(LOG_DIR, fname)
+                    logging.config.dictConfig(config)
+                except Exception:
+                    logging.basicConfig(level=default_level)
+        else:
+            logging.basicConfig(level=default_level)
+            logging.warning('Failed to load configuration file. Using default configs')
+
+        logs.start_queue()
+
+    def load_index(self):
+        """
+        A method that will return a string object for a basic request method
+
+        response -- API server description
+        """
+
+        return "File Upload service by Reagan Balongcas, GRID Trainee"
+
+    def read_stats(self):
+        """
+        A GET request method for the counters of the worker process that serves the request
+
+        response:
+            200 - The counters of the metadata cache, of the database connection pool and of the upload admission
+        """
+
+        return jsonify({
+            "metadata_cache": self.cache.stats(),
+            "db_pool": self.pool_stats(),
+            "admission": admission.ADMISSION.stats(),
+        }), 200
+
+    @staticmethod
+    def pool_stats():
+        """
+        return -- The counters of the database connection pool of the worker process
+        """
+
+        pool = db.engine.pool
+
+        return pool.stats() if isinstance(pool, MeteredQueuePool) else {}
+
+    def read_metrics(self):
+        """
+        A GET request method for the Prometheus metrics of every worker process of the server
+
+        response:
+            200 - The request counts and latencies by operation, the ingested bytes,
+                  the duration of the upload stages and the pool and cache counters
+        """
+
+        metrics.export_stats(force=True)
+        data, content_type = metrics.latest()
+
+        return Response(data, content_type=content_type)
+
+    def upload_file(self, upfile, sha1=None, md5=None, size=None):
+        """
+        The method for a POST request to upload a file.
+        It will extract the metadata of the file argument and add
+        those information in the database.
+
+        Arguments:
+            upfile - The file object sent to the server
+            sha1 -- The sha1 hash claimed by the client, verified while streaming
+            md5 -- The md5 hash claimed by the client, verified while streaming
+            size -- The size claimed by the client, the stream is abandoned as soon as it exceeds it
+
+        responses:
+            201 -- The uploaded file metadata information
+            403 -- Invalid metadata
+            422 -- The content does not match the claimed size or hashes
+        """
+
+        self.logger.info("Filetype: %s", type(upfile))
+
+        # The request body was received and parsed into upfile before the view was called
+        metrics.observe_stage("receive", time.perf_counter() - metrics.request_started())
+
+        try:
+            metadata, staging_path = self.extract_meta(upfile, dict(file_sha1=sha1, file_md5=md5, file_size=size))
+        except ingest.ContentMismatch as e:
+            self.logger.error("Content mismatch! %s: %s", upfile.filename, e)
+            return abort(422, "The content does not match the claimed size or hashes!")
+
+        metrics.INGESTED_BYTES.labels("upload_file").inc(metadata['file_size'])
+
+        return self.create_file(metadata, staging_path)
+
+    def check_file(self, claim):
+        """
+        A POST request method for the pre-upload handshake. The client sends the hashes and the size
+        it is about to upload, and skips the upload when the content is already stored.
+
+        Argument:
+            claim -- The sha1 and/or md5 hash and optionally the size of the content
+
+        responses:
+            200 -- Whether the content exists, with the metadata of its earliest file
+            403 -- No valid hash provided
+        """
+
+        file_hash = claim.get('sha1') or claim.get('md5')
+
+        if not file_hash or self.hash_filter(file_hash) is None:
+            self.logger.error("Invalid pre-upload check! %s", claim)
+            return abort(403, "A valid sha1 or md5 hash is required!")
+
+        data = self.lookup(file_hash)
+
+        try:
+            if data:
+                ingest.verify(
+                    dict(file_size=data['size'], file_sha1=data['sha1'], file_md5=data['md5']),
+                    dict(file_size=claim.get('size'), file_sha1=claim.get('sha1'), file_md5=claim.get('md5'))
+                )
+        except ingest.ContentMismatch:
+            data = None
+
+        if data:
+            return jsonify({"exists": True, "file": data}), 200
+
+        return jsonify({"exists": False}), 200
+
+    def create_file(self, metadata, staging_path):
+        """
+        Adds the metadata of an ingested file in the database and moves its staging file
+        to the storage. A content that is already stored is only referenced once more,
+        its staging file is then discarded.
+
+        Arguments:
+            metadata -- The metadata extracted from the file
+            staging_path -- The staging file of the file
+
+        responses:
+            201 -- The uploaded file metadata information
+            403 -- Invalid metadata
+        """
+
+        try:
+            for attempt in range(2):
+                try:
+                    committed = time.perf_counter()
+                    new_file = FileMetadata(
+                        size=metadata['file_size'],
+                        file_name=metadata['file_name'],
+                        sha1=metadata['file_sha1'],
+                        md5=metadata['file_md5'],
+                        type=metadata['file_type'],
+                        tree_hash=metadata.get('file_tree_hash'),
+                        tree_chunk_size=metadata.get('tree_chunk_size'),
+                        chunk_hashes=metadata.get('file_chunk_hashes'),
+                    )
+                    db.session.add(new_file)
+                    references = self.reference_blob(new_file.sha1)
+                    db.session.commit()
+                    metrics.observe_stage("commit", time.perf_counter() - committed)
+                    break
+                except IntegrityError:
+                    db.session.rollback()
+
+                    # Another request added the same content first, its blob row is referenced on retry
+                    if attempt:
+                        raise
+
+            data = serialize.dump_file(new_file)
+
+            with metrics.stage("store"):
+                stored = self.save_to_host(new_file.sha1, staging_path, new_file.type, new_file.size)
+                data['stored_size'], data['compression'] = stored
+                self.record_storage({new_file.sha1: stored}, [new_file.id])
+
+            # A lookup between the two commits may have cached the first file of a new content without its stored size
+            if references == 1:
+                self.cache.invalidate(data['md5'], data['sha1'])
+
+            self.logger.info("File uploaded! %s", logs.Fields(data))
+
+            return jsonify(data), 201
+        except (DataError, IntegrityError):
+            db.session.rollback()
+            db.session.commit()
+
+            self.logger.error("Invalid metadata! %s", logs.Fields(metadata))
+            return abort(403, "Invalid metadata!")
+        finally:
+            ingest.discard(staging_path)
+
+    def upload_batch(self, upfiles=None, archive=None):
+        """
+        The method for a POST request to upload many files at once, either as many upfiles parts
+        or as one tar or zip archive. Every file gets its own result, a file that cannot be read
+        does not fail the others.
+
+        Arguments:
+            upfiles -- The first of the file objects, every upfiles part is read from the request
+            archive -- A tar, tar.gz, tar.bz2, tar.xz or zip archive of the files
+
+        responses:
+            201 -- The result of every file: created, duplicate (content already stored) or error
+            403 -- Invalid archive, too many files or invalid metadata
+        """
+
+        batch = BatchIngest(self.staging_dir(), BATCH_WORKERS, BATCH_MAX_FILES)
+
+        try:
+            if archive is not None:
+                items = batch.ingest_archive(archive.stream)
+            else:
+                items = batch.ingest_files(request.files.getlist('upfiles'))
+        except InvalidBatch as e:
+            self.logger.error("Invalid batch! %s", e)
+            return abort(403, str(e))
+
+        try:
+            for item in items:
+                if "metadata" in item:
+                    item["metadata"]["file_type"] = self.extract_file_type(item.pop("header"))
+                    metrics.INGESTED_BYTES.labels("upload_batch").inc(item["metadata"]["file_size"])
+
+            return jsonify(self.create_files(items)), 201
+        finally:
+            batch.discard(items)
+
+    def create_files(self, items):
+        """
+        Adds the metadata of the ingested files of a batch in a single transaction, with bulk inserts
+        of BULK_INSERT_SIZE rows and one upsert of the references of every distinct content.
+        The distinct new contents are then moved to the storage concurrently.
+
+        Argument:
+            items -- The ingested files of the batch
+
+        return -- The result of every file, in the order of the batch
+        """
+
+        stored = [item for item in items if "metadata" in item]
+        rows = [
+            dict(
+                size=item['metadata']['file_size'],
+                file_name=item['metadata']['file_name'],
+                sha1=item['metadata']['file_sha1'],
+                md5=item['metadata']['file_md5'],
+                type=item['metadata']['file_type'],
+                tree_hash=item['metadata'].get('file_tree_hash'),
+                tree_chunk_size=item['metadata'].get('tree_chunk_size'),
+                chunk_hashes=item['metadata'].get('file_chunk_hashes'),
+            )
+            for item in stored
+        ]
+
+        table = FileMetadata.__table__
+        file_ids = []
+
+        try:
+            for start in range(0, len(rows), BULK_INSERT_SIZE):
+                inserted = db.session.execute(
+                    table.insert().values(rows[start:start + BULK_INSERT_SIZE]).returning(table.c.id)
+                )
+                file_ids.extend(row.id for row in inserted)
+            self.reference_blobs(Counter(row['sha1'] for row in rows))
+            db.session.commit()
+        except (DataError, IntegrityError):
+            db.session.rollback()
+
+            self.logger.error("Invalid metadata in a batch of %d files!", len(items))
+            return abort(403, "Invalid metadata!")
+
+        # Only the first file of every content is stored, the staging files of its duplicates are discarded
+        firsts = {}
+        for item, row in zip(stored, rows):
+            firsts.setdefault(row['sha1'], item)
+
+        def put(item):
+            metadata = item['metadata']
+            codec = self.compression if compression.compressible(metadata['file_type'], metadata['file_size']) else None
+            return self.storage.put(item.pop('path'), metadata['file_sha1'], codec)
+
+        with ThreadPoolExecutor(BATCH_WORKERS) as executor:
+            added = executor.map(put, firsts.values())
+            for item, was_added in zip(list(firsts.values()), added):
+                item['created'] = was_added
+            stats = dict(zip(firsts, executor.map(self.storage.stat, firsts)))
+
+        self.record_storage(stats, file_ids)
+        # The first files of the new contents may have been cached without their stored size
+        self.cache.invalidate(*[key for item in firsts.values() if item.get('created')
+                                for key in (item['metadata']['file_md5'], item['metadata']['file_sha1'])])
+
+        for item, row in zip(stored, rows):
+            stored_size, codec = stats[row['sha1']]
+            item['result'] = dict(row, stored_size=stored_size, compression=codec,
+                                  status="created" if item.get('created') else "duplicate")
+            item['result'].pop('chunk_hashes')
+
+        results = [
+            item.get('result') or {"file_name": item['file_name'], "status": "error", "error": item['error']}
+            for item in items
+        ]
+
+        counts = Counter(result['status'] for result in results)
+        self.logger.info("Batch uploaded! %d created / %d duplicate / %d error",
+                         counts['created'], counts['duplicate'], counts['error'])
+
+        return results
+
+    def enqueue_analysis(self, file_ids):
+        """
+        Adds the analysis jobs of new files in the current transaction, when ANALYZE_FILES is enabled.
+        Their content must already be stored, a worker may claim the jobs as soon as they are committed.
+
+        Argument:
+            file_ids -- The ids of the new files
+        """
+
+        if self.analyze:
+            self.jobs.enqueue(file_ids, "analyze")
+
+    def analyze_file(self, file_id):
+        """
+        The background job of the worker enriching the metadata of a new file with the libmagic
+        description and encoding of up to ANALYZE_BYTES of its content. A content that was
+        already analyzed for another file is not read again.
+
+        Argument:
+            file_id -- The id of the file, it may have been deleted since the job was queued
+        """
+
+        file = FileMetadata.query.get(file_id)
+
+        if file is None:
+            return
+
+        analyzed = FileMetadata.query.filter(
+            FileMetadata.sha1 == file.sha1, FileMetadata.analyzed_at.isnot(None)
+        ).order_by(FileMetadata.id).first()
+
+        if analyzed is not None:
+            file.description, file.encoding = analyzed.description, analyzed.encoding
+        else:
+            content = b"".join(self.storage.read(file.sha1, 0, ANALYZE_BYTES))
+            file.description = self.libmagic().from_buffer(content)
+            file.encoding = self.libmagic(mime_encoding=True).from_buffer(content)
+
+        file.analyzed_at = db.func.now()
+        db.session.flush()
+        self.invalidate(file)
+
+    @staticmethod
+    def reference_blobs(counts):
+        """
+        Adds references to many stored contents in the current transaction with a single upsert.
+        The blob rows are locked in the order of their hashes until the transaction ends.
+
+        Argument:
+            counts -- The number of references to add for every sha1 hash
+        """
+
+        if not counts:
+            return
+
+        table = FileBlob.__table__
+        statement = insert(table).values([dict(sha1=sha1, ref_count=count) for sha1, count in sorted(counts.items())])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.sha1],
+            set_=dict(ref_count=table.c.ref_count + statement.excluded.ref_count),
+        ))
+
+    @staticmethod
+    def reference_blob(sha1, count=1):
+        """
+        Adds references to a stored content in the current transaction.
+        The blob row is locked until the transaction ends.
+
+        Arguments:
+            sha1 -- The sha1 hash of the content
+            count -- The number of references to add, negative to remove references
+
+        return -- The reference count of the content after the change
+        """
+
+        blob = FileBlob.query.filter(FileBlob.sha1 == sha1).with_for_update().one_or_none()
+
+        if blob is None:
+            blob = FileBlob(sha1=sha1, ref_count=0)
+            db.session.add(blob)
+
+        blob.ref_count += count
+
+        if blob.ref_count <= 0:
+            db.session.delete(blob)
+        else:
+            db.session.flush()
+
+        return blob.ref_count
+
+    def create_session(self, session):
+        """
+        The method for a POST request to start a resumable chunked upload.
+        Abandoned sessions are garbage collected at the same time.
+
+        Argument:
+            session -- The file name, the total size and optionally the chunk size of the upload
+
+        responses:
+            201 -- The session id with the chunk layout of the upload
+            403 -- Invalid size or chunk size
+        """
+
+        try:
+            data = self.sessions.create(
+                session['file_name'],
+                session['size'],
+                session.get('chunk_size', CHUNK_SIZE),
+                session.get('sha1'),
+                session.get('md5'),
+            )
+        except InvalidChunk as e:
+            self.logger.error("Invalid upload session! %s", e)
+            return abort(403, "Invalid size or chunk size!")
+
+        self.logger.info("Upload session %s created for %s", data['session_id'], data['file_name'])
+
+        return jsonify(data), 201
+
+    def read_session(self, session_id):
+        """
+        The method for a GET request of retrieving the state of an upload session
+
+        Argument:
+            session_id -- The id of the upload session
+
+        responses:
+            200 -- The session with the offsets of the received chunks and the indexes of the missing chunks
+            404 -- Session not found
+        """
+
+        try:
+            return jsonify(self.sessions.status(session_id)), 200
+        except SessionNotFound:
+            abort(404, "Session not found!")
+
+    def upload_chunk(self, session_id, chunk_index, chunk):
+        """
+        The method for a PUT request of one chunk of an upload session.
+        Chunks can be sent in parallel and retried.
+
+        Arguments:
+            session_id -- The id of the upload session
+            chunk_index -- The index of the chunk, starting at 0
+            chunk -- The bytes of the chunk
+
+        responses:
+            201 -- The offset and the length of the written chunk
+            403 -- Invalid chunk index or length
+            404 -- Session not found
+            409 -- The chunk was already received with other bytes
+        """
+
+        try:
+            data = self.sessions.write_chunk(session_id, chunk_index, chunk or b"")
+        except InvalidChunk as e:
+            self.logger.error("Invalid chunk for session %s! %s", session_id, e)
+            return abort(403, "Invalid chunk index or length!")
+        except ChunkConflict as e:
+            self.logger.error("Conflicting chunk for session %s! %s", session_id, e)
+            return abort(409, "The chunk was already received with other bytes!")
+        except SessionNotFound:
+            abort(404, "Session not found!")
+
+        metrics.INGESTED_BYTES.labels("upload_chunk").inc(len(chunk or b""))
+
+        return jsonify(data), 201
+
+    def complete_session(self, session_id):
+        """
+        The method for a POST request to finalize an upload session.
+        The file is added exactly like a file sent to upload_file.
+
+        Argument:
+            session_id -- The id of the upload session
+
+        responses:
+            201 -- The uploaded file metadata information
+            403 -- Invalid metadata
+            404 -- Session not found
+            409 -- Some chunks are missing
+            422 -- The content does not match the claimed hashes
+        """
+
+        staging_path = op.join(self.staging_dir(), f"session-{session_id}")
+
+        try:
+            metadata, header = self.sessions.finalize(session_id, staging_path)
+        except IncompleteSession:
+            return abort(409, "Some chunks are missing!")
+        except SessionNotFound:
+            abort(404, "Session not found!")
+        except ingest.ContentMismatch as e:
+            ingest.discard(staging_path)
+            self.logger.error("Content mismatch in upload session %s! %s", session_id, e)
+            return abort(422, "The content does not match the claimed hashes!")
+
+        metadata["file_type"] = self.extract_file_type(header)
+
+        return self.create_file(metadata, staging_path)
+
+    def delete_session(self, session_id):
+        """
+        The method for a DEL request to abort an upload session and drop its chunks
+
+        Argument:
+            session_id -- The id of the upload session
+
+        responses:
+            201 -- Session deletion success
+            404 -- Session not found
+        """
+
+        try:
+            self.sessions.load(session_id)
+        except SessionNotFound:
+            abort(404, "Session not found!")
+
+        self.sessions.delete(session_id)
+        self.logger.warning("Upload session %s deleted!", session_id)
+
+        return jsonify(f"Session {session_id} deleted!"), 201
+
+    def read_files(self, limit=PAGE_SIZE, cursor=None, type=None, min_size=None, max_size=None,
+                   name_prefix=None, sort="id", format="json"):
+        """
+        The method for a GET request of retrieving the uploaded files in the database.
+        Metadata information for each file are the response to be expected.
+
+        The files are paginated with a keyset cursor, the cursor of the next page is returned in
+        the X-Next-Cursor and Link headers. With the ndjson format, every matching file is streamed
+        one per line from a server-side cursor, so the memory used stays constant.
+
+        Arguments:
+            limit -- The maximum number of files of the page
+            cursor -- The cursor returned with the previous page
+            type -- Only the files of this type
+            min_size -- Only the files of at least this size
+            max_size -- Only the files of at most this size
+            name_prefix -- Only the files whose name starts with this prefix
+            sort -- The sort key among id, size and file_name, prefixed with - for a descending order
+            format -- json for a page of files, ndjson to stream all the files
+
+        response:
+            200 - List of metadata objects
+            403 - Invalid cursor or sort key
+        """
+
+        descending = sort.startswith("-")
+        key = sort.lstrip("-")
+        column = SORT_KEYS.get(key)
+
+        if column is None:
+            return abort(403, "Invalid sort key!")
+
+        query = FileMetadata.query.with_entities(*serialize.COLUMNS)
+
+        if type is not None:
+            query = query.filter(FileMetadata.type == type)
+        if min_size is not None:
+            query = query.filter(SORT_KEYS["size"] >= min_size)
+        if max_size is not None:
+            query = query.filter(SORT_KEYS["size"] <= max_size)
+        if name_prefix:
+            query = query.filter(FileMetadata.file_name.startswith(name_prefix, autoescape=True))
+
+        if cursor:
+            try:
+                value, last_id = self.decode_cursor(cursor)
+            except ValueError:
+                return abort(403, "Invalid cursor!")
+
+            keys = tuple_(column, FileMetadata.id) if column is not FileMetadata.id else column
+            last = tuple_(value, last_id) if column is not FileMetadata.id else last_id
+            query = query.filter(keys < last if descending else keys > last)
+
+        order = [column, FileMetadata.id] if column is not FileMetadata.id else [column]
+        query = query.order_by(*[o.desc() if descending else o for o in order])
+
+        if format == "ndjson":
+            rows = query.execution_options(stream_results=True).yield_per(PAGE_SIZE)
+
+            def generate():
+                for row in rows:
+                    yield serialize.dumps(serialize.dump(row)) + b"\n"
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        files = query.limit(limit + 1).all()
+        data = [serialize.dump(row) for row in files[:limit]]
+
+        headers = {}
+        if len(files) > limit:
+            last_file = files[limit - 1]
+            value = getattr(last_file, key)
+            next_cursor = self.encode_cursor(value, last_file.id)
+            headers["X-Next-Cursor"] = next_cursor
+            headers["Link"] = f'<{request.base_url}?{urlencode(dict(request.args, cursor=next_cursor))}>; rel="next"'
+
+        return Response(serialize.dumps(data), status=200, headers=headers, mimetype="application/json")
+
+    def search_files(self, q=None, type=None, limit=PAGE_SIZE, cursor=None):
+        """
+        The method for a GET request searching the files by a fragment of their name and by their type.
+
+        The files whose name starts with the fragment come first, in the order of their names, then the files
+        whose name only contains it, the most recent first. The case of the names is ignored. A fragment of
+        less than 3 characters only matches the start of the names, and so does any fragment when the trigram
+        index of the names does not exist, so that no search scans the table.
+        The files are paginated with a keyset cursor, returned in the X-Next-Cursor and Link headers.
+
+        Arguments:
+            q -- The fragment of the file names
+            type -- Only the files of this type, or of this top-level type followed by /* such as image/*
+            limit -- The maximum number of files of the page
+            cursor -- The cursor returned with the previous page
+
+        response:
+            200 - The ranked list of metadata objects
+            403 - Neither a fragment nor a type, or an invalid cursor
+        """
+
+        if not q and not type:
+            return abort(403, "A name fragment or a type is required!")
+
+        rank, value, last_id = 0, None, None
+
+        if cursor:
+            try:
+                (rank, value), last_id = self.decode_cursor(cursor)
+            except (TypeError, ValueError):
+                return abort(403, "Invalid cursor!")
+
+            if not isinstance(rank, int):
+                return abort(403, "Invalid cursor!")
+
+        kinds, type_filter, params = self.search_ranks(q, type, self.substrings_indexed())
+        connection = db.session.connection().execution_options(compiled_cache=SEARCH_COMPILED)
+        files = []
+
+        for index, kind in enumerate(kinds):
+            if index < rank:
+                continue
+
+            statement = self.search_statement(kind, type_filter, index == rank and last_id is not None)
+            rows = connection.execute(statement, dict(params, last_value=value, last_id=last_id,
+                                                      limit=limit + 1 - len(files)))
+            files.extend((index, row) for row in rows)
+
+            if len(files) > limit:
+                break
+
+        data = [serialize.dump(row) for _, row in files[:limit]]
+
+        headers = {}
+        if len(files) > limit:
+            index, last_file = files[limit - 1]
+            value = last_file.search_name if kinds[index] == "prefix" else None
+            next_cursor = self.encode_cursor([index, value], last_file.id)
+            headers["X-Next-Cursor"] = next_cursor
+            headers["Link"] = f'<{request.base_url}?{urlencode(dict(request.args, cursor=next_cursor))}>; rel="next"'
+
+        return Response(serialize.dumps(data), status=200, headers=headers, mimetype="application/json")
+
+    def substrings_indexed(self):
+        """
+        return -- Whether the trigram index of the substring search exists, checked once by the service
+        """
+
+        if self.substring_index is None:
+            self.substring_index = db.session.execute(
+                text("SELECT 1 FROM pg_indexes WHERE schemaname = 'filemetadata' AND indexname = :name"),
+                dict(name="ix_filemetadata_search_trgm")
+            ).scalar() is not None
+
+        return self.substring_index
+
+    @staticmethod
+    def search_ranks(q, type, substrings=True):
+        """
+        Splits a search in its ranks, the prefix matches then the substring matches.
+
+        Arguments:
+            q -- The fragment of the file names, None to search by type only
+            type -- The type of the files, None to search by name only
+            substrings -- Whether the substring matches are searched, only when their trigram index exists
+
+        return -- The kinds of the ranks, the kind of the type filter and the parameters of their statements
+        """
+
+        type_filter, params = None, {}
+
+        if type and type.endswith("/*"):
+            type_filter, params["type"] = "prefix", LIKE_SPECIAL.sub(r"\\\1", type[:-1]) + "%"
+        elif type:
+            type_filter, params["type"] = "equal", type
+
+        if not q:
+            return ["type"], type_filter, params
+
+        fragment = LIKE_SPECIAL.sub(r"\\\1", q.lower())
+        params.update(prefix=fragment + "%", substring="%" + fragment + "%")
+
+        if substrings and len(q) >= SEARCH_MIN_SUBSTRING:
+            return ["prefix", "substring"], type_filter, params
+
+        return ["prefix"], type_filter, params
+
+    @staticmethod
+    def search_statement(kind, type_filter, after):
+        """
+        Builds the statement of a rank of the searches once, with bound parameters only, so that the engine
+        compiles it once in SEARCH_COMPILED instead of on every search.
+
+        Arguments:
+            kind -- type for the files of a type by id descending, prefix for the prefix matches by name and id,
+                    substring for the other matches by id descending
+            type_filter -- equal for a type, prefix for a top-level type, None for any type
+            after -- Whether the rank starts after the file of a cursor
+
+        return -- The select statement, with the type, prefix, substring, last_value, last_id and limit parameters
+        """
+
+        key = (kind, type_filter, after)
+
+        if key not in SEARCH_STATEMENTS:
+            statement = select(serialize.COLUMNS + [SEARCH_NAME.label("search_name")])
+
+            if type_filter == "prefix":
+                statement = statement.where(FileMetadata.type.like(bindparam("type")))
+            elif type_filter == "equal":
+                statement = statement.where(FileMetadata.type == bindparam("type"))
+
+            prefix = SEARCH_NAME.like(bindparam("prefix"))
+            if kind == "prefix":
+                statement = statement.where(prefix)
+            elif kind == "substring":
+                statement = statement.where(and_(SEARCH_NAME.like(bindparam("substring")), ~prefix))
+
+            # The keys of every rank are in the same order as their index
+            if kind == "prefix":
+                if after:
+                    last = tuple_(bindparam("last_value"), bindparam("last_id"))
+                    statement = statement.where(tuple_(SEARCH_NAME, FileMetadata.id) > last)
+                statement = statement.order_by(SEARCH_NAME, FileMetadata.id)
+            else:
+                if after:
+                    statement = statement.where(FileMetadata.id < bindparam("last_id"))
+                statement = statement.order_by(FileMetadata.id.desc())
+
+            SEARCH_STATEMENTS[key] = statement.limit(bindparam("limit"))
+
+        return SEARCH_STATEMENTS[key]
+
+    @staticmethod
+    def encode_cursor(value, id_):
+        """
+        return -- The opaque cursor pointing after the file with the given sort value and id
+        """
+        return base64.urlsafe_b64encode(json.dumps([value, id_]).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        return -- The sort value and the id of the file pointed by a cursor
+        """
+        try:
+            value, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, binascii.Error, UnicodeDecodeError):
+            raise ValueError(cursor)
+
+        if not isinstance(id_, int):
+            raise ValueError(cursor)
+
+        return value, id_
+
+    @staticmethod
+    def hash_filter(file_hash):
+        """
+        Builds the lookup of a hash on the one column matching its length,
+        32 hex characters for md5 and 40 for sha1, so the query uses a single index.
+
+        Argument:
+            file_hash -- Hash string format in md5 or sha1
+
+        return -- The filter clause or None if the string is not a valid hash
+        """
+        column = HASH_COLUMNS.get(len(file_hash))
+
+        if column is None or not HEX_DIGEST.match(file_hash):
+            return None
+
+        return column == file_hash.lower()
+
+    def find_file(self, file_hash):
+        """
+        Retrieves the file with the given hash. When several files share the same content,
+        the earliest uploaded one is returned.
+
+        Argument:
+            file_hash -- Hash string format in md5 or sha1
+
+        return -- The FileMetadata object or None
+        """
+        clause = self.hash_filter(file_hash)
+
+        if clause is None:
+            return None
+
+        return FileMetadata.query.filter(clause).order_by(FileMetadata.id).first()
+
+    def lookup(self, file_hash):
+        """
+        Retrieves the metadata of the file with the given hash through the metadata cache.
+        Misses are not cached, so a new upload is visible at once.
+
+        Argument:
+            file_hash -- Hash string format in md5 or sha1
+
+        return -- The serialized metadata without the id or None
+        """
+        if self.hash_filter(file_hash) is None:
+            return None
+
+        def load():
+            row = FileMetadata.query.with_entities(*serialize.COLUMNS) \
+                .filter(self.hash_filter(file_hash)) \
+                .order_by(FileMetadata.id) \
+                .first()
+
+            return serialize.dump(row) if row else None
+
+        return self.cache.get(file_hash.lower(), load)
+
+    def lookup_files(self, lookup):
+        """
+        A POST request method for resolving many hashes at once. The hashes are grouped by type and
+        resolved with one query per LOOKUP_CHUNK_SIZE hashes, each binding its hashes as a single
+        array, so the query plan does not depend on the number of hashes.
+
+        Argument:
+            lookup -- The md5 and sha1 hashes to resolve
+
+        responses:
+            200 -- The metadata of every found hash, the missing hashes and the invalid hashes
+            403 -- More than LOOKUP_MAX_HASHES hashes
+        """
+        hashes = lookup['hashes']
+
+        if len(hashes) > LOOKUP_MAX_HASHES:
+            self.logger.error("Too many hashes to lookup! %d", len(hashes))
+            return abort(403, f"More than {LOOKUP_MAX_HASHES} hashes!")
+
+        keys = {length: set() for length in HASH_COLUMNS}
+        valid, invalid = [], []
+
+        for file_hash in hashes:
+            if len(file_hash) in HASH_COLUMNS and HEX_DIGEST.match(file_hash):
+                valid.append(file_hash)
+                keys[len(file_hash)].add(file_hash.lower())
+            else:
+                invalid.append(file_hash)
+
+        resolved = {}
+
+        for length, column in HASH_COLUMNS.items():
+            chunks = sorted(keys[length])
+
+            for start in range(0, len(chunks), LOOKUP_CHUNK_SIZE):
+                chunk = bindparam('hashes', chunks[start:start + LOOKUP_CHUNK_SIZE], type_=ARRAY(column.type))
+
+                # The earliest uploaded file of every hash, as for the single hash lookup
+                rows = FileMetadata.query.with_entities(*serialize.COLUMNS) \
+                    .filter(column == any_(chunk)) \
+                    .distinct(column) \
+                    .order_by(column, FileMetadata.id)
+
+                for row in rows:
+                    data = serialize.dump(row)
+                    resolved[data[column.key]] = data
+
+        found = {file_hash: resolved[file_hash.lower()] for file_hash in valid if file_hash.lower() in resolved}
+        missing = [file_hash for file_hash in valid if file_hash.lower() not in resolved]
+
+        self.logger.info("Lookup of %d hashes! %d found / %d missing / %d invalid",
+                         len(hashes), len(found), len(missing), len(invalid))
+
+        body = serialize.dumps({"found": found, "missing": missing, "invalid": invalid})
+
+        return Response(body, status=200, mimetype="application/json")
+
+    def invalidate(self, file):
+        """
+        Removes the cached metadata of a file under both of its hashes.
+
+        Argument:
+            file -- The FileMetadata object
+        """
+
+        self.cache.invalidate(file.md5, file.sha1)
+
+    def read_file(self, file_hash):
+        """
+        Another method for a GET request but for retrieving a single file only
+
+        Argument:
+            file_hash -- Hash string format in md5 or sha1
+
+        response:
+            200 - The metadata object for the file with given hash
+        """
+        data = self.lookup(file_hash)
+
+        if data:
+            return jsonify(data), 200
+        else:
+            abort(
+                404,
+                "File not found!"
+            )
+
+    def read_jobs(self, file_hash):
+        """
+        A GET request method for the background jobs of the files with the given hash
+
+        Argument:
+            file_hash -- Hash string format in md5 or sha1
+
+        response:
+            200 - The jobs of the files, in the order they were queued
+            404 - File not found
+        """
+        clause = self.hash_filter(file_hash)
+
+        if clause is None or self.lookup(file_hash) is None:
+            abort(
+                404,
+                "File not found!"
+            )
+
+        jobs = Job.query.join(FileMetadata, Job.file_id == FileMetadata.id).filter(clause).order_by(Job.id)
+
+        return jsonify(JobSchema(many=True).dump(jobs)), 200
+
+    def read_chunks(self, file_hash):
+        """
+        A GET request method for the tree hash of a file, the BLAKE2b digest of every chunk of its content,
+        so that the chunks of a download can be verified in parallel and on their own.
+
+        Argument:
+            file_hash -- Hash string format in md5 or sha1
+
+        response:
+            200 - The chunk size, the digest of every chunk and the root digest over them
+            404 - File or tree hash not found
+        """
+        file = self.find_file(file_hash)
+
+        if file is None or file.tree_hash is None:
+            abort(
+                404,
+                "Tree hash not found!"
+            )
+
+        chunk_hashes = file.chunk_hashes
+        size = hashing.TREE_DIGEST_SIZE
+
+        return jsonify({
+            "algorithm": f"blake2b-{8 * size}",
+            "chunk_size": file.tree_chunk_size,
+            "tree_hash": file.tree_hash,
+            "chunks": [chunk_hashes[start:start + size].hex() for start in range(0, len(chunk_hashes), size)],
+        }), 200
+
+    def read_file_content(self, file_hash):
+        """
+        A GET request method for downloading the content of a file.
+        The sha1 hash is used as a strong ETag, and single byte ranges are supported
+        for segmented downloads and resumes.
+
+        Local files are sent with sendfile by the WSGI server, or handed over to a fronting
+        nginx with X-Accel-Redirect when ACCEL_REDIRECT_PREFIX is set.
+
+        Argument:
+            file_hash -- Hash string format in md5 or sha1
+
+        responses:
+            200 -- The content of the file
+            206 -- The requested byte range of the file
+            304 -- The content matches the If-None-Match ETag
+            404 -- File not found, or its content is not stored
+            416 -- The requested range is not satisfiable
+        """
+        file = self.lookup(file_hash)
+
+        if not file:
+            abort(404, "File not found!")
+
+        size = int(file["size"])
+        headers = {
+            "ETag": f'"{file["sha1"]}"',
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file['file_name'])}",
+        }
+
+        if request.if_none_match.contains(file["sha1"]):
+            return Response(status=304, headers=headers)
+
+        # A missing content is reported before the headers are sent, not in the middle of the body
+        if self.storage.stat(file["sha1"]) is None:
+            self.logger.error("Content of file %s not stored!", file["sha1"])
+            abort(404, "File content not found!")
+
+        local_path = self.storage.local_path(file["sha1"])
+
+        if ACCEL_REDIRECT_PREFIX and local_path:
+            headers["X-Accel-Redirect"] = ACCEL_REDIRECT_PREFIX + op.relpath(local_path, DATA_DIR)
+            return Response(status=200, headers=headers, mimetype=file["type"])
+
+        start, length, status = 0, size, 200
+        if_range = request.headers.get("If-Range")
+
+        if request.range and len(request.range.ranges) == 1 and if_range in (None, headers["ETag"]):
+            byte_range = request.range.range_for_length(size)
+
+            if byte_range is None:
+                headers["Content-Range"] = f"bytes */{size}"
+                return Response(status=416, headers=headers)
+
+            start, length, status = byte_range[0], byte_range[1] - byte_range[0], 206
+            headers["Content-Range"] = f"bytes {start}-{start + length - 1}/{size}"
+
+        headers["Content-Length"] = str(length)
+
+        # WSGI servers stop a file wrapper at the Content-Length, without one only the whole file is wrapped
+        if local_path and (status == 200 or "wsgi.file_wrapper" in request.environ):
+            try:
+                content = open(local_path, "rb")
+            except FileNotFoundError:
+                # The last reference to the content was deleted since it was checked
+                abort(404, "File content not found!")
+
+            content.seek(start)
+            body = wrap_file(request.environ, content, BLOCK_SIZE)
+        else:
+            body = self.storage.read(file["sha1"], start, length)
+
+        return Response(body, status=status, headers=headers, mimetype=file["type"], direct_passthrough=True)
+
+    def update_file(self, file_hash, file):
+        """
+        A PUT request dedicated method. It accepts both the hash for a file and the object containing
+        the information to be updated
+
+        Argument:
+            file_hash -- The hash for a specific file uploaded in the server
+            file -- The metadata objects to be updated (file type or filename)
+
+        responses:
+            201 - The metadata for the file with the updated fields
+            403 - Invalid schema or properties provided
+            404 - File not found
+        """
+
+        update_file = self.find_file(file_hash)
+
+        if update_file:
+            if len(file) <= 2 and ('file_name' in file or 'type' in file):
+                try:
+                    schema = FileMetadataSchema()
+                    update = schema.load(file, session=db.session, instance=update_file)
+
+                    update.id = update_file.id
+                    db.session.merge(update)
+                    db.session.commit()
+                    self.invalidate(update)
+                    data = serialize.dump_file(update)
+
+                    self.logger.info("File updated! %s", logs.Fields(data))
+
+                    return jsonify(data), 201
+                except ValidationError:
+                    self.logger.error("Invalid schema provided!")
+                    return abort(
+                        403,
+                        "Invalid schema provided!"
+                    )
+            else:
+                self.logger.error("Invalid properties provided!")
+                return abort(
+                    403,
+                    "Invalid properties provided!"
+                )
+        else:
+            self.logger.error("File with hash %s not found!", file_hash)
+            abort(
+                404,
+                f"File with {file_hash} not found!"
+            )
+
+    def save_to_host(self, sha1, staging_path, file_type=None, size=None):
+        """
+        This method will move the staged file of the request to the storage backend,
+        compressed when STORAGE_COMPRESSION is set and the type of the file is worth it.
+
+        Arguments:
+            sha1 -- The sha1 hash of the uploaded file
+            staging_path -- The staging file written by extract_meta
+            file_type -- The mime type of the uploaded file
+            size -- The size of the uploaded file
+
+        return -- The stored size and the compression of the content
+        """
+        codec = self.compression if compression.compressible(file_type, size) else None
+
+        if self.storage.put(staging_path, sha1, codec):
+            self.logger.info("File saved in %s", self.storage.location(sha1))
+        else:
+            self.logger.info("File already stored in %s", self.storage.location(sha1))
+
+        return self.storage.stat(sha1)
+
+    def record_storage(self, stored, file_ids=()):
+        """
+        This method records the stored size and the compression of contents on their files
+        that do not have them yet, and queues the analysis of the new files in the same transaction.
+
+        Arguments:
+            stored -- The stored size and the compression of every sha1 hash
+            file_ids -- The ids of the new files, whose contents are now stored
+        """
+        if stored:
+            table = FileMetadata.__table__
+            db.session.execute(
+                table.update()
+                .where(table.c.sha1 == bindparam('b_sha1'))
+                .where(table.c.stored_size.is_(None))
+                .values(stored_size=bindparam('b_stored_size'), compression=bindparam('b_compression')),
+                [{'b_sha1': sha1, 'b_stored_size': size, 'b_compression': codec}
+                 for sha1, (size, codec) in stored.items()]
+            )
+
+        self.enqueue_analysis(list(file_ids))
+        db.session.commit()
+
+    def delete_file(self, file_hash):
+        """
+        The method dedicated for the DEL request. It will delete the file metadata in the database
+        and the file object in the storage based from the given hash, when it was the last
+        reference to its content.
+
+        Argument:
+            file_hash -- md5 or sha1 hash of a specific file
+
+        responses:
+            201 - File deletion success
+            404 - File not found
+        """
+        file = self.find_file(file_hash)
+
+        if file:
+            db.session.delete(file)
+
+            # The blob is removed while its row is still locked, so that a concurrent upload
+            # of the same content waits for the commit and stores the content again
+            if self.reference_blob(file.sha1, -1) <= 0:
+                self.delete_file_in_host(file.sha1)
+
+            db.session.commit()
+            self.invalidate(file)
+
+            self.logger.warning("File %s deleted!", file.file_name)
+
+            return jsonify(f"File {file.file_name} deleted!"), 201
+        else:
+            self.logger.error("File with hash %s not found!", file_hash)
+            abort(
+                404,
+                "File not found!"
+            )
+
+    def delete_file_in_host(self, sha1):
+        """
+        The method for deleting the actual file in the storage,
+        once no file references its content anymore
+
+        Argument:
+            sha1 -- The sha1 hash of the file
+        """
+
+        if self.storage.delete(sha1):
+            self.logger.warning("File in %s deleted!", self.storage.location(sha1))
+
+    def extract_meta(self, upfile, claimed=None):
+        """
+        This will extract the metadata information of the given file.
+        The file is read only once, its content is hashed, counted, sniffed and
+        written to a staging file in a single pass.
+
+        Arguments:
+            upfile -- The file object
+            claimed -- The file_size, file_sha1 and file_md5 claimed by the client
+
+        return -- The metadata of the file and the path of its staging file
+        """
+        with metrics.stage("hash"), ingest.StreamIngest(self.staging_dir(), claimed=claimed) as stream:
+            stream.consume(upfile.stream)
+            metadata = stream.finish()
+
+        metadata["file_name"] = upfile.filename
+
+        with metrics.stage("sniff"):
+            metadata["file_type"] = self.extract_file_type(bytes(stream.header))
+
+        return metadata, stream.path
+
+    @staticmethod
+    def staging_dir():
+        """
+        The directory of the staging files, located under DATA_DIR so that the files
+        can be atomically renamed to their final location.
+
+        return -- The staging directory or None if DATA_DIR does not exist
+        """
+        if op.exists(DATA_DIR):
+            os.makedirs(STAGING_DIR, exist_ok=True)
+            return STAGING_DIR
+
+        return None
+
+    def extract_file_type(self, header):
+        """
+        Method for extracting the file type from the leading bytes of a file
+
+        Argument:
+            header -- The leading bytes of the file
+        """
+        try:
+            return self.libmagic(mime=True).from_buffer(header)
+        except MagicException:
+            self.logger.error("File type not found!")
+            return "unknown/unknown"
+
+    def hash_file(self, file, algorithm='sha1'):
+        """
+        Computes the hash of the given file, memory-mapped by the parallel hashing engine.
+
+        Argument:
+            algorithm -- sha1(default) or md5
+        """
+
+        return hashing.hash_path(file, (algorithm,))[algorithm]
+
+
+fileupload = FileUpload()
+
+
+def load_index():
+    """
+    Abstract function to call the method of the
+    fileupload object load_index()
+    """
+
+    return fileupload.load_index()
+
+
+def read_stats():
+    """
+    Abstract function to call the method of the
+    fileupload object read_stats()
+    """
+
+    return fileupload.read_stats()
+
+
+def read_metrics():
+    """
+    Abstract function to call the method of the
+    fileupload object read_metrics()
+    """
+
+    return fileupload.read_metrics()
+
+
+def upload_file(upfile, sha1=None, md5=None, size=None):
+    """
+    Abstract function to call the method of the
+    fileupload object upload_file()
+    """
+
+    return fileupload.upload_file(upfile, sha1, md5, size)
+
+
+def check_file(claim):
+    """
+    Abstract function to call the method of the
+    fileupload object check_file()
+    """
+
+    return fileupload.check_file(claim)
+
+
+def upload_batch(upfiles=None, archive=None):
+    """
+    Abstract function to call the method of the
+    fileupload object upload_batch()
+    """
+
+    return fileupload.upload_batch(upfiles, archive)
+
+
+def create_session(session):
+    """
+    Abstract function to call the method of the
+    fileupload object create_session()
+    """
+
+    return fileupload.create_session(session)
+
+
+def read_session(session_id):
+    """
+    Abstract function to call the method of the
+    fileupload object read_session()
+    """
+
+    return fileupload.read_session(session_id)
+
+
+def upload_chunk(session_id, chunk_index, chunk):
+    """
+    Abstract function to call the method of the
+    fileupload object upload_chunk()
+    """
+
+    return fileupload.upload_chunk(session_id, chunk_index, chunk)
+
+
+def complete_session(session_id):
+    """
+    Abstract function to call the method of the
+    fileupload object complete_session()
+    """
+
+    return fileupload.complete_session(session_id)
+
+
+def delete_session(session_id):
+    """
+    Abstract function to call the method of the
+    fileupload object delete_session()
+    """
+
+    return fileupload.delete_session(session_id)
+
+
+def read_files(**kwargs):
+    """
+    Abstract function to call the method of the
+    fileupload object read_files()
+    """
+
+    return fileupload.read_files(**kwargs)
+
+
+def search_files(**kwargs):
+    """
+    Abstract function to call the method of the
+    fileupload object search_files()
+    """
+
+    return fileupload.search_files(**kwargs)
+
+
+def lookup_files(lookup):
+    """
+    Abstract function to call the method of the
+    fileupload object lookup_files()
+    """
+
+    return fileupload.lookup_files(lookup)
+
+
+def read_file(file_hash):
+    """
+    Abstract function to call the method of the
+    fileupload object read_file()
+    """
+
+    return fileupload.read_file(file_hash)
+
+
+def read_jobs(file_hash):
+    """
+    Abstract function to call the method of the
+    fileupload object read_jobs()
+    """
+
+    return fileupload.read_jobs(file_hash)
+
+
+def read_chunks(file_hash):
+    """
+    Abstract function to call the method of the
+    fileupload object read_chunks()
+    """
+
+    return fileupload.read_chunks(file_hash)
+
+
+def read_file_content(file_hash):
+    """
+    Abstract function to call the method of the
+    fileupload object read_file_content()
+    """
+
+    return fileupload.read_file_content(file_hash)
+
+
+def update_file(file_hash, file):
+    """
+    Abstract function to call the method of the
+    fileupload object update_file()
+    """
+
+    return fileupload.update_file(file_hash, file)
+
+
+def delete_file(file_hash):
+    """
+    Abstract function to call the method of the
+    fileupload object delete_file()
+    """
+
+    return fileupload.delete_file(file_hash)
+
+
+
+
+
+
+
+
+
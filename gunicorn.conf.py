@@ -0,0 +1,51 @@
+"""
+The gunicorn settings of the API server, loaded from the working directory.
+
+The application is preloaded by the master, which imports it once, and the workers are forked from it
+ready to serve. It opens nothing at import, the libmagic handles, the log files and the database connections
+are opened by every worker on first use. The engines the master may still have created are closed before
+every fork, and every worker starts with pools of its own.
+The metrics of an exited worker stop counting in the live gauges of GET /metrics.
+"""
+
+import os
+import shutil
+import sys
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def engines():
+    """
+    return -- The SQLAlchemy engines created in this process, none is created here
+    """
+
+    config = sys.modules.get("app.config")
+
+    return list(config.db.engines) if config is not None else []
+
+
+def on_starting(server):
+    # The samples of a previous run of the server would be added to the new ones
+    metrics_dir = os.environ.get("prometheus_multiproc_dir")
+
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+
+
+def pre_fork(server, worker):
+    for engine in engines():
+        engine.dispose()
+
+
+def post_fork(server, worker):
+    for engine in engines():
+        engine.pool = engine.pool.recreate()
+        server.log.info(f"Worker {worker.pid} uses a new connection pool")
+
+
+def child_exit(server, worker):
+    from app.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
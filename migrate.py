@@ -1,30 +1,130 @@
-"""
-The script to be executed to apply DB migrations.
-
-Examples:
-
-$ python migrate.py db migrate
--- Make migrations
-
-$ python migrate.py db upgrade
--- Apply migrations
-
-"""
-
-from flask_migrate import MigrateCommand, Migrate
-from flask_script import Manager
-from app import create_app, create_db
-from app.config import db
-from fileupload.models import FileMetadata
-
-
-app_db = create_app().app
-
-create_db()
-
-migrate = Migrate(app_db, db)
-manager = Manager(app_db)
-manager.add_command('db', MigrateCommand)
-
-if __name__ == "__main__":
-    manager.run()
+"""
+The script to be executed to apply DB migrations.
+
+Examples:
+
+$ python migrate.py db migrate
+-- Make migrations
+
+$ python migrate.py db upgrade
+-- Apply migrations
+
+$ python migrate.py relayout
+-- Move the files of the DATA_DIR/<id>/<file_name> layout to the content-addressed blob store
+
+$ python migrate.py scrub --verify --max-rate 50 --checkpoint scrub.json
+-- Report the inconsistencies between the storage and the database, reading every content again
+
+$ python migrate.py scrub --repair --checkpoint scrub.json --resume
+-- Resume an interrupted scrub and repair the inconsistencies
+
+$ python migrate.py compact --min-garbage 0.2
+-- Reclaim the space of the deleted contents of the packed store
+
+"""
+
+import json
+import os
+import os.path as op
+from flask_migrate import MigrateCommand, Migrate
+from flask_script import Manager
+from sqlalchemy import func
+from app import create_db, DATA_DIR
+from app.config import db, create_service
+from fileupload.cache import create_cache
+from fileupload.models import FileMetadata, FileBlob
+from fileupload.packs import MIN_GARBAGE
+from fileupload.scrub import Scrubber, WORKERS, GRACE_PERIOD
+from fileupload.storage import LocalStorage, create_storage
+
+
+app_db = create_service(api=None).app
+
+create_db()
+
+migrate = Migrate(app_db, db)
+manager = Manager(app_db)
+manager.add_command('db', MigrateCommand)
+
+
+@manager.command
+def relayout():
+    """
+    Moves the files stored under DATA_DIR/<id>/<file_name> to the content-addressed
+    blob store and rebuilds the reference count of every content.
+    """
+
+    with app_db.app_context():
+        blobs = LocalStorage(op.join(DATA_DIR, "blobs"))
+
+        for file in FileMetadata.query.yield_per(1000):
+            dir_path = op.join(DATA_DIR, str(file.id))
+            file_path = op.join(dir_path, file.file_name)
+
+            if op.isfile(file_path):
+                blobs.put(file_path, file.sha1)
+                os.rmdir(dir_path)
+                print(f"Moved {file_path} to {blobs.path(file.sha1)}")
+
+        FileBlob.query.delete()
+        db.session.execute(
+            FileBlob.__table__.insert().from_select(
+                ["sha1", "ref_count"],
+                db.session.query(FileMetadata.sha1, func.count()).group_by(FileMetadata.sha1)
+            )
+        )
+        db.session.commit()
+
+
+@manager.option("--verify", action="store_true", help="Read every content again to verify its sha1, md5 and size")
+@manager.option("--repair", action="store_true", help="Repair the inconsistencies instead of only reporting them")
+@manager.option("--workers", type=int, default=WORKERS, help="The number of verification threads")
+@manager.option("--max-rate", type=float, default=None, help="The maximum verification rate in MiB/s")
+@manager.option("--grace-period", type=float, default=GRACE_PERIOD,
+                help="The seconds an inconsistency must hold before it is reported")
+@manager.option("--checkpoint", default=None, help="The file the progress is saved to")
+@manager.option("--resume", action="store_true", help="Resume from the checkpoint file")
+def scrub(verify=False, repair=False, workers=WORKERS, max_rate=None, grace_period=GRACE_PERIOD,
+          checkpoint=None, resume=False):
+    """
+    Walks the stored contents and the metadata in the order of their hashes and reports,
+    or repairs, the files without content, the contents without file, the wrong reference
+    counts and the corrupt contents. The findings are printed as JSON lines.
+    """
+
+    with app_db.app_context():
+        scrubber = Scrubber(
+            create_storage(DATA_DIR),
+            verify=verify,
+            repair=repair,
+            workers=workers,
+            max_rate=max_rate and max_rate * 1048576,
+            grace_period=grace_period,
+            checkpoint=checkpoint,
+            cache=create_cache(os.environ),
+        )
+        counts = scrubber.run(resume=resume)
+
+    print(json.dumps(dict(counts, summary=True)))
+
+
+@manager.option("--min-garbage", type=float, default=MIN_GARBAGE,
+                help="The garbage ratio from which a segment is compacted, 0 compacts every sealed segment")
+def compact(min_garbage=MIN_GARBAGE):
+    """
+    Copies the live contents of the segments of the packed store with too much garbage to the active
+    segment and removes them. The counts of the compaction and of the store are printed as JSON.
+    """
+
+    storage = create_storage(DATA_DIR)
+
+    if not hasattr(storage, "compact"):
+        print("The storage has no packed store, set PACK_MAX_FILE_SIZE")
+        return
+
+    counts = storage.compact(min_garbage)
+    print(json.dumps(dict(compaction=counts, store=storage.stats())))
+
+
+if __name__ == "__main__":
+    manager.run()
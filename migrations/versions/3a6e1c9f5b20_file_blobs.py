@@ -0,0 +1,42 @@
+"""file blobs: shared contents with their reference counts
+
+Revision ID: 3a6e1c9f5b20
+Revises: 789935b9e320
+Create Date: 2026-10-18 09:47:26.318452
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a6e1c9f5b20'
+down_revision = '789935b9e320'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_constraint('filemetadata_sha1_key', 'filemetadata', type_='unique', schema='filemetadata')
+    op.drop_constraint('filemetadata_md5_key', 'filemetadata', type_='unique', schema='filemetadata')
+    op.create_index(op.f('ix_filemetadata_filemetadata_md5'), 'filemetadata', ['md5'], unique=False, schema='filemetadata')
+    op.create_index(op.f('ix_filemetadata_filemetadata_sha1'), 'filemetadata', ['sha1'], unique=False, schema='filemetadata')
+    op.create_table('fileblob',
+    sa.Column('sha1', sa.String(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('sha1'),
+    schema='filemetadata'
+    )
+    # Every stored file was the only reference to its content
+    op.execute(
+        "INSERT INTO filemetadata.fileblob (sha1, ref_count) "
+        "SELECT sha1, count(*) FROM filemetadata.filemetadata WHERE sha1 IS NOT NULL GROUP BY sha1"
+    )
+
+
+def downgrade():
+    op.drop_table('fileblob', schema='filemetadata')
+    op.drop_index(op.f('ix_filemetadata_filemetadata_sha1'), table_name='filemetadata', schema='filemetadata')
+    op.drop_index(op.f('ix_filemetadata_filemetadata_md5'), table_name='filemetadata', schema='filemetadata')
+    op.create_unique_constraint('filemetadata_md5_key', 'filemetadata', ['md5'], schema='filemetadata')
+    op.create_unique_constraint('filemetadata_sha1_key', 'filemetadata', ['sha1'], schema='filemetadata')
@@ -0,0 +1,51 @@
+"""file jobs: job queue table and analysis columns
+
+Revision ID: 4b7d2e91a6c3
+Revises: c08a9e86870a
+Create Date: 2026-10-18 20:31:05.418260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7d2e91a6c3'
+down_revision = 'c08a9e86870a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('filemetadata', sa.Column('description', sa.String(), nullable=True), schema='filemetadata')
+    op.add_column('filemetadata', sa.Column('encoding', sa.String(), nullable=True), schema='filemetadata')
+    op.add_column('filemetadata', sa.Column('analyzed_at', sa.DateTime(timezone=True), nullable=True),
+                  schema='filemetadata')
+    op.create_table('job',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), server_default='queued', nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('locked_by', sa.String(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['file_id'], ['filemetadata.filemetadata.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    schema='filemetadata'
+    )
+    op.create_index(op.f('ix_filemetadata_job_file_id'), 'job', ['file_id'], unique=False, schema='filemetadata')
+    op.create_index('ix_job_ready', 'job', ['status', 'run_at'], unique=False, schema='filemetadata')
+
+
+def downgrade():
+    op.drop_index('ix_job_ready', table_name='job', schema='filemetadata')
+    op.drop_index(op.f('ix_filemetadata_job_file_id'), table_name='job', schema='filemetadata')
+    op.drop_table('job', schema='filemetadata')
+    op.drop_column('filemetadata', 'analyzed_at', schema='filemetadata')
+    op.drop_column('filemetadata', 'encoding', schema='filemetadata')
+    op.drop_column('filemetadata', 'description', schema='filemetadata')
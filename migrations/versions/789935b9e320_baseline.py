@@ -0,0 +1,35 @@
+"""baseline: filemetadata table
+
+Revision ID: 789935b9e320
+Revises: 
+Create Date: 2026-10-18 09:12:41.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '789935b9e320'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('filemetadata',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('size', sa.String(), nullable=True),
+    sa.Column('file_name', sa.String(), nullable=True),
+    sa.Column('sha1', sa.String(), nullable=True),
+    sa.Column('md5', sa.String(), nullable=True),
+    sa.Column('type', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('md5', name='filemetadata_md5_key'),
+    sa.UniqueConstraint('sha1', name='filemetadata_sha1_key'),
+    schema='filemetadata'
+    )
+
+
+def downgrade():
+    op.drop_table('filemetadata', schema='filemetadata')
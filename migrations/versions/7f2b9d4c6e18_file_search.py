@@ -0,0 +1,45 @@
+"""file search: indexes of the name and type search
+
+Revision ID: 7f2b9d4c6e18
+Revises: d41c7a2b8e05
+Create Date: 2026-10-18 23:05:41.226350
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+# revision identifiers, used by Alembic.
+revision = '7f2b9d4c6e18'
+down_revision = 'd41c7a2b8e05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_filemetadata_type_id', 'filemetadata', ['type', 'id'], unique=False, schema='filemetadata',
+                    postgresql_ops={'type': 'text_pattern_ops'})
+    op.execute('CREATE INDEX ix_filemetadata_search_name ON filemetadata.filemetadata '
+               '((lower(file_name) COLLATE "C"), id)')
+
+    # The trigram index of the substring search needs pg_trgm, from the contrib modules of PostgreSQL.
+    # Without it the search only matches the prefixes of the names, it never scans the table.
+    bind = op.get_bind()
+    available = bind.execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar()
+
+    if available:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_filemetadata_search_trgm ON filemetadata.filemetadata '
+                   'USING gin ((lower(file_name) COLLATE "C") gin_trgm_ops)')
+    else:
+        logger.warning("pg_trgm is not available, the file search only matches the prefixes of the names")
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS filemetadata.ix_filemetadata_search_trgm')
+    op.drop_index('ix_filemetadata_search_name', table_name='filemetadata', schema='filemetadata')
+    op.drop_index('ix_filemetadata_type_id', table_name='filemetadata', schema='filemetadata')
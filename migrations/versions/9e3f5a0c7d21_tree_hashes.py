@@ -0,0 +1,30 @@
+"""tree hashes: root digest, chunk size and chunk digests of the files
+
+Revision ID: 9e3f5a0c7d21
+Revises: 4b7d2e91a6c3
+Create Date: 2026-10-18 21:02:47.903114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3f5a0c7d21'
+down_revision = '4b7d2e91a6c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('filemetadata', sa.Column('tree_hash', postgresql.BYTEA(length=32), nullable=True),
+                  schema='filemetadata')
+    op.add_column('filemetadata', sa.Column('tree_chunk_size', sa.Integer(), nullable=True), schema='filemetadata')
+    op.add_column('filemetadata', sa.Column('chunk_hashes', sa.LargeBinary(), nullable=True), schema='filemetadata')
+
+
+def downgrade():
+    op.drop_column('filemetadata', 'chunk_hashes', schema='filemetadata')
+    op.drop_column('filemetadata', 'tree_chunk_size', schema='filemetadata')
+    op.drop_column('filemetadata', 'tree_hash', schema='filemetadata')
@@ -0,0 +1,39 @@
+"""typed hash columns: binary md5/sha1 and bigint size
+
+Revision ID: c08a9e86870a
+Revises: 3a6e1c9f5b20
+Create Date: 2026-10-18 10:03:17.582930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c08a9e86870a'
+down_revision = '3a6e1c9f5b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column('filemetadata', 'size', type_=sa.BigInteger(),
+                    postgresql_using='size::bigint', schema='filemetadata')
+    op.alter_column('filemetadata', 'sha1', type_=postgresql.BYTEA(),
+                    postgresql_using="decode(sha1, 'hex')", schema='filemetadata')
+    op.alter_column('filemetadata', 'md5', type_=postgresql.BYTEA(),
+                    postgresql_using="decode(md5, 'hex')", schema='filemetadata')
+    op.alter_column('fileblob', 'sha1', type_=postgresql.BYTEA(),
+                    postgresql_using="decode(sha1, 'hex')", schema='filemetadata')
+
+
+def downgrade():
+    op.alter_column('fileblob', 'sha1', type_=sa.String(),
+                    postgresql_using="encode(sha1, 'hex')", schema='filemetadata')
+    op.alter_column('filemetadata', 'md5', type_=sa.String(),
+                    postgresql_using="encode(md5, 'hex')", schema='filemetadata')
+    op.alter_column('filemetadata', 'sha1', type_=sa.String(),
+                    postgresql_using="encode(sha1, 'hex')", schema='filemetadata')
+    op.alter_column('filemetadata', 'size', type_=sa.String(),
+                    postgresql_using='size::text', schema='filemetadata')
@@ -0,0 +1,26 @@
+"""stored size: size and compression of the stored contents
+
+Revision ID: d41c7a2b8e05
+Revises: 9e3f5a0c7d21
+Create Date: 2026-10-18 21:48:12.530671
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7a2b8e05'
+down_revision = '9e3f5a0c7d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('filemetadata', sa.Column('stored_size', sa.BigInteger(), nullable=True), schema='filemetadata')
+    op.add_column('filemetadata', sa.Column('compression', sa.String(), nullable=True), schema='filemetadata')
+
+
+def downgrade():
+    op.drop_column('filemetadata', 'compression', schema='filemetadata')
+    op.drop_column('filemetadata', 'stored_size', schema='filemetadata')
@@ -1,12 +1,12 @@
-#!/bin/bash
-
-export DB_PORT="5432"
-export DB_TYPE="postgresql"
-export DB_USER="postgres"
-export DB_HOST="10.0.2.2"
-export DB_PASSWORD="nopassword"
-export DB_NAME="fileservice_db"
-
-export ROOT_DIR=/home/rbalongcas/TrendProjects
-export LOG_DIR=$ROOTDIR/logs
-export DATA_DIR=$ROOT_DIR/data/
+#!/bin/bash
+
+export DB_PORT="5432"
+export DB_TYPE="postgresql"
+export DB_USER="postgres"
+export DB_HOST="10.0.2.2"
+export DB_PASSWORD="nopassword"
+export DB_NAME="fileservice_db"
+
+export ROOT_DIR=/home/rbalongcas/TrendProjects
+export LOG_DIR=$ROOTDIR/logs
+export DATA_DIR=$ROOT_DIR/data/
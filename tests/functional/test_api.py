@@ -1,93 +1,568 @@
-"""
-The testing functions to be executed sequentially to perform integration testing of the API server request methods
-"""
-
-import io
-import hashlib
-import json
-
-
-# file_content = b"testingtesting"
-# file_content = b"testingtesting1"
-# file_content = b"testingtesting2"
-# file_content = b"testingtesting3"
-# file_content = b"testingtesting4"
-# FILE_CONTENT = b"testingtesting5"
-# FILE_CONTENT = b"testingtesting6"
-# FILE_CONTENT = b"testingtesting7"
-FILE_CONTENT = b"testingtesting8"
-FILE_HASH = hashlib.md5(FILE_CONTENT).hexdigest()
-
-
-def test_home_page(test_client):
-    """
-    Testing the home page
-    """
-    response = test_client.get('/')
-    assert response.status_code == 200
-
-
-def test_upload(test_client):
-    """
-    Testing the POST request method
-    """
-    data = {
-        "upfile": (io.BytesIO(FILE_CONTENT), 'testing.jpg')
-    }
-
-    response = test_client.post(
-        '/service/fileupload',
-        data=data
-    )
-
-    print(response)
-
-    assert response.status_code == 201
-
-
-def test_get_files(test_client):
-    """
-    Testing the GET request method, for sequence type response
-    """
-
-    response = test_client.get('/service/fileupload')
-    assert response.status_code == 200
-
-
-def test_get_file(test_client):
-    """
-    Testing the GET request method, for single object type response
-    """
-
-    response = test_client.get(f'/service/fileupload/{FILE_HASH}')
-    assert response.status_code == 200
-
-
-def test_update(test_client):
-    """
-    Testing the PUT request method
-    """
-
-    file = {
-            "file_name": "new_file",
-            "type": "unknown/unknown"
-    }
-
-    response = test_client.put(
-        f'/service/fileupload/{FILE_HASH}',
-        data=json.dumps(file),
-        headers={'content-type' : 'application/json'}
-    )
-
-    assert response.status_code == 201
-
-
-def test_delete(test_client):
-    """
-    Testing the DEL request method
-    """
-    response = test_client.delete(
-        f'/service/fileupload/{FILE_HASH}',
-    )
-
-    assert response.status_code == 201
+"""
+The testing functions to be executed sequentially to perform integration testing of the API server request methods
+"""
+
+import io
+import hashlib
+import json
+import tarfile
+import zipfile
+
+from werkzeug.test import EnvironBuilder
+
+from app import admission
+from fileupload import hashing, views
+
+
+# file_content = b"testingtesting"
+# file_content = b"testingtesting1"
+# file_content = b"testingtesting2"
+# file_content = b"testingtesting3"
+# file_content = b"testingtesting4"
+# FILE_CONTENT = b"testingtesting5"
+# FILE_CONTENT = b"testingtesting6"
+# FILE_CONTENT = b"testingtesting7"
+FILE_CONTENT = b"testingtesting8"
+FILE_HASH = hashlib.md5(FILE_CONTENT).hexdigest()
+
+
+def test_home_page(test_client):
+    """
+    Testing the home page
+    """
+    response = test_client.get('/')
+    assert response.status_code == 200
+
+
+def test_upload(test_client):
+    """
+    Testing the POST request method
+    """
+    data = {
+        "upfile": (io.BytesIO(FILE_CONTENT), 'testing.jpg')
+    }
+
+    response = test_client.post(
+        '/service/fileupload',
+        data=data
+    )
+
+    print(response)
+
+    assert response.status_code == 201
+
+
+def test_upload_duplicate(test_client):
+    """
+    Testing that the same content uploaded under another name is accepted and stored once
+    """
+    data = {
+        "upfile": (io.BytesIO(FILE_CONTENT), 'copy.jpg')
+    }
+
+    response = test_client.post(
+        '/service/fileupload',
+        data=data
+    )
+
+    assert response.status_code == 201
+    assert response.get_json()["file_name"] == 'copy.jpg'
+
+
+def test_metrics(test_client):
+    """
+    Testing that the uploads are counted and their stages timed
+    """
+    response = test_client.get('/metrics')
+    text = response.data.decode()
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert 'fileupload_requests_total{method="POST",operation="upload_file",status="201"}' in text
+    assert f'fileupload_ingested_bytes_total{{operation="upload_file"}} {float(2 * len(FILE_CONTENT))}' in text
+    for stage in ("receive", "hash", "sniff", "commit", "store"):
+        assert f'fileupload_upload_stage_seconds_count{{stage="{stage}"}} 2.0' in text
+    assert 'fileupload_db_pool{counter="checkouts"}' in text
+
+
+def test_get_files(test_client):
+    """
+    Testing the GET request method, for sequence type response
+    """
+
+    response = test_client.get('/service/fileupload')
+    assert response.status_code == 200
+
+
+def test_get_files_pages(test_client):
+    """
+    Testing the GET request method, page by page with a cursor, filtered and streamed
+    """
+
+    response = test_client.get('/service/fileupload?limit=1&sort=-id')
+    assert response.status_code == 200
+    assert [f["file_name"] for f in response.get_json()] == ['copy.jpg']
+
+    response = test_client.get(f'/service/fileupload?limit=1&sort=-id&cursor={response.headers["X-Next-Cursor"]}')
+    assert [f["file_name"] for f in response.get_json()] == ['testing.jpg']
+
+    response = test_client.get(f'/service/fileupload?name_prefix=copy&min_size={len(FILE_CONTENT)}')
+    assert [f["file_name"] for f in response.get_json()] == ['copy.jpg']
+    assert 'X-Next-Cursor' not in response.headers
+
+    response = test_client.get('/service/fileupload?format=ndjson&sort=size')
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(response.data.splitlines()) == len(test_client.get('/service/fileupload').get_json())
+
+
+def test_get_file(test_client):
+    """
+    Testing the GET request method, for single object type response
+    """
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}')
+    assert response.status_code == 200
+
+    hits = json.loads(test_client.get('/service/stats').data)['metadata_cache']['hits']
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH.upper()}')
+    assert response.status_code == 200
+    assert json.loads(test_client.get('/service/stats').data)['metadata_cache']['hits'] == hits + 1
+
+
+def test_get_file_content(test_client):
+    """
+    Testing the GET request method for the file content, with ranges and ETags
+    """
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}/content')
+    assert response.status_code == 200
+    assert response.data == FILE_CONTENT
+
+    etag = response.headers['ETag']
+    assert etag == f'"{hashlib.sha1(FILE_CONTENT).hexdigest()}"'
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}/content', headers={'Range': 'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.data == FILE_CONTENT[2:6]
+    assert response.headers['Content-Range'] == f'bytes 2-5/{len(FILE_CONTENT)}'
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}/content', headers={'Range': 'bytes=100-'})
+    assert response.status_code == 416
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}/content', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+MISSING_CONTENT = b"missingtesting"
+MISSING_HASH = hashlib.sha1(MISSING_CONTENT).hexdigest()
+
+
+def test_get_missing_content(test_client, monkeypatch):
+    """
+    Testing that the content of a file that is no longer stored is not found, instead of failing
+    """
+    response = test_client.post('/service/fileupload', data={"upfile": (io.BytesIO(MISSING_CONTENT), 'missing.jpg')})
+    assert response.status_code == 201
+
+    assert views.fileupload.storage.delete(MISSING_HASH)
+
+    response = test_client.get(f'/service/fileupload/{MISSING_HASH}/content')
+    assert response.status_code == 404
+
+    monkeypatch.setattr(views, "ACCEL_REDIRECT_PREFIX", "/protected/")
+    response = test_client.get(f'/service/fileupload/{MISSING_HASH}/content')
+    assert response.status_code == 404
+    assert "X-Accel-Redirect" not in response.headers
+
+    response = test_client.delete(f'/service/fileupload/{MISSING_HASH}')
+    assert response.status_code == 201
+
+
+def test_update(test_client):
+    """
+    Testing the PUT request method
+    """
+
+    file = {
+            "file_name": "new_file",
+            "type": "unknown/unknown"
+    }
+
+    response = test_client.put(
+        f'/service/fileupload/{FILE_HASH}',
+        data=json.dumps(file),
+        headers={'content-type' : 'application/json'}
+    )
+
+    assert response.status_code == 201
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}')
+    assert json.loads(response.data)['file_name'] == "new_file"
+
+
+def test_delete(test_client):
+    """
+    Testing the DEL request method
+    """
+    response = test_client.delete(
+        f'/service/fileupload/{FILE_HASH}',
+    )
+
+    assert response.status_code == 201
+
+
+def test_delete_last_reference(test_client):
+    """
+    Testing that the content stays available until its last file is deleted
+    """
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}')
+    assert response.status_code == 200
+    assert response.get_json()["file_name"] == 'copy.jpg'
+
+    response = test_client.delete(f'/service/fileupload/{FILE_HASH}')
+    assert response.status_code == 201
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}')
+    assert response.status_code == 404
+
+
+SESSION_CONTENT = b"chunkedtesting" * 3
+SESSION_HASH = hashlib.sha1(SESSION_CONTENT).hexdigest()
+CHUNK_SIZE = 16
+
+
+def test_upload_session(test_client):
+    """
+    Testing the chunked upload session, with chunks sent out of order and retried
+    """
+
+    response = test_client.post(
+        '/service/fileupload/sessions',
+        data=json.dumps({"file_name": "chunked.txt", "size": len(SESSION_CONTENT), "chunk_size": CHUNK_SIZE}),
+        headers={'content-type': 'application/json'}
+    )
+    assert response.status_code == 201
+
+    session = response.get_json()
+    assert session["chunk_count"] == 3
+
+    for index in [2, 0, 0]:
+        response = test_client.put(
+            f'/service/fileupload/sessions/{session["session_id"]}/chunks/{index}',
+            data=SESSION_CONTENT[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE],
+            headers={'content-type': 'application/octet-stream'}
+        )
+        assert response.status_code == 201
+
+    response = test_client.get(f'/service/fileupload/sessions/{session["session_id"]}')
+    assert response.get_json()["received"] == [0, 2 * CHUNK_SIZE]
+    assert response.get_json()["missing"] == [1]
+
+    response = test_client.post(f'/service/fileupload/sessions/{session["session_id"]}/complete')
+    assert response.status_code == 409
+
+    response = test_client.put(
+        f'/service/fileupload/sessions/{session["session_id"]}/chunks/0',
+        data=SESSION_CONTENT[CHUNK_SIZE:2 * CHUNK_SIZE],
+        headers={'content-type': 'application/octet-stream'}
+    )
+    assert response.status_code == 409
+
+    response = test_client.put(
+        f'/service/fileupload/sessions/{session["session_id"]}/chunks/1',
+        data=SESSION_CONTENT[CHUNK_SIZE:2 * CHUNK_SIZE],
+        headers={'content-type': 'application/octet-stream'}
+    )
+    assert response.status_code == 201
+
+    response = test_client.post(f'/service/fileupload/sessions/{session["session_id"]}/complete')
+    assert response.status_code == 201
+    assert response.get_json()["sha1"] == SESSION_HASH
+    assert response.get_json()["size"] == len(SESSION_CONTENT)
+
+    response = test_client.delete(f'/service/fileupload/{SESSION_HASH}')
+    assert response.status_code == 201
+
+
+def test_read_chunks(test_client, monkeypatch):
+    """
+    Testing the tree hash of a file uploaded with a session, out of order so that it is hashed at the finalization
+    """
+    monkeypatch.setattr(hashing, "INGEST_TREE_CHUNK_SIZE", CHUNK_SIZE)
+
+    response = test_client.post(
+        '/service/fileupload/sessions',
+        data=json.dumps({"file_name": "tree.txt", "size": len(SESSION_CONTENT), "chunk_size": CHUNK_SIZE}),
+        headers={'content-type': 'application/json'}
+    )
+    session = response.get_json()
+
+    for index in [2, 1, 0]:
+        test_client.put(
+            f'/service/fileupload/sessions/{session["session_id"]}/chunks/{index}',
+            data=SESSION_CONTENT[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE],
+            headers={'content-type': 'application/octet-stream'}
+        )
+
+    response = test_client.post(f'/service/fileupload/sessions/{session["session_id"]}/complete')
+    assert response.status_code == 201
+
+    chunks = [
+        hashlib.blake2b(SESSION_CONTENT[start:start + CHUNK_SIZE], digest_size=32).digest()
+        for start in range(0, len(SESSION_CONTENT), CHUNK_SIZE)
+    ]
+
+    response = test_client.get(f'/service/fileupload/{SESSION_HASH}/chunks')
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "algorithm": "blake2b-256",
+        "chunk_size": CHUNK_SIZE,
+        "chunks": [chunk.hex() for chunk in chunks],
+        "tree_hash": hashlib.blake2b(b"".join(chunks), digest_size=32).hexdigest(),
+    }
+
+    response = test_client.delete(f'/service/fileupload/{SESSION_HASH}')
+    assert response.status_code == 201
+
+    response = test_client.get(f'/service/fileupload/{FILE_HASH}/chunks')
+    assert response.status_code == 404
+
+
+COMPRESSED_CONTENT = b"timestamp,level,message\n" + b"2019-10-01T00:00:00,INFO,testing\n" * 4096
+COMPRESSED_HASH = hashlib.sha1(COMPRESSED_CONTENT).hexdigest()
+
+
+def test_compressed_storage(test_client, monkeypatch):
+    """
+    Testing that a text file is stored compressed and read back decompressed, by ranges too
+    """
+    monkeypatch.setattr(views.fileupload, "compression", "gzip")
+
+    data = {
+        "upfile": (io.BytesIO(COMPRESSED_CONTENT), 'testing.csv')
+    }
+    response = test_client.post('/service/fileupload', data=data)
+    assert response.status_code == 201
+
+    metadata = response.get_json()
+    assert metadata["size"] == len(COMPRESSED_CONTENT)
+    assert metadata["compression"] == "gzip"
+    assert metadata["stored_size"] < len(COMPRESSED_CONTENT) // 10
+
+    response = test_client.get(f'/service/fileupload/{COMPRESSED_HASH}')
+    assert response.get_json()["stored_size"] == metadata["stored_size"]
+
+    response = test_client.get(f'/service/fileupload/{COMPRESSED_HASH}/content')
+    assert response.status_code == 200
+    assert response.data == COMPRESSED_CONTENT
+
+    response = test_client.get(f'/service/fileupload/{COMPRESSED_HASH}/content', headers={'Range': 'bytes=24-50'})
+    assert response.status_code == 206
+    assert response.data == COMPRESSED_CONTENT[24:51]
+
+    response = test_client.delete(f'/service/fileupload/{COMPRESSED_HASH}')
+    assert response.status_code == 201
+    assert not views.fileupload.storage.exists(COMPRESSED_HASH)
+
+
+BATCH_CONTENTS = [b"batchtesting1", b"batchtesting1", b"batchtesting2"]
+
+
+def test_upload_batch(test_client):
+    """
+    Testing the batch upload of many parts, a duplicate inside the batch is stored once
+    """
+    data = {
+        "upfiles": [(io.BytesIO(content), f'batch{index}.txt') for index, content in enumerate(BATCH_CONTENTS)]
+    }
+
+    response = test_client.post('/service/fileupload/batch', data=data)
+    assert response.status_code == 201
+
+    results = response.get_json()
+    assert [result["status"] for result in results] == ["created", "duplicate", "created"]
+    assert [result["file_name"] for result in results] == ["batch0.txt", "batch1.txt", "batch2.txt"]
+
+    for content in BATCH_CONTENTS:
+        response = test_client.delete(f'/service/fileupload/{hashlib.sha1(content).hexdigest()}')
+        assert response.status_code == 201
+
+
+def test_upload_batch_archive(test_client):
+    """
+    Testing the batch upload of tar and zip archives expanded on the fly
+    """
+    tar_buf = io.BytesIO()
+    with tarfile.open(fileobj=tar_buf, mode="w:gz") as archive:
+        for index, content in enumerate(BATCH_CONTENTS):
+            info = tarfile.TarInfo(f"dir/batch{index}.txt")
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+    zip_buf = io.BytesIO()
+    with zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for index, content in enumerate(BATCH_CONTENTS):
+            archive.writestr(f"dir/batch{index}.txt", content)
+
+    for buf in [tar_buf, zip_buf]:
+        buf.seek(0)
+        response = test_client.post('/service/fileupload/batch', data={"archive": (buf, 'batch.archive')})
+        assert response.status_code == 201
+
+        results = response.get_json()
+        assert [result["file_name"] for result in results] == ["dir/batch0.txt", "dir/batch1.txt", "dir/batch2.txt"]
+        assert [result["sha1"] for result in results] == [hashlib.sha1(c).hexdigest() for c in BATCH_CONTENTS]
+
+        for content in BATCH_CONTENTS:
+            test_client.delete(f'/service/fileupload/{hashlib.sha1(content).hexdigest()}')
+
+    response = test_client.post('/service/fileupload/batch', data={"archive": (io.BytesIO(b"testing"), 'batch.tar')})
+    assert response.status_code == 403
+
+
+def test_lookup(test_client):
+    """
+    Testing the lookup of many hashes at once
+    """
+    data = {
+        "upfile": (io.BytesIO(FILE_CONTENT), 'lookup.jpg')
+    }
+    test_client.post('/service/fileupload', data=data)
+
+    sha1 = hashlib.sha1(FILE_CONTENT).hexdigest()
+    hashes = [FILE_HASH.upper(), sha1, "f" * 40, "testing"]
+
+    response = test_client.post(
+        '/service/fileupload/lookup',
+        data=json.dumps({"hashes": hashes}),
+        headers={'content-type': 'application/json'}
+    )
+    assert response.status_code == 200
+
+    result = response.get_json()
+    assert sorted(result["found"]) == sorted([FILE_HASH.upper(), sha1])
+    assert result["found"][sha1]["file_name"] == 'lookup.jpg'
+    assert result["missing"] == ["f" * 40]
+    assert result["invalid"] == ["testing"]
+
+    response = test_client.delete(f'/service/fileupload/{sha1}')
+    assert response.status_code == 201
+
+
+def test_check_before_upload(test_client):
+    """
+    Testing the pre-upload handshake and the verification of the claimed hashes
+    """
+    sha1 = hashlib.sha1(FILE_CONTENT).hexdigest()
+
+    def check():
+        response = test_client.post(
+            '/service/fileupload/check',
+            data=json.dumps({"sha1": sha1, "size": len(FILE_CONTENT)}),
+            headers={'content-type': 'application/json'}
+        )
+        assert response.status_code == 200
+        return response.get_json()["exists"]
+
+    assert not check()
+
+    response = test_client.post(
+        f'/service/fileupload?sha1={hashlib.sha1(b"testing").hexdigest()}',
+        data={"upfile": (io.BytesIO(FILE_CONTENT), 'claimed.jpg')}
+    )
+    assert response.status_code == 422
+    assert not check()
+
+    response = test_client.post(
+        f'/service/fileupload?sha1={sha1}&size={len(FILE_CONTENT)}',
+        data={"upfile": (io.BytesIO(FILE_CONTENT), 'claimed.jpg')}
+    )
+    assert response.status_code == 201
+    assert check()
+
+    response = test_client.delete(f'/service/fileupload/{sha1}')
+    assert response.status_code == 201
+
+
+def test_admission(test_client, monkeypatch):
+    """
+    Testing that the uploads over the limits are shed before their body is read, and counted
+    """
+    monkeypatch.setattr(admission.ADMISSION, "max_body_size", 10)
+
+    response = test_client.post('/service/fileupload', data={"upfile": (io.BytesIO(FILE_CONTENT), 'large.jpg')})
+    assert response.status_code == 413
+    assert response.get_json()["status"] == 413
+
+    # A chunked body announces no Content-Length
+    environ = EnvironBuilder('/service/fileupload', method='POST', input_stream=io.BytesIO(FILE_CONTENT),
+                             content_type='multipart/form-data; boundary=chunked').get_environ()
+    del environ["CONTENT_LENGTH"]
+    environ["wsgi.input_terminated"] = True
+    response = test_client.open(environ)
+    assert response.status_code == 411
+
+    monkeypatch.setattr(admission.ADMISSION, "max_body_size", 0)
+    monkeypatch.setattr(admission.ADMISSION, "max_concurrent", 1)
+    ticket = admission.ADMISSION.admit()
+
+    try:
+        response = test_client.post('/service/fileupload', data={"upfile": (io.BytesIO(FILE_CONTENT), 'busy.jpg')})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == str(admission.ADMISSION.retry_after)
+
+        assert test_client.get('/service/fileupload?limit=1').status_code == 200
+    finally:
+        admission.ADMISSION.release(ticket)
+
+    stats = test_client.get('/service/stats').get_json()["admission"]
+    assert stats["rejected_size"] >= 1
+    assert stats["rejected_worker"] >= 1
+    assert stats["running"] == 0
+
+
+SEARCH_NAMES = ["Report_2026.pdf", "report.txt", "annual-report.pdf", "reporting.csv", "100%_report.txt", "other.pdf"]
+SEARCH_CONTENTS = [(b"%PDF-1.4\n" if name.endswith(".pdf") else b"") + b"searchtesting%d" % index
+                   for index, name in enumerate(SEARCH_NAMES)]
+
+
+def test_search(test_client, monkeypatch):
+    """
+    Testing that the search ranks the prefix matches before the substring matches, by type too, page by page
+    """
+    for name, content in zip(SEARCH_NAMES, SEARCH_CONTENTS):
+        data = {"upfile": (io.BytesIO(content), name)}
+        assert test_client.post('/service/fileupload', data=data).status_code == 201
+
+    def names(**params):
+        response = test_client.get('/service/fileupload/search', query_string=params)
+        assert response.status_code == 200
+        return [file["file_name"] for file in response.get_json()], response.headers.get("X-Next-Cursor")
+
+    # Without their trigram index the substrings are not searched
+    monkeypatch.setattr(views.fileupload, "substring_index", False)
+    assert names(q="REPORT") == (["report.txt", "Report_2026.pdf", "reporting.csv"], None)
+
+    monkeypatch.setattr(views.fileupload, "substring_index", True)
+    assert names(q="REPORT") == (["report.txt", "Report_2026.pdf", "reporting.csv", "100%_report.txt",
+                                  "annual-report.pdf"], None)
+    assert names(q="re")[0] == ["report.txt", "Report_2026.pdf", "reporting.csv"]
+    assert names(q="0%_")[0] == ["100%_report.txt"]
+    assert names(q="report", type="application/pdf")[0] == ["Report_2026.pdf", "annual-report.pdf"]
+    assert names(type="application/*")[0][:3] == ["other.pdf", "annual-report.pdf", "Report_2026.pdf"]
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = names(q="report", limit=2, **({"cursor": cursor} if cursor else {}))
+        pages.append(page)
+        if cursor is None:
+            break
+    assert pages == [["report.txt", "Report_2026.pdf"], ["reporting.csv", "100%_report.txt"], ["annual-report.pdf"]]
+
+    assert test_client.get('/service/fileupload/search').status_code == 403
+    assert test_client.get('/service/fileupload/search?q=report&cursor=invalid').status_code == 403
+
+    for content in SEARCH_CONTENTS:
+        sha1 = hashlib.sha1(content).hexdigest()
+        assert test_client.delete(f'/service/fileupload/{sha1}').status_code == 201
@@ -0,0 +1,169 @@
+"""
+The testing of the asynchronous serving mode, driving the ASGI application directly
+"""
+
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("multipart")
+
+from app import admission, database_uri
+from fileupload.asgi import AsyncFileUpload
+
+FILE_CONTENT = b"asynctesting" * 100000
+BOUNDARY = "testingboundary"
+
+
+def multipart(content, file_name):
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="upfile"; filename="{file_name}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + content + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def request(application, method, path, body=b"", query=b"", content_type=f"multipart/form-data; boundary={BOUNDARY}"):
+    """
+    Sends one request to an ASGI application, the body in pieces like a slow client
+
+    return -- The status and the JSON body of the response
+    """
+    pieces = [body[start:start + 65536] for start in range(0, len(body), 65536)] or [b""]
+    messages = [
+        {"type": "http.request", "body": piece, "more_body": index < len(pieces) - 1}
+        for index, piece in enumerate(pieces)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "http_version": "1.1", "method": method, "path": path, "root_path": "",
+        "query_string": query, "headers": [(b"content-type", content_type.encode())],
+        "server": ("testserver", 80), "client": ("127.0.0.1", 1234), "scheme": "http",
+    }
+    asyncio.get_event_loop().run_until_complete(application(scope, receive, send))
+
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+
+    return sent[0]["status"], json.loads(body) if body else None
+
+
+def test_async_upload(test_client):
+    """
+    Testing the native streamed upload, the claimed hash verification and the delegation to the WSGI application
+    """
+    from app_docker import connex_app
+    from fileupload.views import fileupload
+
+    application = AsyncFileUpload(connex_app.app, fileupload, database_uri())
+    sha1 = hashlib.sha1(FILE_CONTENT).hexdigest()
+
+    status, _ = request(application, "POST", "/service/fileupload", multipart(FILE_CONTENT, "async.txt"),
+                        query=f"sha1={'f' * 40}".encode())
+    assert status == 422
+
+    status, data = request(application, "POST", "/service/fileupload", multipart(FILE_CONTENT, "async.txt"),
+                           query=f"sha1={sha1}".encode())
+    assert status == 201
+    assert data["sha1"] == sha1
+    assert data["size"] == len(FILE_CONTENT)
+
+    status, data = request(application, "GET", f"/service/fileupload/{sha1}")
+    assert status == 200
+    assert data["file_name"] == "async.txt"
+
+    status, _ = request(application, "DELETE", f"/service/fileupload/{sha1}")
+    assert status == 201
+
+    asyncio.get_event_loop().run_until_complete(application.pool.close())
+
+
+def test_async_admission(monkeypatch):
+    """
+    Testing that the native uploads are shed at once, with Retry-After, when the worker is busy
+    """
+    from app_docker import connex_app
+    from fileupload.views import fileupload
+
+    application = AsyncFileUpload(connex_app.app, fileupload, database_uri())
+    monkeypatch.setattr(admission.ADMISSION, "max_concurrent", 1)
+    ticket = admission.ADMISSION.admit()
+
+    try:
+        status, data = request(application, "PUT", "/service/fileupload/sessions/1/chunks/0", b"chunk",
+                               content_type="application/octet-stream")
+    finally:
+        admission.ADMISSION.release(ticket)
+
+    assert status == 429
+    assert data["detail"] == "Too many uploads in progress!"
+    assert admission.ADMISSION.stats()["running"] == 0
+
+
+def test_async_unknown_length(monkeypatch):
+    """
+    Testing that an upload without Content-Length is shed with 411 when the body size is limited,
+    before its body is read
+    """
+    from app_docker import connex_app
+    from fileupload.views import fileupload
+
+    application = AsyncFileUpload(connex_app.app, fileupload, database_uri())
+    monkeypatch.setattr(admission.ADMISSION, "max_body_size", 1000)
+    content = b"x" * 1200000
+
+    status, data = request(application, "POST", "/service/fileupload", multipart(content, "unknown.txt"))
+    assert status == 411
+    assert data["detail"] == "The Content-Length of the upload is required!"
+
+    status, data = request(application, "GET", f"/service/fileupload/{hashlib.sha1(content).hexdigest()}")
+    assert status == 404
+
+
+def test_async_delegated_admission(monkeypatch):
+    """
+    Testing that the uploads delegated to the WSGI application are shed before their body is read,
+    and admitted once when they run
+    """
+    from app_docker import connex_app
+    from fileupload.views import fileupload
+
+    application = AsyncFileUpload(connex_app.app, fileupload, database_uri())
+    monkeypatch.setattr(admission.ADMISSION, "max_concurrent", 1)
+    ticket = admission.ADMISSION.admit()
+    received = []
+
+    async def receive():
+        received.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    sent = []
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "POST", "path": "/service/fileupload/batch", "root_path": "",
+        "query_string": b"", "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())],
+        "server": ("testserver", 80), "client": ("127.0.0.1", 1234), "scheme": "http",
+    }
+
+    try:
+        asyncio.get_event_loop().run_until_complete(application(scope, receive, send))
+    finally:
+        admission.ADMISSION.release(ticket)
+
+    assert sent[0]["status"] == 429
+    assert not received
+
+    status, data = request(application, "POST", "/service/fileupload/sessions/unknown/complete",
+                           content_type="application/json")
+    assert status == 404
+    assert admission.ADMISSION.stats()["running"] == 0
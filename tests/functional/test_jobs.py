@@ -0,0 +1,115 @@
+"""
+The testing of the background jobs, queued by the uploads and run by a worker
+"""
+
+import io
+import hashlib
+
+from app.config import connex_app
+from fileupload.jobs import JobQueue, Worker
+from fileupload.models import FileMetadata, Job
+from fileupload.views import fileupload
+
+FILE_CONTENT = b"jobtesting\n" * 100
+FILE_HASH = hashlib.sha1(FILE_CONTENT).hexdigest()
+
+
+def run_jobs(handlers, queue=None):
+    with connex_app.app.app_context():
+        return Worker(queue or fileupload.jobs, handlers, name="test").run_once()
+
+
+def test_upload_queues_analysis(test_client):
+    """
+    Testing that an upload queues the analysis of its file, and that a worker fills in its metadata
+    """
+    response = test_client.post('/service/fileupload', data={"upfile": (io.BytesIO(FILE_CONTENT), 'job.txt')})
+    assert response.status_code == 201
+    assert response.get_json()["analyzed_at"] is None
+
+    jobs = test_client.get(f'/service/fileupload/{FILE_HASH}/jobs').get_json()
+    assert [(job["kind"], job["status"], job["attempts"]) for job in jobs] == [("analyze", "queued", 0)]
+
+    assert run_jobs({"analyze": fileupload.analyze_file}) >= 1
+
+    jobs = test_client.get(f'/service/fileupload/{FILE_HASH}/jobs').get_json()
+    assert [(job["status"], job["attempts"]) for job in jobs] == [("done", 1)]
+
+    data = test_client.get(f'/service/fileupload/{FILE_HASH}').get_json()
+    assert data["analyzed_at"] is not None
+    assert data["encoding"] == "us-ascii"
+    assert "text" in data["description"].lower()
+
+
+def test_failed_job_is_retried(test_client):
+    """
+    Testing that a failing job is queued again with its error, then failed after its last attempt
+    """
+    response = test_client.post('/service/fileupload', data={"upfile": (io.BytesIO(FILE_CONTENT), 'retry.txt')})
+    assert response.status_code == 201
+
+    def broken(file_id):
+        raise ValueError("analysis failed")
+
+    queue = JobQueue(retry_delay=0)
+    assert run_jobs({"analyze": broken}, queue) >= 1
+
+    job = test_client.get(f'/service/fileupload/{FILE_HASH}/jobs').get_json()[-1]
+    assert (job["status"], job["attempts"], job["last_error"]) == ("queued", 1, "analysis failed")
+
+    for _ in range(job["max_attempts"] - 1):
+        run_jobs({"analyze": broken}, queue)
+
+    job = test_client.get(f'/service/fileupload/{FILE_HASH}/jobs').get_json()[-1]
+    assert (job["status"], job["attempts"]) == ("failed", job["max_attempts"])
+
+    assert test_client.get('/service/fileupload/ffffffffffffffffffffffffffffffffffffffff/jobs').status_code == 404
+
+    for _ in range(2):
+        assert test_client.delete(f'/service/fileupload/{FILE_HASH}').status_code == 201
+
+
+STORED_CONTENT = b"storedtesting\n" * 100
+STORED_HASH = hashlib.sha1(STORED_CONTENT).hexdigest()
+
+
+def test_analysis_queued_after_storage(test_client, monkeypatch):
+    """
+    Testing that the analysis of a file is only queued once its content is stored, so no worker reads it before
+    """
+    queued = []
+    save_to_host = fileupload.save_to_host
+
+    def store(sha1, *args):
+        queued.append(Job.query.join(FileMetadata, Job.file_id == FileMetadata.id)
+                      .filter(FileMetadata.sha1 == sha1).count())
+        return save_to_host(sha1, *args)
+
+    monkeypatch.setattr(fileupload, "save_to_host", store)
+
+    response = test_client.post('/service/fileupload', data={"upfile": (io.BytesIO(STORED_CONTENT), 'stored.txt')})
+    assert response.status_code == 201
+    assert queued == [0]
+
+    jobs = test_client.get(f'/service/fileupload/{STORED_HASH}/jobs').get_json()
+    assert [(job["kind"], job["status"]) for job in jobs] == [("analyze", "queued")]
+
+    assert test_client.delete(f'/service/fileupload/{STORED_HASH}').status_code == 201
+
+
+def test_periodic_tasks():
+    """
+    Testing that the periodic tasks of a worker run when they are due, a failure does not stop the worker
+    """
+    runs = []
+
+    def failing():
+        raise RuntimeError("Task failure")
+
+    worker = Worker(fileupload.jobs, {}, name="test", tasks={"count": (3600, lambda: runs.append(1)),
+                                                              "failing": (0, failing)})
+
+    worker.run_tasks()
+    worker.run_tasks()
+
+    assert runs == [1]
@@ -0,0 +1,104 @@
+"""
+The testing of the consistency scrubber of the storage and the database
+"""
+
+import io
+import hashlib
+import json
+
+from app.config import connex_app
+from fileupload.models import FileBlob, FileMetadata, db
+from fileupload.scrub import Scrubber
+from fileupload.views import fileupload
+
+CONTENTS = {
+    "missing": b"scrubtesting missing\n" * 10,
+    "orphan": b"scrubtesting orphan\n" * 10,
+    "ref_count": b"scrubtesting ref_count\n" * 10,
+    "corrupt": b"scrubtesting corrupt\n" * 10,
+}
+HASHES = {issue: hashlib.sha1(content).hexdigest() for issue, content in CONTENTS.items()}
+
+
+def scrub(**kwargs):
+    report = io.StringIO()
+
+    with connex_app.app.app_context():
+        counts = Scrubber(fileupload.storage, verify=True, grace_period=0, report=report, **kwargs).run()
+
+    findings = [json.loads(line) for line in report.getvalue().splitlines()]
+    return counts, {finding["sha1"]: finding for finding in findings if finding["sha1"] in HASHES.values()}
+
+
+def test_scrub_and_repair(test_client, tmpdir):
+    """
+    Testing that the inconsistencies left by crashes are reported, then repaired
+    """
+    for issue in ["missing", "ref_count", "corrupt"]:
+        response = test_client.post('/service/fileupload', data={"upfile": (io.BytesIO(CONTENTS[issue]), 'scrub.txt')})
+        assert response.status_code == 201
+
+    staging = tmpdir.join("orphan")
+    staging.write_binary(CONTENTS["orphan"])
+    fileupload.storage.put(str(staging), HASHES["orphan"])
+    fileupload.storage.delete(HASHES["missing"])
+
+    with open(fileupload.storage.local_path(HASHES["corrupt"]), "wb") as blob:
+        blob.write(b"scrubtesting corrupted\n")
+
+    with connex_app.app.app_context():
+        FileBlob.query.filter(FileBlob.sha1 == HASHES["ref_count"]).update({FileBlob.ref_count: 5})
+        db.session.commit()
+
+    counts, findings = scrub()
+    assert {sha1: finding["issues"] for sha1, finding in findings.items()} == {
+        HASHES["missing"]: ["missing"],
+        HASHES["orphan"]: ["orphan"],
+        HASHES["ref_count"]: ["ref_count"],
+        HASHES["corrupt"]: ["corrupt"],
+    }
+    assert findings[HASHES["corrupt"]]["actual"]["size"] == len(b"scrubtesting corrupted\n")
+    assert counts["verified"] >= 1
+    assert not any(finding["repaired"] for finding in findings.values())
+
+    # The lookups cache the files that the repair deletes
+    assert test_client.get(f'/service/fileupload/{HASHES["missing"]}').status_code == 200
+
+    counts, findings = scrub(repair=True, cache=fileupload.cache)
+    assert len(findings) == 4
+    assert [row["file_name"] for row in findings[HASHES["missing"]]["deleted"]] == ["scrub.txt"]
+    assert findings[HASHES["corrupt"]]["quarantined"].endswith(HASHES["corrupt"])
+    assert test_client.get(f'/service/fileupload/{HASHES["missing"]}').status_code == 404
+
+    assert scrub()[1] == {}
+
+    with connex_app.app.app_context():
+        assert FileBlob.query.get(HASHES["ref_count"]).ref_count == 1
+        assert FileMetadata.query.filter(FileMetadata.sha1.in_([HASHES["missing"], HASHES["corrupt"]])).count() == 0
+    assert not fileupload.storage.exists(HASHES["orphan"])
+    assert not fileupload.storage.exists(HASHES["corrupt"])
+
+    assert test_client.delete(f'/service/fileupload/{HASHES["ref_count"]}').status_code == 201
+
+
+def test_scrub_resume(test_client, tmpdir):
+    """
+    Testing that a scrub resumes after its checkpoint, and removes it once done
+    """
+    response = test_client.post('/service/fileupload', data={"upfile": (io.BytesIO(CONTENTS["missing"]), 'scrub.txt')})
+    assert response.status_code == 201
+
+    checkpoint = tmpdir.join("scrub.json")
+    checkpoint.write(json.dumps({"after": HASHES["missing"], "counts": {"scanned": 1000}}))
+
+    report = io.StringIO()
+    with connex_app.app.app_context():
+        counts = Scrubber(fileupload.storage, checkpoint=str(checkpoint), report=report, page_size=1).run(resume=True)
+
+    with connex_app.app.app_context():
+        after = FileBlob.query.filter(FileBlob.sha1 > HASHES["missing"]).count()
+
+    assert counts["scanned"] == 1000 + after
+    assert not checkpoint.exists()
+
+    assert test_client.delete(f'/service/fileupload/{HASHES["missing"]}').status_code == 201
@@ -0,0 +1,123 @@
+"""
+The testing of the admission control of the uploads
+"""
+
+import threading
+
+import pytest
+
+from app.admission import Admission, NodeSlots, Rejected, body_length, create_admission
+
+
+def test_size_and_disk_limits(tmp_path):
+    """
+    Testing that a body over the size limit is shed with 413, and one that would fill a disk with 503
+    """
+    admission = Admission(max_body_size=100, min_free_bytes=1, paths=(str(tmp_path),))
+
+    with pytest.raises(Rejected) as e:
+        admission.admit(101)
+    assert e.value.status == 413
+    assert e.value.headers() == {}
+
+    admission.release(admission.admit(100))
+
+    admission.min_free_bytes = 1 << 60
+    with pytest.raises(Rejected) as e:
+        admission.admit(100)
+    assert e.value.status == 503
+    assert e.value.headers() == {"Retry-After": "5"}
+    assert e.value.problem()["title"] == "Service Unavailable"
+
+    assert admission.stats() == dict(admitted=1, rejected_size=1, rejected_disk=1, rejected_worker=0,
+                                     rejected_node=0, running=0, waiting=0)
+
+
+def test_unknown_length(tmp_path):
+    """
+    Testing that a body without Content-Length is shed with 411 when its size is limited, and that the
+    session completions, without body, are admitted
+    """
+    admission = Admission(max_body_size=100, min_free_bytes=1, paths=(str(tmp_path),))
+
+    with pytest.raises(Rejected) as e:
+        admission.admit(body_length("upload_file", None))
+    assert e.value.status == 411
+    assert e.value.problem()["title"] == "Length Required"
+
+    admission.release(admission.admit(body_length("complete_session", None)))
+
+    admission.max_body_size = 0
+    admission.release(admission.admit(None))
+
+    assert admission.stats() == dict(admitted=2, rejected_size=1, rejected_disk=0, rejected_worker=0,
+                                     rejected_node=0, running=0, waiting=0)
+
+
+def test_worker_limit_and_queue():
+    """
+    Testing that the uploads over the limit of the worker wait for a slot, then are shed with 429
+    """
+    admission = Admission(max_concurrent=1, min_free_bytes=0, queue_timeout=0.05)
+    ticket = admission.admit(10)
+
+    with pytest.raises(Rejected) as e:
+        admission.admit(10, wait=False)
+    assert e.value.status == 429
+
+    with pytest.raises(Rejected):
+        admission.admit(10)
+
+    admission.queue_timeout = 5
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(admission.admit(10)))
+    waiter.start()
+
+    while admission.stats()["waiting"] == 0:
+        pass
+
+    admission.release(ticket)
+    waiter.join()
+    admission.release(admitted[0])
+
+    assert admission.stats() == dict(admitted=2, rejected_size=0, rejected_disk=0, rejected_worker=2,
+                                     rejected_node=0, running=0, waiting=0)
+
+
+def test_node_limit(tmp_path):
+    """
+    Testing that the slots of the node are shared through lock files, freed when released
+    """
+    slots = str(tmp_path / "slots")
+    first = Admission(max_node_concurrent=1, min_free_bytes=0, slots_dir=slots)
+    second = Admission(max_node_concurrent=1, min_free_bytes=0, slots_dir=slots)
+    ticket = first.admit()
+
+    with pytest.raises(Rejected) as e:
+        second.admit()
+    assert e.value.reason == "node"
+    assert second.stats()["running"] == 0
+
+    first.release(ticket)
+    second.release(second.admit())
+
+    assert NodeSlots(slots, 2).acquire() is not None
+
+
+def test_create_admission():
+    """
+    Testing the configuration by the env variables, 0 disables a limit
+    """
+    admission = create_admission({"UPLOAD_MAX_CONCURRENT": "0", "UPLOAD_MAX_BODY_SIZE": "1024",
+                                  "UPLOAD_MIN_FREE_BYTES": "0", "DATA_DIR": "/data", "UPLOAD_RETRY_AFTER": "30"})
+
+    assert admission.max_concurrent == 0
+    assert admission.max_body_size == 1024
+    assert admission.node_slots is None
+    assert admission.paths[0] == "/data"
+    assert admission.retry_after == 30
+
+    tickets = [admission.admit(1024) for _ in range(100)]
+    assert admission.stats()["running"] == 100
+    for ticket in tickets:
+        admission.release(ticket)
@@ -0,0 +1,115 @@
+"""
+The testing for the metadata cache, the shared tier runs against an in-memory stand-in
+"""
+
+from fileupload.cache import MetadataCache
+
+
+class FakeRedis:
+    """
+    The subset of the Redis client used by the shared tier
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode()
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+
+def test_lru_eviction_and_ttl():
+    """
+    Testing that the local tier is bounded, expires its entries and counts hits and misses
+    """
+    cache = MetadataCache(max_size=2, ttl=60)
+
+    assert cache.get("a", lambda: {"file_name": "a"}) == {"file_name": "a"}
+    assert cache.get("a", lambda: None) == {"file_name": "a"}
+    cache.set("b", {"file_name": "b"})
+    cache.set("c", {"file_name": "c"})
+
+    assert cache.get("a") is None
+    assert cache.stats() == dict(hits=1, shared_hits=0, misses=2, evictions=1, shared_errors=0, stale_loads=0,
+                                 size=2)
+
+    cache.ttl = -1
+    cache.set("d", {"file_name": "d"})
+    assert cache.get("d") is None
+
+
+def test_shared_tier_and_invalidation():
+    """
+    Testing that the workers share their entries and that an invalidation reaches both tiers
+    """
+    shared = FakeRedis()
+    worker1 = MetadataCache(shared=shared)
+    worker2 = MetadataCache(shared=shared)
+
+    worker1.get("a", lambda: {"file_name": "a"})
+    assert worker2.get("a", lambda: None) == {"file_name": "a"}
+    assert worker2.stats()["shared_hits"] == 1
+
+    worker2.invalidate("a")
+    assert worker2.get("a") is None
+    assert shared.values == {"fileupload:metadata:a": b"null"}
+
+
+def test_load_overlapping_invalidation():
+    """
+    Testing that a load which read the value before an invalidation does not cache it, in either tier
+    """
+    cache = MetadataCache()
+
+    def load_before_update():
+        cache.invalidate("a")
+        return {"file_name": "old"}
+
+    assert cache.get("a", load_before_update) == {"file_name": "old"}
+    assert cache.get("a") is None
+    assert cache.get("a", lambda: {"file_name": "new"}) == {"file_name": "new"}
+    assert cache.get("a") == {"file_name": "new"}
+
+    shared = FakeRedis()
+    worker1 = MetadataCache(shared=shared)
+    worker2 = MetadataCache(shared=shared)
+
+    def load_before_remote_update():
+        worker2.invalidate("b")
+        return {"file_name": "old"}
+
+    assert worker1.get("b", load_before_remote_update) == {"file_name": "old"}
+    assert worker1.get("b") is None
+    assert worker2.get("b") is None
+    assert worker1.stats()["stale_loads"] == 1
+
+
+def test_shared_tier_errors():
+    """
+    Testing that an unreachable shared tier falls back to the loader
+    """
+    class Unreachable:
+        def get(self, *args, **kwargs):
+            raise ConnectionError
+
+        set = delete = get
+
+    cache = MetadataCache(shared=Unreachable())
+
+    assert cache.get("a", lambda: {"file_name": "a"}) == {"file_name": "a"}
+    assert cache.stats()["shared_errors"] == 2
@@ -0,0 +1,73 @@
+"""
+The testing for the parallel hashing engine and its tree hashes
+"""
+
+import hashlib
+
+from fileupload.hashing import MultiHasher, TreeHash, hash_path, PARALLEL_MIN_SIZE
+from fileupload.ingest import StreamIngest
+
+CONTENT = bytes(range(256)) * 4099
+
+
+def tree(content, chunk_size):
+    chunks = [hashlib.blake2b(content[start:start + chunk_size], digest_size=32).digest()
+              for start in range(0, len(content), chunk_size)] or [hashlib.blake2b(digest_size=32).digest()]
+
+    return hashlib.blake2b(b"".join(chunks), digest_size=32).hexdigest(), b"".join(chunks)
+
+
+def test_parallel_and_serial_digests_match(tmpdir):
+    """
+    Testing that the streamed, the threaded and the memory-mapped digests are the same as hashlib's
+    """
+    path = str(tmpdir.join("content"))
+    with open(path, "wb") as file:
+        file.write(CONTENT)
+
+    expected = dict(
+        md5=hashlib.md5(CONTENT).hexdigest(),
+        sha1=hashlib.sha1(CONTENT).hexdigest(),
+        tree_hash=tree(CONTENT, 65536)[0],
+        chunk_hashes=tree(CONTENT, 65536)[1],
+        tree_chunk_size=65536,
+    )
+
+    for threads in (1, 4):
+        hasher = MultiHasher(tree_chunk_size=65536, threads=threads)
+        for start in range(0, len(CONTENT), PARALLEL_MIN_SIZE + 1000):
+            hasher.update(CONTENT[start:start + PARALLEL_MIN_SIZE + 1000])
+
+        assert hasher.digests() == expected
+        assert hash_path(path, tree_chunk_size=65536, threads=threads) == expected
+
+
+def test_tree_hash_boundaries(tmpdir):
+    """
+    Testing the tree hash of an empty file and of a file made of whole chunks
+    """
+    empty = str(tmpdir.join("empty"))
+    open(empty, "wb").close()
+
+    assert hash_path(empty, tree_chunk_size=1024)["tree_hash"] == tree(b"", 1024)[0]
+
+    content = CONTENT[:4096]
+    tree_hash = TreeHash(1024)
+    tree_hash.update(content[:1000])
+    tree_hash.update(content[1000:])
+
+    assert len(tree_hash.chunk_digests()) == 4
+    assert tree_hash.root() == tree(content, 1024)[0]
+
+
+def test_ingest_tree_hash(tmpdir):
+    """
+    Testing that the ingest reports the tree hash when it is enabled
+    """
+    with StreamIngest(str(tmpdir), tree_chunk_size=65536) as stream:
+        stream.feed(CONTENT)
+        metadata = stream.finish()
+
+    assert metadata["file_tree_hash"] == tree(CONTENT, 65536)[0]
+    assert metadata["file_chunk_hashes"] == tree(CONTENT, 65536)[1]
+    assert metadata["tree_chunk_size"] == 65536
@@ -0,0 +1,72 @@
+"""
+The testing for the streaming ingest unit
+"""
+
+import io
+import hashlib
+import os.path as op
+
+import pytest
+
+from fileupload.ingest import StreamIngest, ContentMismatch, commit
+
+
+def test_single_pass_ingest(tmpdir):
+    """
+    Testing that a single read of the stream yields the hashes, the size, the header and the staged content
+    """
+    content = b"testingtesting" * 1000
+
+    with StreamIngest(str(tmpdir), block_size=4096, header_size=16) as stream:
+        stream.consume(io.BytesIO(content))
+        metadata = stream.finish()
+
+    assert metadata["file_size"] == len(content)
+    assert metadata["file_md5"] == hashlib.md5(content).hexdigest()
+    assert metadata["file_sha1"] == hashlib.sha1(content).hexdigest()
+    assert bytes(stream.header) == content[:16]
+
+    file_path = op.join(str(tmpdir), "final")
+    commit(stream.path, file_path)
+
+    assert not op.exists(stream.path)
+    with open(file_path, "rb") as file:
+        assert file.read() == content
+
+
+def test_discard_on_error(tmpdir):
+    """
+    Testing that the staging file is removed when the ingest fails
+    """
+    try:
+        with StreamIngest(str(tmpdir)) as stream:
+            stream.feed(b"testing")
+            raise IOError("Connection dropped")
+    except IOError:
+        pass
+
+    assert not op.exists(stream.path)
+
+
+def test_claimed_mismatch(tmpdir):
+    """
+    Testing that a stream longer than its claimed size is abandoned early and that the claimed hashes are verified
+    """
+    content = b"testingtesting" * 1000
+    stream = io.BytesIO(content)
+
+    with pytest.raises(ContentMismatch):
+        with StreamIngest(str(tmpdir), block_size=4096, claimed={"file_size": 100}) as ingest:
+            ingest.consume(stream)
+
+    assert stream.tell() == 4096
+    assert not op.exists(ingest.path)
+
+    with pytest.raises(ContentMismatch):
+        with StreamIngest(str(tmpdir), claimed={"file_sha1": hashlib.sha1(b"testing").hexdigest()}) as ingest:
+            ingest.consume(io.BytesIO(content))
+            ingest.finish()
+
+    with StreamIngest(str(tmpdir), claimed={"file_md5": hashlib.md5(content).hexdigest().upper()}) as ingest:
+        ingest.consume(io.BytesIO(content))
+        assert ingest.finish()["file_size"] == len(content)
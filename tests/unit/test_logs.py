@@ -0,0 +1,78 @@
+"""
+The testing for the queue logging pipeline and its JSON output
+"""
+
+import json
+import logging
+import os
+
+from app import logs
+
+
+class Recorder(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logs.JsonFormatter())
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class Counted:
+    """
+    An argument counting how many times it is formatted
+    """
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "counted"
+
+
+def test_queue_formats_in_listener():
+    """
+    Testing that the records are formatted once by the listener, and that disabled levels are never formatted
+    """
+    root = logging.getLogger()
+    saved_handlers, saved_level, saved_listener = root.handlers[:], root.level, logs.listener
+    recorder = Recorder()
+    argument = Counted()
+
+    root.handlers = [recorder]
+    root.setLevel(logging.INFO)
+
+    try:
+        logs.start_queue({"LOG_QUEUE": "1"})
+        assert isinstance(root.handlers[0], logs.LazyQueueHandler)
+
+        logging.getLogger("fileupload").debug("Skipped %s", argument)
+        logging.getLogger("fileupload").info("File uploaded! %s", logs.Fields({"sha1": "ab", "size": 3}))
+        logs.stop_queue()
+    finally:
+        root.handlers, root.level, logs.listener = saved_handlers, saved_level, saved_listener
+
+    assert argument.formatted == 0
+    assert len(recorder.lines) == 1
+
+    entry = json.loads(recorder.lines[0])
+    assert entry["message"] == "File uploaded! sha1: ab / size: 3"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "fileupload"
+    assert entry["process"] == os.getpid()
+
+
+def test_file_names_and_format():
+    """
+    Testing the per process file names and the switch of every handler to the json formatter
+    """
+    assert logs.file_name("/logs", "info.log", {"LOG_PER_PROCESS": "0"}) == "/logs/info.log"
+    assert logs.file_name("/logs", "info.log", {}) == f"/logs/info.{os.getpid()}.log"
+
+    config = {"formatters": {"out": {}, "json": {}}, "handlers": {"console": {"formatter": "out"}}}
+
+    assert logs.configure(config, {})["handlers"]["console"]["formatter"] == "out"
+    assert logs.configure(config, {"LOG_FORMAT": "json"})["handlers"]["console"]["formatter"] == "json"
@@ -1,14 +1,40 @@
-"""
-The testing for the Model unit
-"""
-
-from fileupload.models import FileMetadata
-
-
-def test_new_file(new_file):
-    assert isinstance(new_file.size, str)
-    assert isinstance(new_file.file_name, str)
-    assert isinstance(new_file.sha1, str)
-    assert isinstance(new_file.md5, str)
-    assert isinstance(new_file.type, str)
-
+"""
+The testing for the Model unit
+"""
+
+import datetime
+import json
+
+from fileupload import serialize
+from fileupload.models import FileMetadata, FileMetadataSchema
+
+
+def test_new_file(new_file):
+    assert isinstance(new_file.size, int)
+    assert isinstance(new_file.file_name, str)
+    assert isinstance(new_file.sha1, str)
+    assert isinstance(new_file.md5, str)
+    assert isinstance(new_file.type, str)
+
+
+def test_serialize():
+    """
+    Testing that the fast serialization is the same as the dump of the schema without the id
+    """
+    new_file = FileMetadata(
+        id=1,
+        size=5242880,
+        file_name='new_file',
+        sha1='ffffffffffffffffffffffffffffffffffffffff',
+        md5='ffffffffffffffffffffffffffffffff',
+        type='unknown/unknown',
+        analyzed_at=datetime.datetime(2019, 10, 1, 12, 30, tzinfo=datetime.timezone.utc),
+        chunk_hashes=b"\x00" * 32,
+    )
+
+    expected = FileMetadataSchema().dump(new_file)
+    expected.pop("id")
+
+    assert serialize.dump_file(new_file) == expected
+    assert serialize.dump([getattr(new_file, column.key) for column in serialize.COLUMNS]) == expected
+    assert json.loads(serialize.dumps([expected])) == [expected]
@@ -0,0 +1,48 @@
+"""
+Testing for the connection pool of the database engine
+"""
+
+import os
+
+from sqlalchemy import create_engine
+
+from app import database_uri
+from app.pool import MeteredQueuePool, engine_options, asyncpg_options
+
+
+def test_engine_options():
+    """
+    Testing the pool settings read from the environment, and the PgBouncer mode
+    """
+    options = engine_options({"DB_POOL_SIZE": "3", "DB_STATEMENT_TIMEOUT": "5000"})
+
+    assert options["poolclass"] is MeteredQueuePool
+    assert options["pool_size"] == 3
+    assert options["pool_pre_ping"]
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+    assert asyncpg_options({"DB_PGBOUNCER": "1"}) == {"statement_cache_size": 0}
+
+
+def test_pool_metrics_and_fork():
+    """
+    Testing the checkout metrics and that a connection opened by another process is never reused
+    """
+    engine = create_engine(database_uri(), **engine_options({"DB_POOL_SIZE": "1", "DB_STATEMENT_TIMEOUT": "5000"}))
+
+    with engine.connect() as conn:
+        assert conn.execute("SHOW statement_timeout").scalar() == "5s"
+        assert engine.pool.stats()["checked_out"] == 1
+        first = conn.connection.connection
+
+    # The connection now looks like it was inherited from a parent process
+    record = engine.pool._pool.queue[0]
+    record.info["pid"] = os.getpid() + 1
+
+    with engine.connect() as conn:
+        assert conn.connection.connection is not first
+    first.close()
+
+    stats = engine.pool.stats()
+    assert stats["checkouts"] >= 2
+    assert stats["checked_out"] == 0
+    engine.dispose()
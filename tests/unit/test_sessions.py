@@ -0,0 +1,63 @@
+"""
+The testing for the resumable upload sessions unit
+"""
+
+import hashlib
+import os.path as op
+
+import pytest
+
+from fileupload.sessions import UploadSessions, ChunkConflict
+
+CONTENT = b"chunkedtesting" * 3
+CHUNK_SIZE = 16
+
+
+def chunk(index, content=CONTENT):
+    return content[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+
+def test_resent_chunk(tmpdir):
+    """
+    Testing that a chunk sent again is accepted with the same bytes and rejected with other bytes,
+    so the hashes of the session match its content
+    """
+    sessions = UploadSessions(str(tmpdir))
+    session_id = sessions.create("chunked.txt", len(CONTENT), CHUNK_SIZE)["session_id"]
+
+    for index in [0, 1, 0]:
+        assert sessions.write_chunk(session_id, index, chunk(index)) == {"offset": index * CHUNK_SIZE,
+                                                                         "length": CHUNK_SIZE}
+
+    with pytest.raises(ChunkConflict):
+        sessions.write_chunk(session_id, 0, chunk(1))
+
+    sessions.write_chunk(session_id, 2, chunk(2))
+    metadata, header = sessions.finalize(session_id, str(tmpdir.join("staging")))
+
+    assert metadata["file_sha1"] == hashlib.sha1(CONTENT).hexdigest()
+    assert tmpdir.join("staging").read_binary() == CONTENT
+
+
+def test_hashers_of_other_workers(tmpdir):
+    """
+    Testing that the hash state of a session finalized by another worker is dropped by the worker that kept it
+    """
+    worker1 = UploadSessions(str(tmpdir))
+    worker2 = UploadSessions(str(tmpdir))
+    session_id = worker1.create("chunked.txt", len(CONTENT), CHUNK_SIZE)["session_id"]
+
+    for index in range(3):
+        worker1.write_chunk(session_id, index, chunk(index))
+
+    assert session_id in worker1.hashers
+
+    metadata, header = worker2.finalize(session_id, str(tmpdir.join("staging")))
+    assert metadata["file_sha1"] == hashlib.sha1(CONTENT).hexdigest()
+    assert not op.exists(worker2.path(session_id))
+
+    # The next session started by the worker drops the states of the sessions that are gone
+    other_id = worker2.create("other.txt", len(CONTENT), CHUNK_SIZE)["session_id"]
+    worker1.write_chunk(other_id, 0, chunk(0))
+
+    assert list(worker1.hashers) == [other_id]
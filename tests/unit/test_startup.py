@@ -0,0 +1,55 @@
+"""
+The testing of the startup of the application, in a new interpreter so that nothing is imported yet
+"""
+
+import json
+import subprocess
+import sys
+
+SCRIPT = """
+import json, os, sys
+
+import app_docker
+from app import logs
+from app.config import db
+from fileupload.views import fileupload
+
+def state():
+    return dict(
+        pid=os.getpid(),
+        modules=[name for name in ("boto3", "flask_migrate", "sqlalchemy_utils") if name in sys.modules],
+        engines=len(db.engines),
+        magics=fileupload.magics_pid,
+        listener=logs.listener and logs.listener.pid,
+    )
+
+print(json.dumps(state()), flush=True)
+pid = os.fork()
+
+if pid == 0:
+    with app_docker.connex_app.app.test_client() as client:
+        listed = client.get("/service/fileupload?limit=1").status_code
+        checked = client.post("/service/fileupload/check", json={"sha1": "invalid"}).status_code
+    file_type = fileupload.extract_file_type(b"startup testing")
+    print(json.dumps(dict(state(), statuses=[listed, checked], file_type=file_type)), flush=True)
+    os._exit(0)
+
+os.waitpid(pid, 0)
+"""
+
+
+def test_import_opens_nothing():
+    """
+    Testing that importing the application opens no libmagic handle, no connection and no log listener,
+    and that a process forked after the import opens its own on first use
+    """
+    output = subprocess.run([sys.executable, "-c", SCRIPT], capture_output=True, check=True, text=True).stdout
+    parent, child = [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+
+    assert parent == dict(pid=parent["pid"], modules=[], engines=0, magics=None, listener=None)
+
+    assert child["statuses"] == [200, 403]
+    assert child["file_type"] == "text/plain"
+    assert child["engines"] == 1
+    assert child["magics"] == child["pid"]
+    assert child["listener"] == child["pid"]
@@ -0,0 +1,205 @@
+"""
+The testing for the storage backends, the S3 backend runs against a local S3-compatible stand-in
+"""
+
+import io
+import hashlib
+import os
+import threading
+
+import pytest
+
+from fileupload import compression
+from fileupload.packs import PackedStorage
+from fileupload.storage import LocalStorage, S3Storage
+
+PART_SIZE = 5242880
+CONTENT = b"a" * PART_SIZE + b"testingtesting"
+CONTENT_HASH = hashlib.sha1(CONTENT).hexdigest()
+
+
+@pytest.fixture(scope='module')
+def s3_endpoint():
+    """
+    Fixture for serving a local S3-compatible stand-in
+    """
+    server = pytest.importorskip("moto.server")
+    serving = pytest.importorskip("werkzeug.serving")
+
+    httpd = serving.make_server("127.0.0.1", 0, server.create_backend_app("s3"), threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{httpd.server_port}"
+
+    httpd.shutdown()
+
+
+@pytest.fixture(params=["local", "s3", "packed"])
+def storage(request, tmpdir, monkeypatch):
+    """
+    Fixture for creating a backend of every kind, only the S3 one is skipped without its stand-in
+    """
+    if request.param == "local":
+        return LocalStorage(str(tmpdir.join("blobs")))
+
+    if request.param == "packed":
+        return PackedStorage(str(tmpdir.join("packs")), LocalStorage(str(tmpdir.join("packed-blobs"))),
+                             max_file_size=2 * PART_SIZE)
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+
+    s3 = S3Storage("fileupload", prefix="blobs/", endpoint_url=request.getfixturevalue("s3_endpoint"),
+                   region="us-east-1", part_size=PART_SIZE, max_concurrency=2)
+    s3.client.create_bucket(Bucket="fileupload")
+
+    return s3
+
+
+def test_streaming_write_and_ranged_read(storage):
+    """
+    Testing that a content written from a stream can be read back by ranges
+    """
+    assert not storage.exists(CONTENT_HASH)
+    assert storage.local_path(CONTENT_HASH) is None
+
+    storage.write(CONTENT_HASH, io.BytesIO(CONTENT))
+
+    assert storage.exists(CONTENT_HASH)
+    assert storage.size(CONTENT_HASH) == len(CONTENT)
+    assert b"".join(storage.read(CONTENT_HASH)) == CONTENT
+    assert b"".join(storage.read(CONTENT_HASH, PART_SIZE - 2, 6)) == b"aatest"
+
+    assert storage.delete(CONTENT_HASH)
+    assert not storage.delete(CONTENT_HASH)
+
+
+def test_put_staging_file(storage, tmpdir):
+    """
+    Testing that a staging file is consumed, and not stored twice
+    """
+    for added in [True, False]:
+        staging = tmpdir.join("staging")
+        staging.write_binary(b"testingtesting")
+
+        assert storage.put(str(staging), hashlib.sha1(b"testingtesting").hexdigest()) == added
+        assert not staging.exists()
+
+
+def test_put_compressed(storage, tmpdir):
+    """
+    Testing that a compressed content is read back decompressed, and that an incompressible one is stored as is
+    """
+    codecs = [codec for codec in compression.CODECS if codec != "zstd" or compression.zstandard]
+
+    for codec in codecs:
+        staging = tmpdir.join("staging")
+        staging.write_binary(CONTENT)
+
+        assert storage.put(str(staging), CONTENT_HASH, codec)
+        assert storage.stat(CONTENT_HASH)[1] == codec
+        assert storage.size(CONTENT_HASH) < len(CONTENT) // 100
+        assert storage.local_path(CONTENT_HASH) is None
+        assert b"".join(storage.read(CONTENT_HASH)) == CONTENT
+        assert b"".join(storage.read(CONTENT_HASH, PART_SIZE - 2, 6)) == b"aatest"
+        assert b"".join(storage.read(CONTENT_HASH, PART_SIZE)) == b"testingtesting"
+
+        assert storage.delete(CONTENT_HASH)
+        assert not storage.exists(CONTENT_HASH)
+
+    random_content = os.urandom(65536)
+    staging = tmpdir.join("staging")
+    staging.write_binary(random_content)
+    random_hash = hashlib.sha1(random_content).hexdigest()
+
+    assert storage.put(str(staging), random_hash, "gzip")
+    assert storage.stat(random_hash) == (len(random_content), None)
+    assert storage.delete(random_hash)
+
+
+def test_packed_store(tmpdir):
+    """
+    Testing that the small contents are packed in segments and the large ones stored as blobs,
+    and that the compaction reclaims the deleted contents without moving the live ones out of reach
+    """
+    storage = PackedStorage(str(tmpdir.join("packs")), LocalStorage(str(tmpdir.join("blobs"))),
+                            max_file_size=100, segment_size=250)
+    contents = {hashlib.sha1(content).hexdigest(): content for content in (b"%02d" % i * 40 for i in range(10))}
+    large = b"large" * 100
+    large_hash = hashlib.sha1(large).hexdigest()
+
+    for sha1, content in contents.items():
+        storage.write(sha1, io.BytesIO(content))
+    storage.write(large_hash, io.BytesIO(large))
+
+    assert storage.stats()["segments"] == 4
+    assert storage.local_path(large_hash) is not None
+    assert [sha1 for sha1, _ in storage.list()] == sorted(list(contents) + [large_hash])
+    assert [sha1 for sha1, _ in storage.list(after=min(contents))] == sorted(list(contents) + [large_hash])[1:]
+
+    for sha1 in list(contents)[:6]:
+        assert storage.delete(sha1)
+        assert not storage.exists(sha1)
+        del contents[sha1]
+
+    assert storage.compact() == dict(segments=2, contents=0, moved_bytes=0, reclaimed_bytes=480)
+    assert storage.compact(min_garbage=0) == dict(segments=1, contents=3, moved_bytes=240, reclaimed_bytes=0)
+    assert sorted(os.listdir(str(tmpdir.join("packs"))))[:2] == ["00000004.pack", "00000005.pack"]
+
+    for sha1, content in contents.items():
+        assert storage.location(sha1).startswith(str(tmpdir.join("packs")))
+        assert b"".join(storage.read(sha1)) == content
+        assert b"".join(storage.read(sha1, 38, 4)) == content[38:42]
+    assert b"".join(storage.read(large_hash)) == large
+
+    assert storage.stats() == dict(contents=4, live_bytes=320, segments=2, segment_bytes=320, garbage_bytes=0)
+
+
+def test_compressible_types():
+    """
+    Testing that small contents and already compressed types are not compressed
+    """
+    assert compression.compressible("text/plain", 65536)
+    assert compression.compressible("image/svg+xml", 65536)
+    assert not compression.compressible("text/plain", 100)
+    assert not compression.compressible("image/jpeg", 65536)
+    assert not compression.compressible("application/zip", 65536)
+    assert not compression.compressible("application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+
+
+def test_compressing_reader():
+    """
+    Testing that a stream compressed while it is read, in reads of any size, decompresses to the content
+    """
+    content = b"testingtesting" * 200000
+    codecs = [codec for codec in compression.CODECS if codec != "zstd" or compression.zstandard]
+
+    for codec in codecs:
+        reader = compression.CompressingReader(io.BytesIO(content), codec, 65536)
+        blocks, sizes = [], [1, 5000, 100000]
+
+        while True:
+            block = reader.read(sizes[len(blocks) % 3])
+            if not block:
+                break
+            blocks.append(block)
+
+        assert (reader.size, reader.stored_size) == (len(content), sum(len(block) for block in blocks))
+        assert reader.stored_size < len(content) // 100
+        assert b"".join(compression.decompress(blocks, codec, 65536)) == content
+
+
+def test_bounded_decompression():
+    """
+    Testing that a highly compressed content is decompressed in blocks of bounded size
+    """
+    content = bytes(8388608)
+    codecs = [codec for codec in compression.CODECS if codec != "zstd" or compression.zstandard]
+
+    for codec in codecs:
+        compressed = compression.compress_bytes(content, codec)
+        blocks = list(compression.decompress([compressed], codec, 65536, 100))
+
+        assert max(len(block) for block in blocks) <= 65536
+        assert b"".join(blocks) == content[100:]
@@ -0,0 +1,68 @@
+"""
+The script running the background jobs of the files, such as their analysis.
+
+Any number of workers can run at the same time, on any node reaching the database.
+
+Examples:
+
+$ python worker.py
+-- Runs the jobs as they are queued, until SIGTERM or SIGINT
+
+$ python worker.py --once
+-- Runs the jobs that are ready and exits
+
+$ python worker.py --compact-interval 600
+-- Also compacts the packed store of the node every 10 minutes
+
+"""
+
+import argparse
+import os
+import signal
+
+from app.config import connex_app
+from fileupload.jobs import Worker, POLL_INTERVAL, BATCH_SIZE
+from fileupload.packs import COMPACT_INTERVAL, MIN_GARBAGE
+from fileupload.views import fileupload
+
+
+def main(args):
+    fileupload.init_logging()
+    tasks = {}
+
+    # The packed store of the node is compacted by one of its workers at a time
+    if hasattr(fileupload.storage, "compact") and args.compact_interval > 0:
+        tasks["compact"] = (args.compact_interval, lambda: dict(fileupload.storage.compact(args.min_garbage)))
+
+    worker = Worker(
+        fileupload.jobs,
+        {"analyze": fileupload.analyze_file},
+        poll_interval=args.poll_interval,
+        batch_size=args.batch_size,
+        tasks=tasks,
+    )
+
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+
+    with connex_app.app.app_context():
+        if args.once:
+            while worker.run_once() == args.batch_size:
+                pass
+        else:
+            worker.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="Exit once no job is ready")
+    parser.add_argument("--poll-interval", type=float, default=float(os.environ.get("JOB_POLL_INTERVAL", POLL_INTERVAL)),
+                        help="The seconds between two polls of an empty queue")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("JOB_BATCH_SIZE", BATCH_SIZE)),
+                        help="The number of jobs claimed at once")
+    parser.add_argument("--compact-interval", type=float,
+                        default=float(os.environ.get("PACK_COMPACT_INTERVAL", COMPACT_INTERVAL)),
+                        help="The seconds between two compactions of the packed store, 0 disables them")
+    parser.add_argument("--min-garbage", type=float, default=float(os.environ.get("PACK_MIN_GARBAGE", MIN_GARBAGE)),
+                        help="The garbage ratio from which a segment of the packed store is compacted")
+    main(parser.parse_args())